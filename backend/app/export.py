@@ -0,0 +1,107 @@
+"""Exportación de transacciones a Parquet para análisis fuera de la base de producción.
+
+Uso:
+    python -m app.export
+    python -m app.export --full --account cliente-42 --output-dir /data/exports
+    python -m app.export replay --account cliente-42 --sensitivity strict --report replay.json
+
+Sin subcomando exporta de forma incremental (filas nuevas desde la última marca de agua)
+todas las cuentas, o sólo `--account`; con `--full` reescribe las cuentas completas. Lee
+de la réplica si `DATABASE_READ_URL` está configurada. Ver `services.parquet_export`.
+
+`replay` carga el snapshot Parquet de una cuenta con memory mapping y repite el detector
+en orden cronológico sin tocar la base (`suspicious_detector.replay_history`).
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from app import models
+from app.database import ReadSessionLocal
+from app.services import accounts, parquet_export, suspicious_detector
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command")
+
+    replay_parser = sub.add_parser("replay", help="Repite el detector sobre el snapshot Parquet de una cuenta")
+    replay_parser.add_argument("--account", default=models.DEFAULT_ACCOUNT_ID,
+                               help="Cuenta a reproducir (como el header X-Account-Id)")
+    replay_parser.add_argument("--sensitivity", default=suspicious_detector.DEFAULT_SENSITIVITY,
+                               choices=sorted(suspicious_detector.SENSITIVITY_LEVELS))
+    replay_parser.add_argument("--input-dir", default=str(parquet_export.EXPORT_DIR),
+                               help="Directorio de la exportación")
+    replay_parser.add_argument("--report", default=None, help="Ruta para escribir el resultado en JSON")
+
+    parser.add_argument("--account", default=None, help="Exporta sólo esta cuenta (por defecto todas)")
+    parser.add_argument("--full", action="store_true",
+                        help="Reescribe todo en vez de agregar las filas nuevas (recoge ediciones y eliminaciones)")
+    parser.add_argument("--output-dir", default=str(parquet_export.EXPORT_DIR), help="Directorio de la exportación")
+    parser.add_argument("--batch-rows", type=int, default=parquet_export.EXPORT_BATCH_ROWS,
+                        help="Filas por lote leído de la base y por row group")
+    args = parser.parse_args(argv)
+
+    try:
+        account_id = accounts.normalize_account_id(args.account) if args.account else None
+    except accounts.InvalidAccount as e:
+        print(f"[Export] {str(e)}")
+        return 2
+
+    try:
+        if args.command == "replay":
+            return replay(account_id or models.DEFAULT_ACCOUNT_ID, args.sensitivity, Path(args.input_dir), args.report)
+        return export(account_id, args.full, Path(args.output_dir), args.batch_rows)
+    except parquet_export.ArrowUnavailable as e:
+        print(f"[Export] {str(e)}")
+        return 2
+
+
+def export(account_id: Optional[str], full: bool, output_dir: Path, batch_rows: int) -> int:
+    db = ReadSessionLocal()
+    try:
+        summary = parquet_export.export_expenses(db, account_id, full, output_dir, max(1, batch_rows))
+    finally:
+        db.close()
+    for account, result in sorted(summary["accounts"].items()):
+        held = ""
+        if result["held_from_id"] is not None:
+            held = f"; desde el id {result['held_from_id']} quedan para la próxima (margen de seguridad)"
+        if not result["rows"]:
+            print(f"  {account}: sin filas nuevas desde el id {result['since_id']}{held}")
+            continue
+        print(f"  {account}: {result['rows']} filas en {result['files']} archivos "
+              f"(ids {result['since_id'] + 1}-{result['last_id']}, meses {', '.join(result['months'])}){held}")
+    return 0
+
+
+def replay(account_id: str, sensitivity: str, input_dir: Path, report_path: Optional[str]) -> int:
+    started = time.perf_counter()
+    history = parquet_export.load_history(account_id, input_dir)
+    if not history:
+        print(f"[Export] No hay snapshot Parquet de la cuenta '{account_id}' en {input_dir}")
+        return 1
+    loaded = time.perf_counter() - started
+
+    result = suspicious_detector.replay_history(history, sensitivity)
+    result["account_id"] = account_id
+    result["timings"] = {
+        "load_seconds": round(loaded, 3),
+        "replay_seconds": round(time.perf_counter() - started - loaded, 3),
+    }
+    print(f"[Export] Replay de '{account_id}': {result['suspicious_count']} sospechosas de {result['total']} "
+          f"({result['changed']} distintas de las guardadas); carga {result['timings']['load_seconds']}s, "
+          f"detector {result['timings']['replay_seconds']}s")
+    if report_path:
+        Path(report_path).write_text(json.dumps(result, indent=2, ensure_ascii=False, default=str))
+        print(f"[Export] Reporte escrito en {report_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,308 @@
+"""Ingesta masiva de cartolas PDF desde un directorio.
+
+Uso:
+    python -m app.ingest /ruta/a/cartolas
+    python -m app.ingest /ruta/a/cartolas --workers 4 --recursive --report ingest-report.json
+    python -m app.ingest /ruta/a/cartolas --account cliente-42
+
+Cada PDF se extrae en un proceso separado con `openai_service.process_expense_pdf`
+(mismas rutas de parser de tablas / LLM y diccionario de comercios que el upload). Los
+archivos ya ingeridos en la cuenta se omiten por hash SHA-256 del contenido, así que la
+ingesta se puede relanzar sobre el mismo directorio. Las filas de cada archivo se insertan en
+bloque y el detector de sospechosas corre una sola vez al final, en orden cronológico,
+con el mismo trabajo de reproceso de `/expenses/reprocess-suspicious`.
+
+Los PDFs no se copian: `pdf_path` apunta a la cartola original, y la API sólo borra
+archivos dentro de su directorio de uploads, así que eliminar las transacciones no toca
+el directorio de origen. `DELETE /expenses/clear/all` olvida también los archivos
+ingeridos de la cuenta, de modo que se pueden volver a cargar.
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from app import models
+from app.database import SessionLocal, engine, run_migrations
+from app.services import accounts, charge_classifier, expense_store, merchant_dictionary, openai_service, reprocess_job, suspicious_detector
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="Directorio con los PDFs a ingerir")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="Procesos de extracción en paralelo")
+    parser.add_argument("--recursive", action="store_true", help="Incluye subdirectorios")
+    parser.add_argument("--account", default=models.DEFAULT_ACCOUNT_ID,
+                        help="Cuenta dueña de las transacciones (como el header X-Account-Id)")
+    parser.add_argument("--sensitivity", default=None, choices=sorted(suspicious_detector.SENSITIVITY_LEVELS),
+                        help="Por defecto, la configurada para la cuenta")
+    parser.add_argument("--skip-detection", action="store_true",
+                        help="No ejecuta el detector al final (se puede lanzar luego desde la API)")
+    parser.add_argument("--report", default=None, help="Ruta para escribir el resumen en JSON")
+    args = parser.parse_args(argv)
+
+    directory = Path(args.directory)
+    if not directory.is_dir():
+        print(f"[Ingest] {directory} no es un directorio")
+        return 2
+
+    try:
+        account_id = accounts.normalize_account_id(args.account)
+    except accounts.InvalidAccount as e:
+        print(f"[Ingest] {str(e)}")
+        return 2
+
+    report = run(directory, args.workers, args.recursive, args.sensitivity, args.skip_detection, account_id)
+    print_summary(report)
+    if args.report:
+        Path(args.report).write_text(json.dumps(report, indent=2, ensure_ascii=False, default=str))
+        print(f"[Ingest] Reporte escrito en {args.report}")
+    return 1 if report["files"]["failed"] else 0
+
+
+def run(
+    directory: Path,
+    workers: int,
+    recursive: bool,
+    sensitivity: Optional[str],
+    skip_detection: bool,
+    account_id: str = models.DEFAULT_ACCOUNT_ID,
+) -> Dict:
+    started = time.perf_counter()
+    run_migrations()
+
+    pattern = "**/*" if recursive else "*"
+    paths = sorted(p for p in directory.glob(pattern) if p.is_file() and p.suffix.lower() == ".pdf")
+    hashes = {path: file_hash(path) for path in paths}
+
+    db = SessionLocal()
+    try:
+        known = {
+            content_hash for (content_hash,) in db.query(models.IngestedFile.content_hash)
+            .filter(
+                models.IngestedFile.account_id == account_id,
+                models.IngestedFile.content_hash.in_(set(hashes.values())),
+            )
+            .all()
+        } if hashes else set()
+
+        pending: Dict[str, Path] = {}
+        skipped: List[str] = []
+        for path, content_hash in hashes.items():
+            # También se omiten copias idénticas dentro del mismo directorio
+            if content_hash in known or content_hash in pending:
+                skipped.append(str(path))
+            else:
+                pending[content_hash] = path
+
+        print(f"[Ingest] {len(paths)} PDFs encontrados, {len(skipped)} ya ingeridos, {len(pending)} por procesar con {workers} procesos")
+
+        processed: List[Dict] = []
+        failures: List[Dict] = []
+        insert_seconds = 0.0
+        extraction_started = time.perf_counter()
+
+        with ProcessPoolExecutor(max_workers=max(1, workers), initializer=_init_worker) as pool:
+            futures = {pool.submit(extract_file, str(path), account_id): content_hash for content_hash, path in pending.items()}
+            for index, future in enumerate(as_completed(futures), start=1):
+                content_hash = futures[future]
+                result = future.result()
+                if result["error"]:
+                    failures.append({"path": result["path"], "error": result["error"], "seconds": result["seconds"]})
+                    print(f"[Ingest] ({index}/{len(futures)}) ERROR {result['path']}: {result['error']}")
+                    continue
+
+                insert_started = time.perf_counter()
+                _store_result(db, result, content_hash, account_id)
+                insert_seconds += time.perf_counter() - insert_started
+                processed.append({k: v for k, v in result.items() if k != "transactions"})
+                print(
+                    f"[Ingest] ({index}/{len(futures)}) {result['path']}: {result['count']} transacciones "
+                    f"({result['extraction_path']}) en {result['seconds']:.1f}s"
+                )
+
+        extraction_seconds = time.perf_counter() - extraction_started
+        inserted = sum(item["count"] for item in processed)
+
+        detection: Dict = {"skipped": True}
+        if inserted and not skip_detection:
+            detection = _run_detection(db, sensitivity, account_id)
+    finally:
+        db.close()
+
+    file_seconds = [item["seconds"] for item in processed]
+    return {
+        "directory": str(directory),
+        "account_id": account_id,
+        "workers": workers,
+        "files": {
+            "found": len(paths),
+            "skipped": len(skipped),
+            "processed": len(processed),
+            "failed": len(failures),
+        },
+        "transactions": {
+            "inserted": inserted,
+            "duplicates_skipped": sum(item.get("duplicates_skipped", 0) for item in processed),
+            "by_path": _count_by(processed, "extraction_path"),
+        },
+        "timings": {
+            "total_seconds": round(time.perf_counter() - started, 3),
+            "extraction_wall_seconds": round(extraction_seconds, 3),
+            "per_file_avg_seconds": round(sum(file_seconds) / len(file_seconds), 3) if file_seconds else None,
+            "per_file_max_seconds": round(max(file_seconds), 3) if file_seconds else None,
+            "insert_seconds": round(insert_seconds, 3),
+            "detection_seconds": detection.get("seconds"),
+        },
+        "detection": detection,
+        "processed": processed,
+        "failures": failures,
+        "skipped": skipped,
+    }
+
+
+def extract_file(path: str, account_id: str = models.DEFAULT_ACCOUNT_ID) -> Dict:
+    """Se ejecuta en un proceso del pool: extrae y enriquece, sin detección ni escritura."""
+    started = time.perf_counter()
+    report: Dict = {}
+    db = SessionLocal()
+    try:
+        transactions = openai_service.process_expense_pdf(
+            path, merchant_lookup=lambda vendors: merchant_dictionary.lookup(db, vendors, account_id), report=report
+        )
+        error = None
+        if all(tx.get("analysis_method") == "failed" for tx in transactions):
+            error = transactions[0].get("description") if transactions else "Sin transacciones"
+    except Exception as e:
+        transactions, error = [], str(e)
+    finally:
+        db.close()
+
+    return {
+        "path": path,
+        "error": error,
+        "transactions": transactions if not error else [],
+        "count": len(transactions) if not error else 0,
+        "extraction_path": transactions[0].get("extraction_path", "failed") if transactions and not error else None,
+        "pages": report.get("pages"),
+        "peak_rss_mb": report.get("peak_rss_mb"),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def print_summary(report: Dict) -> None:
+    files = report["files"]
+    timings = report["timings"]
+    print()
+    print("Resumen de ingesta")
+    print(f"  Archivos:       {files['found']} encontrados, {files['processed']} procesados, "
+          f"{files['skipped']} omitidos (ya ingeridos), {files['failed']} con error")
+    print(f"  Transacciones:  {report['transactions']['inserted']} insertadas {report['transactions']['by_path']}, "
+          f"{report['transactions']['duplicates_skipped']} duplicadas omitidas")
+    if not report["detection"].get("skipped"):
+        print(f"  Detector:       {report['detection']['suspicious']} sospechosas de {report['detection']['total']} "
+              f"({report['detection']['status']})")
+    print(f"  Tiempos:        total {timings['total_seconds']}s, extracción {timings['extraction_wall_seconds']}s "
+          f"(promedio por archivo {timings['per_file_avg_seconds']}s, máx {timings['per_file_max_seconds']}s), "
+          f"inserción {timings['insert_seconds']}s, detector {timings['detection_seconds']}s")
+    for failure in report["failures"]:
+        print(f"  ERROR {failure['path']}: {failure['error']}")
+
+
+def _init_worker() -> None:
+    # Las conexiones heredadas del proceso padre no se deben reutilizar tras el fork
+    engine.dispose(close=False)
+
+
+def _store_result(db, result: Dict, content_hash: str, account_id: str) -> None:
+    filename = Path(result["path"]).name
+    expense_store.assign_fingerprints(result["transactions"])
+    rows = [
+        expense_store.expense_values(transaction, filename, result["path"], account_id)
+        for transaction in result["transactions"]
+    ]
+    try:
+        created = expense_store.insert_expenses(db, rows)
+        db.add(models.IngestedFile(
+            account_id=account_id,
+            content_hash=content_hash,
+            filename=filename,
+            path=result["path"],
+            transactions=len(created),
+            pages=result["pages"],
+            seconds=result["seconds"],
+        ))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    # Cartolas que se traslapan con otras ya ingeridas
+    result["count"] = len(created)
+    result["duplicates_skipped"] = len(rows) - len(created)
+
+    try:
+        charge_classifier.classify_rows(db, created, account_id)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Error clasificando tipos de cargo: {str(e)}")
+
+    created_fingerprints = {row["fingerprint"] for row in created}
+    try:
+        merchant_dictionary.learn(
+            db, [tx for tx in result["transactions"] if tx.get("fingerprint") in created_fingerprints], account_id
+        )
+    except Exception as e:
+        db.rollback()
+        print(f"Error actualizando diccionario de comercios: {str(e)}")
+
+
+def _run_detection(db, sensitivity: Optional[str], account_id: str) -> Dict:
+    sensitivity = sensitivity or accounts.get_sensitivity(db, account_id)
+    print(f"[Ingest] Ejecutando detector sobre el historial de la cuenta '{account_id}' (sensibilidad {sensitivity})")
+    started = time.perf_counter()
+    job, created = reprocess_job.start_job(db, sensitivity, account_id)
+    job_id = job.id
+    if not created:
+        # Otro proceso (p. ej. la API) ya lo encoló o lo está corriendo; sólo se informa su estado
+        print(f"[Ingest] Ya hay un reproceso en curso (#{job_id}, {job.status}); no se lanza otro")
+    else:
+        reprocess_job.run_job(job_id)
+    db.expire_all()
+    job = db.get(models.ReprocessJob, job_id)
+    return {
+        "job_id": job_id,
+        "status": job.status,
+        "total": job.total,
+        "suspicious": job.suspicious_count,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def _count_by(items: List[Dict], key: str) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for item in items:
+        counts[item[key]] = counts.get(item[key], 0) + item["count"]
+    return counts
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,39 @@
-from fastapi import FastAPI, Depends, UploadFile, File, HTTPException
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, Depends, UploadFile, File, HTTPException, BackgroundTasks, Request, Response, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from app.database import engine, Base, get_db
+from app.database import (
+    engine, read_engine, get_db, SessionLocal, ReadSessionLocal, run_migrations, mark_write, read_from_replica,
+    READ_AFTER_WRITE_SECONDS,
+)
 from app import models, schemas
 from pydantic import BaseModel
 
 # Allow fields prefixed with model_ used by some dependencies (e.g., docling) without warnings.
 BaseModel.model_config["protected_namespaces"] = ()
 
-from app.services import openai_service, suspicious_detector
+from app.services import openai_service, suspicious_detector, reprocess_job, merchant_dictionary, llm_client, pdf_text, ingest_pipeline, expense_store, metrics, profiling, balance_series, fast_json, expense_filters, charge_classifier, accounts, parquet_export
 from typing import List, Optional
+import asyncio
+import json
+import os
+import threading
 import uuid
 import shutil
+from decimal import Decimal
 from pathlib import Path
 
 
+_IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
+
+# Carga Docling y el cliente de OpenAI en segundo plano al arrancar (ver `/warmup`)
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "").lower() in ("1", "true", "yes")
+
 UPLOAD_DIR = Path("/app/uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
@@ -26,9 +45,46 @@ app = FastAPI(
 
 @app.on_event("startup")
 async def startup_event():
-    from app.database import ensure_schema_updates, engine, Base
-    Base.metadata.create_all(bind=engine)
-    ensure_schema_updates()
+    timings = {"imports": _IMPORT_SECONDS}
+
+    def timed(name, fn, *args, **kwargs):
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        timings[name] = time.perf_counter() - started
+        return result
+
+    timed("migrations", run_migrations)
+    if read_engine is not engine:
+        print(
+            f"[Database] Lecturas de listados y dashboard en la réplica {read_engine.url.render_as_string()} "
+            f"(primario por {READ_AFTER_WRITE_SECONDS:g}s tras cada escritura de la cuenta)"
+        )
+    timed("resume_jobs", reprocess_job.resume_interrupted_jobs)
+    # Filas anteriores a charge_class (o que fallaron al clasificar), en segundo plano
+    charge_classifier.start_rebuild(only_missing=True)
+    timed("pipeline", ingest_pipeline.start, detect=_detect_suspicious, persist=_persist_transactions)
+    if WARMUP_ON_STARTUP:
+        threading.Thread(target=_warm_up, name="warmup", daemon=True).start()
+
+    print(
+        f"[Startup] Listo en {sum(timings.values()):.2f}s: "
+        + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items())
+        + (" (precarga en segundo plano)" if WARMUP_ON_STARTUP else "")
+    )
+
+
+def _warm_up() -> dict:
+    """Carga Docling y el SDK de OpenAI, que de otro modo se importan en el primer upload."""
+    result = {"seconds": {}, "errors": {}}
+    for name, loader in (("docling", pdf_text.get_converter), ("openai", llm_client.get_client)):
+        started = time.perf_counter()
+        try:
+            loader()
+            result["seconds"][name] = round(time.perf_counter() - started, 3)
+        except Exception as e:
+            result["errors"][name] = str(e)
+    print(f"[Startup] Precarga: {result['seconds']}" + (f", errores: {result['errors']}" if result["errors"] else ""))
+    return result
 
 app.add_middleware(
     CORSMiddleware,
@@ -36,8 +92,74 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count"],
 )
 
+metrics.instrument_engine(engine)
+profiling.instrument_engine(engine)
+if read_engine is not engine:
+    metrics.instrument_engine(read_engine)
+    profiling.instrument_engine(read_engine)
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Latencia por ruta y consultas SQL por request para `/metrics`.
+
+    En los endpoints SSE la latencia cubre hasta el envío de los headers, no el stream.
+    """
+    token = metrics.start_request()
+    metrics.HTTP_REQUESTS_IN_PROGRESS.inc(method=request.method)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.HTTP_REQUESTS_IN_PROGRESS.inc(-1, method=request.method)
+        # Plantilla de la ruta (p. ej. /expenses/{expense_id}) para no crear una serie por id
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        metrics.HTTP_REQUEST_SECONDS.observe(elapsed, method=request.method, route=path, status=status)
+        metrics.DB_QUERIES_PER_REQUEST.observe(metrics.finish_request(token), route=path)
+
+
+@app.middleware("http")
+async def track_account_writes(request: Request, call_next):
+    """Tras una escritura exitosa, las lecturas de la cuenta van al primario (ver `get_read_db`)."""
+    response = await call_next(request)
+    if request.method in WRITE_METHODS and response.status_code < 400:
+        try:
+            mark_write(accounts.normalize_account_id(request.headers.get(accounts.ACCOUNT_HEADER)))
+        except accounts.InvalidAccount:
+            pass
+    return response
+
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    """Perfilado opcional (`PROFILING=1` o header `X-Profile: 1`), ver `profiling`."""
+    if not profiling.wants_profile(request.headers):
+        return await call_next(request)
+
+    token = profiling.start_trace(f"{request.method} {request.url.path}")
+    try:
+        response = await call_next(request)
+    finally:
+        trace = profiling.finish_trace(token)
+        route = request.scope.get("route")
+        if getattr(route, "path", None):
+            trace.root.name = f"{request.method} {route.path}"
+    response.headers["Server-Timing"] = profiling.server_timing(trace)
+    report_path = await asyncio.to_thread(profiling.maybe_dump, trace)
+    if report_path:
+        print(f"[Profiling] {trace.root.name} tomó {trace.root.seconds * 1000:.0f} ms, reporte en {report_path}")
+    return response
+
 
 @app.get("/")
 def read_root():
@@ -53,28 +175,66 @@ def health_check():
     return {"status": "healthy"}
 
 
-# Configuración de sensibilidad (por ahora en memoria, luego se puede hacer persistente)
-_user_sensitivity = {}  # En producción, esto debería estar en base de datos
+@app.post("/warmup")
+def warm_up():
+    """Precarga Docling y el cliente de OpenAI; llamarlo antes de enviar tráfico de uploads."""
+    return _warm_up()
+
+
+@app.get("/health/llm")
+def llm_health():
+    """Contadores del cliente LLM: reintentos, timeouts, tokens y estado del circuit breaker."""
+    return llm_client.stats_snapshot()
+
+
+def get_account_id(x_account_id: Optional[str] = Header(None)) -> str:
+    """Cuenta del request (header `X-Account-Id`, ver `accounts`); sin header, la cuenta por defecto."""
+    try:
+        return accounts.normalize_account_id(x_account_id)
+    except accounts.InvalidAccount as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def get_read_db(account_id: str = Depends(get_account_id)):
+    """Sesión para endpoints de solo lectura.
+
+    Usa la réplica (`DATABASE_READ_URL`) salvo que la cuenta haya escrito hace menos de
+    `READ_AFTER_WRITE_SECONDS`, para que vea sus propios cambios aunque la réplica vaya atrasada.
+    """
+    replica = read_from_replica(account_id)
+    metrics.DB_READ_ROUTING.inc(target="replica" if replica else "primary")
+    db = ReadSessionLocal() if replica else SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
 
 
 @app.get("/settings/sensitivity")
-def get_sensitivity():
-    """Obtiene el nivel de sensibilidad configurado (default: standard)"""
-    # Por ahora retorna default, luego se puede obtener de base de datos por usuario
-    return {"sensitivity": "standard"}
+def get_sensitivity(db: Session = Depends(get_db), account_id: str = Depends(get_account_id)):
+    """Obtiene el nivel de sensibilidad configurado para la cuenta (default: standard)"""
+    return {"sensitivity": accounts.get_sensitivity(db, account_id)}
 
 
 class SensitivityRequest(BaseModel):
     sensitivity: str
 
 @app.post("/settings/sensitivity")
-def set_sensitivity(request: SensitivityRequest):
-    """Configura el nivel de sensibilidad"""
+def set_sensitivity(
+    request: SensitivityRequest, db: Session = Depends(get_db), account_id: str = Depends(get_account_id)
+):
+    """Guarda el nivel de sensibilidad de la cuenta y re-aplica el umbral sobre las métricas guardadas"""
     sensitivity = request.sensitivity
     if sensitivity not in ["conservative", "standard", "strict"]:
         raise HTTPException(status_code=400, detail="Sensitivity must be: conservative, standard, or strict")
-    # Por ahora solo retorna, luego se puede guardar en base de datos
-    return {"sensitivity": sensitivity, "message": "Sensitivity updated"}
+    accounts.set_sensitivity(db, account_id, sensitivity)
+    result = suspicious_detector.rescore_from_features(db, sensitivity, account_id)
+    return {
+        "sensitivity": sensitivity,
+        "message": "Sensitivity updated",
+        "suspicious_count": result["suspicious_count"],
+        "changed": result["changed"],
+    }
 
 
 @app.post("/items/", response_model=schemas.Item)
@@ -127,102 +287,402 @@ def delete_item(item_id: int, db: Session = Depends(get_db)):
     return {"message": "Item deleted successfully"}
 
 
-@app.post("/expenses/upload")
-async def upload_expense(
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db)
-):
+def _upload_path(file: UploadFile) -> Path:
     if not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
     
     file_extension = ".pdf"
     unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = UPLOAD_DIR / unique_filename
+    return UPLOAD_DIR / unique_filename
+
+
+def _delete_uploaded_pdf(pdf_path: Optional[str]) -> bool:
+    """Borra el PDF sólo si es una copia propia en UPLOAD_DIR.
+
+    `python -m app.ingest` guarda la ruta original de la cartola, que pertenece al usuario
+    y nunca se debe borrar desde la API.
+    """
+    if not pdf_path:
+        return False
+    path = Path(pdf_path).resolve()
+    if not path.is_relative_to(UPLOAD_DIR.resolve()) or not path.exists():
+        return False
+    path.unlink()
+    return True
+
+
+def _store_upload(file: UploadFile) -> Path:
+    file_path = _upload_path(file)
     
     try:
         with open(file_path, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error saving file: {str(e)}")
+    return file_path
+
+
+def _detect_suspicious(transactions: List[dict], db: Session, account_id: str) -> List[dict]:
+    if not transactions:
+        return transactions
+    # Extraer nombres de comercios del lote actual para excluirlos del historial
+    current_vendors = [
+        tx.get("merchant_normalized") or tx.get("vendor") 
+        for tx in transactions 
+        if tx.get("merchant_normalized") or tx.get("vendor")
+    ]
     
+    return suspicious_detector.annotate_transactions(
+        transactions,
+        db,
+        accounts.get_sensitivity(db, account_id),
+        exclude_vendors=current_vendors,
+        account_id=account_id,
+    )
+
+
+def _persist_transactions(
+    transactions: List[dict], db: Session, pdf_filename: str, file_path: Path, account_id: str
+) -> List[dict]:
+    """Inserta las transacciones omitiendo las ya existentes (mismo fingerprint).
+
+    Retorna sólo las filas creadas; la diferencia con `transactions` son duplicados.
+    """
+    # Normalmente ya vienen de `expense_store.drop_existing`: recalcularlos sobre la lista
+    # filtrada cambiaría la secuencia de los movimientos repetidos
+    if any("fingerprint" not in transaction for transaction in transactions):
+        expense_store.assign_fingerprints(transactions)
+    rows = [
+        expense_store.expense_values(transaction, pdf_filename, file_path, account_id)
+        for transaction in transactions
+    ]
+    created_expenses = expense_store.insert_expenses(db, rows)
+    db.commit()
+    # Los uploads con SSE o por el pipeline terminan de escribir después de los headers
+    mark_write(account_id)
+    
+    skipped = len(rows) - len(created_expenses)
+    if skipped:
+        print(f"[Upload] {pdf_filename}: {skipped} transacciones omitidas por estar ya registradas")
+    
+    _classify_charges(db, created_expenses, account_id)
+    
+    created_fingerprints = {row["fingerprint"] for row in created_expenses}
     try:
-        transactions = openai_service.process_expense_pdf(str(file_path))
-        # Obtener sensibilidad desde query param o usar default
-        sensitivity = "standard"  # Por ahora fijo, luego se puede hacer configurable
-        
-        # Extraer nombres de comercios del lote actual para excluirlos del historial
-        current_vendors = [
-            tx.get("merchant_normalized") or tx.get("vendor") 
-            for tx in transactions 
-            if tx.get("merchant_normalized") or tx.get("vendor")
-        ]
-        
-        transactions = suspicious_detector.annotate_transactions(
-            transactions, db, sensitivity, exclude_vendors=current_vendors
+        merchant_dictionary.learn(
+            db, [tx for tx in transactions if tx.get("fingerprint") in created_fingerprints], account_id
+        )
+    except Exception as e:
+        db.rollback()
+        print(f"Error actualizando diccionario de comercios: {str(e)}")
+    return created_expenses
+
+
+def _classify_charges(db: Session, rows: List[dict], account_id: str) -> None:
+    """Clasifica los cargos de los comercios afectados (la periodicidad depende de todo su historial)."""
+    try:
+        charge_classifier.classify_rows(db, rows, account_id)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Error clasificando tipos de cargo: {str(e)}")
+
+
+@app.post("/expenses/upload")
+async def upload_expense(file: UploadFile = File(...), account_id: str = Depends(get_account_id)):
+    """Encola la cartola en el pipeline de ingesta (ver `ingest_pipeline`) y espera su resultado."""
+    file_path = _upload_path(file)
+    
+    try:
+        future = await asyncio.to_thread(
+            ingest_pipeline.submit, file.file, str(file_path), file.filename, account_id
         )
+        job = await asyncio.wrap_future(future)
+    except ingest_pipeline.PipelineBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except pdf_text.PDFLimitExceeded as e:
+        if file_path.exists():
+            file_path.unlink()
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         if file_path.exists():
             file_path.unlink()
         raise HTTPException(status_code=500, detail=f"Error analyzing PDF: {str(e)}")
     
-    created_expenses = []
-    for transaction in transactions:
-        expense_data = {
-            "category": transaction["category"],
-            "amount": transaction["amount"],
-            "date": transaction.get("date"),
-            "vendor": transaction.get("vendor"),
-            "description": transaction.get("description"),
-            "is_fixed": transaction.get("is_fixed", "variable"),
-            "channel": transaction.get("channel"),
-            "merchant_normalized": transaction.get("merchant_normalized"),
-            "merchant_category": transaction.get("merchant_category"),
-            "transaction_type": transaction.get("transaction_type", "cargo"),
-            "charge_archetype": transaction.get("charge_archetype"),
-            "charge_origin": transaction.get("charge_origin"),
-            "is_suspicious": transaction.get("is_suspicious", False),
-            "suspicious_reason": transaction.get("suspicious_reason"),
-            "suspicion_score": transaction.get("suspicion_score"),
-            "pdf_filename": file.filename,
-            "pdf_path": str(file_path),
-            "analysis_method": transaction.get("analysis_method")
-        }
-        
-        db_expense = models.Expense(**expense_data)
-        db.add(db_expense)
-        created_expenses.append(expense_data)
-    
-    db.commit()
+    # Las etapas corren en los hilos del pipeline, fuera del trace del request
+    for stage, seconds in job.timings.items():
+        profiling.record(f"pipeline.{stage}", seconds)
+
+    report = job.report
+    created_expenses = job.created
+    extraction_path = job.extraction_path or (
+        job.transactions[0].get("extraction_path", "failed") if job.transactions else "failed"
+    )
+    print(
+        f"[Upload] {file.filename}: ruta de extracción '{extraction_path}', {len(created_expenses)} transacciones, "
+        f"{report.get('pages')} páginas en {report.get('windows')} ventanas, RSS pico {report.get('peak_rss_mb')} MB, "
+        f"etapas {job.timings}"
+    )
     
     return {
         "success": True,
         "message": f"{len(created_expenses)} transacciones procesadas",
         "count": len(created_expenses),
+        "duplicates_skipped": job.duplicates_skipped + len(job.transactions) - len(created_expenses),
         "pdf_filename": file.filename,
+        "extraction_path": extraction_path,
+        "processing": {**report, "stage_seconds": job.timings},
         "transactions": created_expenses
     }
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    """Métricas en formato de texto de Prometheus."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/pipeline/stats")
+def pipeline_stats():
+    """Profundidad de cola, workers, latencia y throughput por etapa del pipeline de ingesta."""
+    return ingest_pipeline.stats()
+
+
+def _sse(event: str, payload: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, default=_json_default, ensure_ascii=False)}\n\n"
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+@app.post("/expenses/upload/stream")
+def upload_expense_stream(file: UploadFile = File(...), account_id: str = Depends(get_account_id)):
+    """Sube una cartola y emite el progreso como server-sent events.
+
+    Eventos: `stage` (store, docling, llm, detection, persistence), `transaction` por cada
+    transacción extraída apenas llega del LLM, `detection` con las banderas de sospecha (y los índices ya registrados en la cuenta, que
+    no pasan por el detector),
+    `done` con el resumen final y `error` si algo falla.
+    """
+    file_path = _store_upload(file)
+    pdf_filename = file.filename
+    # Los límites se validan antes de abrir el stream para poder responder 413
+    try:
+        pdf_text.check_pdf_limits(str(file_path))
+    except pdf_text.PDFLimitExceeded as e:
+        file_path.unlink()
+        raise HTTPException(status_code=413, detail=str(e))
+    
+    def event_stream():
+        # La sesión se abre dentro del generador: la respuesta sigue emitiendo después
+        # de que terminan las dependencias del request.
+        db = SessionLocal()
+        started = time.perf_counter()
+        try:
+            yield _sse("stage", {"stage": "store", "status": "completed", "pdf_filename": pdf_filename})
+            
+            transactions = []
+            extraction_path = "failed"
+            report: dict = {}
+            for event in openai_service.stream_expense_pdf(
+                str(file_path),
+                merchant_lookup=lambda vendors: merchant_dictionary.lookup(db, vendors, account_id),
+                report=report,
+            ):
+                if event["type"] == "stage":
+                    yield _sse("stage", {k: v for k, v in event.items() if k != "type"})
+                    continue
+                transaction = event["transaction"]
+                extraction_path = transaction.get("extraction_path", extraction_path)
+                transactions.append(transaction)
+                if len(transactions) == 1:
+                    print(f"[Upload] {pdf_filename}: primera transacción en {time.perf_counter() - started:.2f}s")
+                yield _sse("transaction", {"index": len(transactions) - 1, "transaction": transaction})
+            
+            yield _sse("stage", {"stage": "detection", "status": "started"})
+            # Los movimientos ya registrados en la cuenta no pasan por el detector
+            streamed = transactions
+            transactions = expense_store.drop_existing(db, streamed, account_id)
+            new_ids = {id(tx) for tx in transactions}
+            transactions = _detect_suspicious(transactions, db, account_id)
+            yield _sse("detection", {
+                "flags": [
+                    {
+                        "index": index,
+                        "is_suspicious": tx.get("is_suspicious", False),
+                        "suspicion_score": tx.get("suspicion_score"),
+                        "suspicious_reason": tx.get("suspicious_reason"),
+                    }
+                    for index, tx in enumerate(streamed) if id(tx) in new_ids
+                ],
+                "duplicates": [index for index, tx in enumerate(streamed) if id(tx) not in new_ids],
+            })
+            yield _sse("stage", {"stage": "detection", "status": "completed"})
+            
+            yield _sse("stage", {"stage": "persistence", "status": "started"})
+            created_expenses = _persist_transactions(transactions, db, pdf_filename, file_path, account_id)
+            yield _sse("stage", {"stage": "persistence", "status": "completed"})
+            
+            yield _sse("done", {
+                "success": True,
+                "message": f"{len(created_expenses)} transacciones procesadas",
+                "count": len(created_expenses),
+                "duplicates_skipped": len(streamed) - len(created_expenses),
+                "pdf_filename": pdf_filename,
+                "extraction_path": extraction_path,
+                "processing": report,
+                "elapsed": round(time.perf_counter() - started, 3),
+            })
+            print(
+                f"[Upload] {pdf_filename}: {report.get('pages')} páginas en {report.get('windows')} ventanas, "
+                f"RSS pico {report.get('peak_rss_mb')} MB"
+            )
+        except Exception as e:
+            db.rollback()
+            if file_path.exists():
+                file_path.unlink()
+            yield _sse("error", {"detail": f"Error analyzing PDF: {str(e)}"})
+        finally:
+            db.close()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/merchants/rebuild")
+def rebuild_merchant_dictionary(db: Session = Depends(get_db), account_id: str = Depends(get_account_id)):
+    """Reconstruye el diccionario de comercios de la cuenta desde sus transacciones."""
+    count = merchant_dictionary.rebuild_from_expenses(db, account_id)
+    return {"message": "Diccionario de comercios reconstruido", "merchants": count}
+
+
+@app.post("/expenses/charge-classes/rebuild")
+def rebuild_charge_classes(account_id: str = Depends(get_account_id)):
+    """Recalcula en segundo plano la clase de cargo de todas las transacciones de la cuenta."""
+    if not charge_classifier.start_rebuild(account_id=account_id):
+        raise HTTPException(status_code=409, detail="A charge class rebuild is already running")
+    return {"message": "Clasificación de cargos iniciada", "status": charge_classifier.rebuild_status()}
+
+
+@app.get("/expenses/charge-classes/rebuild")
+def charge_classes_rebuild_status():
+    return charge_classifier.rebuild_status()
+
+
+@app.post("/expenses/export")
+def export_expenses(full: bool = False, account_id: str = Depends(get_account_id)):
+    """Exporta en segundo plano las transacciones de la cuenta a Parquet particionado por mes.
+
+    Por defecto sólo agrega las filas nuevas desde la última exportación; `full=true`
+    reescribe la cuenta completa (necesario para recoger ediciones y eliminaciones).
+    """
+    try:
+        started = parquet_export.start_export(account_id=account_id, full=full)
+    except parquet_export.ArrowUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if not started:
+        raise HTTPException(status_code=409, detail="A Parquet export is already running")
+    return {"message": "Exportación a Parquet iniciada", "status": parquet_export.export_status()}
+
+
+@app.get("/expenses/export")
+def export_expenses_status(account_id: str = Depends(get_account_id)):
+    return {
+        "status": parquet_export.export_status(),
+        "watermark": parquet_export.read_watermarks().get(account_id),
+    }
+
+
+@app.get("/merchants/")
+def get_merchants(
+    skip: int = 0, limit: int = 100, db: Session = Depends(get_db), account_id: str = Depends(get_account_id)
+):
+    entries = (
+        db.query(models.MerchantKnowledge)
+        .filter(models.MerchantKnowledge.account_id == account_id)
+        .order_by(models.MerchantKnowledge.occurrences.desc())
+        .offset(skip)
+        .limit(limit)
+        .all()
+    )
+    return [
+        {
+            "vendor_key": entry.vendor_key,
+            "occurrences": entry.occurrences,
+            "source": entry.source,
+            **{field: getattr(entry, field) for field in merchant_dictionary.KNOWLEDGE_FIELDS},
+        }
+        for entry in entries
+    ]
+
+
 @app.get("/expenses/", response_model=List[schemas.Expense])
 def get_expenses(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     category: Optional[str] = None,
-    db: Session = Depends(get_db)
+    vendor: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    transaction_type: Optional[str] = None,
+    is_suspicious: Optional[bool] = None,
+    q: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+    account_id: str = Depends(get_account_id),
 ):
-    query = db.query(models.Expense)
+    """Filtros en SQL (ver `expense_filters`); el total filtrado va en `X-Total-Count`."""
+    # Camino rápido (FAST_JSON_RESPONSES): tuplas proyectadas serializadas con orjson
+    if fast_json.FAST_JSON_RESPONSES:
+        query = db.query(*fast_json.EXPENSE_COLUMNS)
+    else:
+        query = db.query(models.Expense)
+    
+    query = expense_filters.apply_filters(
+        query,
+        account_id,
+        category=category,
+        vendor=vendor,
+        date_from=date_from,
+        date_to=date_to,
+        min_amount=min_amount,
+        max_amount=max_amount,
+        transaction_type=transaction_type,
+        is_suspicious=is_suspicious,
+        q=q,
+    )
     
-    if category:
-        query = query.filter(models.Expense.category == category)
+    rows = query.order_by(models.Expense.created_at.desc(), models.Expense.id.desc()).offset(skip).limit(limit).all()
+    # Una página incompleta desde el inicio ya es el total; si no, se cuenta en SQL
+    if skip == 0 and len(rows) < limit:
+        total = len(rows)
+    else:
+        total = query.with_entities(func.count(models.Expense.id)).scalar()
     
-    expenses = query.order_by(models.Expense.created_at.desc()).offset(skip).limit(limit).all()
-    return expenses
+    if fast_json.FAST_JSON_RESPONSES:
+        return fast_json.json_response(request, fast_json.expense_rows(rows), headers={"X-Total-Count": str(total)})
+    response.headers["X-Total-Count"] = str(total)
+    return rows
 
 
 @app.get("/expenses/categories/list")
-def get_categories(db: Session = Depends(get_db)):
-    """Obtiene las categorías únicas existentes en la base de datos"""
-    categories = db.query(models.Expense.category).distinct().all()
+def get_categories(db: Session = Depends(get_read_db), account_id: str = Depends(get_account_id)):
+    """Obtiene las categorías únicas existentes en la cuenta"""
+    categories = (
+        db.query(models.Expense.category)
+        .filter(models.Expense.account_id == account_id)
+        .distinct()
+        .all()
+    )
     # Extraer las categorías de las tuplas y filtrar None/vacías
     category_list = sorted([cat[0] for cat in categories if cat[0] and cat[0].strip()])
     return {"categories": category_list}
@@ -230,17 +690,38 @@ def get_categories(db: Session = Depends(get_db)):
 
 @app.get("/expenses/stats", response_model=schemas.DashboardStats)
 def get_expenses_stats(
+    request: Request,
     month: Optional[str] = None,
-    db: Session = Depends(get_db)
+    resolution: str = "day",
+    max_points: int = balance_series.DEFAULT_MAX_POINTS,
+    db: Session = Depends(get_read_db),
+    account_id: str = Depends(get_account_id),
 ):
+    """`balance_evolution` trae el saldo de cierre por `resolution` (day, week o month),
+    reducido a lo más `max_points` puntos."""
     from collections import defaultdict
     
-    query = db.query(models.Expense)
+    if resolution not in balance_series.RESOLUTIONS:
+        raise HTTPException(status_code=400, detail="Resolution must be: day, week, or month")
+    if max_points < 2:
+        raise HTTPException(status_code=400, detail="max_points must be at least 2")
+    
+    # Sólo las columnas que usan los agregados, sin instanciar entidades ORM
+    query = db.query(
+        models.Expense.amount,
+        models.Expense.date,
+        models.Expense.category,
+        models.Expense.is_fixed,
+        models.Expense.transaction_type,
+        models.Expense.vendor,
+        models.Expense.merchant_normalized,
+    ).filter(models.Expense.account_id == account_id)
     
     if month:
         query = query.filter(models.Expense.date.like(f"{month}%"))
     
-    expenses = query.all()
+    with profiling.span("stats.load"):
+        expenses = query.all()
     
     if not expenses:
         return schemas.DashboardStats(
@@ -313,22 +794,9 @@ def get_expenses_stats(
             "deposits": monthly_deposits.get(month, 0.0)
         })
     
-    # Calcular evolución del saldo (acumulado)
-    sorted_expenses = sorted([e for e in expenses if e.date], key=lambda x: x.date)
-    current_balance = 0.0
-    balance_evolution = []
-    
-    for e in sorted_expenses:
-        tx_type = getattr(e, 'transaction_type', 'cargo')
-        if tx_type == 'abono':
-            current_balance += e.amount
-        else:
-            current_balance -= e.amount
-        
-        balance_evolution.append({
-            "date": e.date,
-            "balance": current_balance
-        })
+    # Evolución del saldo (acumulado): cierre por período calculado en SQL
+    with profiling.span("stats.balance"):
+        balance_evolution = balance_series.balance_evolution(db, month, resolution, max_points, account_id)
     
     merchants = defaultdict(lambda: {"amount": 0, "count": 0})
     for e in expenses:
@@ -350,37 +818,25 @@ def get_expenses_stats(
         reverse=True
     )[:10]
     
-    # Clasificar cargos por tipo (suscripciones, compras diarias, pagos excepcionales)
+    # Tipos de cargo precalculados al ingerir (charge_classifier): un solo GROUP BY
     charge_type_summary = {
-        "suscripciones": {"amount": 0.0, "count": 0},
-        "compras_diarias": {"amount": 0.0, "count": 0},
-        "pagos_excepcionales": {"amount": 0.0, "count": 0},
-        "otros": {"amount": 0.0, "count": 0}
+        charge_class: {"amount": 0.0, "count": 0} for charge_class in charge_classifier.CHARGE_CLASSES
     }
+    summary_query = db.query(
+        models.Expense.charge_class,
+        func.sum(models.Expense.amount),
+        func.count(models.Expense.id),
+    ).filter(models.Expense.account_id == account_id, models.Expense.transaction_type == "cargo")
+    if month:
+        summary_query = summary_query.filter(models.Expense.date.like(f"{month}%"))
+    with profiling.span("stats.charge_types"):
+        for charge_class, amount, charge_count in summary_query.group_by(models.Expense.charge_class):
+            # Filas aún sin clasificar (backfill en curso) cuentan como "otros"
+            entry = charge_type_summary.get(charge_class) or charge_type_summary["otros"]
+            entry["amount"] += float(amount or 0.0)
+            entry["count"] += charge_count
     
-    for e in expenses:
-        if getattr(e, 'transaction_type', 'cargo') == 'cargo':
-            archetype_lower = (e.charge_archetype or "").lower()
-            merchant_cat_lower = (e.merchant_category or "").lower()
-            
-            # Detectar suscripciones
-            if any(keyword in archetype_lower for keyword in ['suscripción', 'suscripcion', 'subscription', 'recurrente', 'mensual']):
-                charge_type_summary["suscripciones"]["amount"] += e.amount
-                charge_type_summary["suscripciones"]["count"] += 1
-            # Detectar compras diarias (comida, transporte, supermercado)
-            elif any(keyword in archetype_lower or keyword in merchant_cat_lower for keyword in 
-                    ['comida', 'restaurante', 'supermercado', 'transporte', 'gasolinera', 'cafetería', 'cafeteria']):
-                charge_type_summary["compras_diarias"]["amount"] += e.amount
-                charge_type_summary["compras_diarias"]["count"] += 1
-            # Detectar pagos excepcionales (montos altos, servicios, pagos únicos)
-            elif e.is_fixed == "fixed" or e.amount > (avg_ticket * 3):
-                charge_type_summary["pagos_excepcionales"]["amount"] += e.amount
-                charge_type_summary["pagos_excepcionales"]["count"] += 1
-            else:
-                charge_type_summary["otros"]["amount"] += e.amount
-                charge_type_summary["otros"]["count"] += 1
-    
-    return schemas.DashboardStats(
+    stats = dict(
         total_expenses=total,
         total_transactions=count,
         average_ticket=avg_ticket,
@@ -395,11 +851,22 @@ def get_expenses_stats(
         top_merchants=top_merchants,
         charge_type_summary=charge_type_summary
     )
+    if fast_json.FAST_JSON_RESPONSES:
+        return fast_json.json_response(request, stats)
+    return schemas.DashboardStats(**stats)
+
+
+@app.get("/expenses/suspicious/preview")
+def preview_suspicious_levels(db: Session = Depends(get_db), account_id: str = Depends(get_account_id)):
+    """Muestra cuántas transacciones quedarían marcadas con cada nivel de sensibilidad."""
+    preview = suspicious_detector.preview_sensitivity_levels(db, account_id)
+    preview["current"] = accounts.get_sensitivity(db, account_id)
+    return preview
 
 
 @app.get("/expenses/{expense_id}", response_model=schemas.Expense)
-def get_expense(expense_id: int, db: Session = Depends(get_db)):
-    expense = db.query(models.Expense).filter(models.Expense.id == expense_id).first()
+def get_expense(expense_id: int, db: Session = Depends(get_read_db), account_id: str = Depends(get_account_id)):
+    expense = _get_account_expense(db, expense_id, account_id)
     if expense is None:
         raise HTTPException(status_code=404, detail="Expense not found")
     return expense
@@ -409,40 +876,67 @@ def get_expense(expense_id: int, db: Session = Depends(get_db)):
 def update_expense(
     expense_id: int,
     expense_update: schemas.ExpenseUpdate,
-    db: Session = Depends(get_db)
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    account_id: str = Depends(get_account_id),
 ):
-    db_expense = db.query(models.Expense).filter(models.Expense.id == expense_id).first()
+    db_expense = _get_account_expense(db, expense_id, account_id)
     if db_expense is None:
         raise HTTPException(status_code=404, detail="Expense not found")
     
+    before = _detector_snapshot(db_expense)
+    previous_vendor = charge_classifier.vendor_of(db_expense.merchant_normalized, db_expense.vendor)
     update_data = expense_update.dict(exclude_unset=True)
     for key, value in update_data.items():
         setattr(db_expense, key, value)
     
     db.commit()
     db.refresh(db_expense)
+    
+    if CHARGE_CLASS_FIELDS.intersection(update_data):
+        affected = [{"merchant_normalized": db_expense.merchant_normalized, "vendor": db_expense.vendor}]
+        if previous_vendor:
+            affected.append({"merchant_normalized": previous_vendor, "vendor": None})
+        _classify_charges(db, affected, account_id)
+        db.refresh(db_expense)
+    
+    # Las correcciones del usuario alimentan el diccionario de comercios
+    if set(merchant_dictionary.KNOWLEDGE_FIELDS).intersection(update_data):
+        merchant_dictionary.learn_from_correction(db, db_expense)
+    
+    # Re-evaluar las banderas que dependen de la fila modificada (sin bloquear la respuesta)
+    if RESCORE_FIELDS.intersection(update_data):
+        background_tasks.add_task(
+            _rescore_dependents_task,
+            [before, _detector_snapshot(db_expense)],
+            accounts.get_sensitivity(db, account_id),
+            account_id,
+        )
     return db_expense
 
 
 @app.delete("/expenses/clear/all")
-def delete_all_expenses(db: Session = Depends(get_db)):
-    """Elimina todas las transacciones de la base de datos y sus archivos PDF asociados."""
+def delete_all_expenses(db: Session = Depends(get_db), account_id: str = Depends(get_account_id)):
+    """Elimina todas las transacciones de la cuenta y sus archivos PDF asociados."""
     try:
-        expenses = db.query(models.Expense).all()
+        account_expenses = db.query(models.Expense).filter(models.Expense.account_id == account_id)
+        pdf_paths = {pdf_path for (pdf_path,) in account_expenses.with_entities(models.Expense.pdf_path).distinct()}
         
         # Eliminar archivos PDF
         deleted_files = 0
-        for expense in expenses:
+        for pdf_path in pdf_paths:
             try:
-                pdf_path = Path(expense.pdf_path)
-                if pdf_path.exists():
-                    pdf_path.unlink()
+                if _delete_uploaded_pdf(pdf_path):
                     deleted_files += 1
             except Exception as e:
-                print(f"Error deleting PDF file {expense.pdf_path}: {str(e)}")
+                print(f"Error deleting PDF file {pdf_path}: {str(e)}")
         
-        # Eliminar todas las transacciones
-        count = db.query(models.Expense).delete()
+        # Eliminar todas las transacciones de la cuenta, y el registro de archivos ingeridos
+        # para que `python -m app.ingest` pueda volver a cargarlos
+        count = account_expenses.delete(synchronize_session=False)
+        db.query(models.IngestedFile).filter(models.IngestedFile.account_id == account_id).delete(
+            synchronize_session=False
+        )
         db.commit()
         
         return {
@@ -456,225 +950,128 @@ def delete_all_expenses(db: Session = Depends(get_db)):
 
 
 @app.post("/expenses/reprocess-suspicious")
-def reprocess_suspicious_flags(db: Session = Depends(get_db)):
-    """Reprocesa todas las transacciones para actualizar las banderas de sospecha.
+def reprocess_suspicious_flags(
+    background_tasks: BackgroundTasks, db: Session = Depends(get_db), account_id: str = Depends(get_account_id)
+):
+    """Inicia el reproceso de las banderas de sospecha como trabajo en segundo plano.
     
-    Usa la lógica completa del detector de forma incremental, procesando las transacciones
-    en orden cronológico y comparando cada una solo con el historial previo.
+    El trabajo procesa las transacciones en orden cronológico comparando cada una solo con
+    el historial previo, hace commit por bloques y guarda un checkpoint para reanudarse.
+    Si ya hay un trabajo en curso, se retorna ese mismo trabajo.
     """
-    try:
-        # Obtener todas las transacciones ordenadas por fecha
-        all_expenses = db.query(models.Expense).order_by(models.Expense.date, models.Expense.id).all()
-        
-        if len(all_expenses) < 5:
-            return {
-                "message": "No hay suficientes transacciones para analizar. Se necesitan al menos 5 transacciones.",
-                "total": len(all_expenses),
-                "suspicious_count": 0
-            }
-        
-        suspicious_count = 0
-        sensitivity = "standard"
-        sensitivity_config = suspicious_detector.SENSITIVITY_LEVELS.get(sensitivity, suspicious_detector.SENSITIVITY_LEVELS["standard"])
-        
-        # Importar funciones necesarias del detector
-        from app.services.suspicious_detector import _build_stats, _normalize_vendor, _analyze_date_pattern, _days_since_last_transaction
-        
-        # Procesar transacciones de forma incremental
-        # Cada transacción se compara solo con las anteriores
-        for i, expense in enumerate(all_expenses):
-            # Si es una de las primeras transacciones, no hay historial suficiente
-            if i < 3:
-                expense.is_suspicious = False
-                expense.suspicion_score = None
-                expense.suspicious_reason = None
-                db.add(expense)
-                continue
-            
-            # Obtener solo las transacciones anteriores como historial
-            historical_expenses = all_expenses[:i]
-            
-            # Construir estadísticas del historial
-            stats = _build_stats(historical_expenses)
-            
-            # Si no hay suficiente historial, saltar
-            if stats["global"]["count"] < 3:
-                expense.is_suspicious = False
-                expense.suspicion_score = None
-                expense.suspicious_reason = None
-                db.add(expense)
-                continue
-            
-            # Preparar datos de la transacción actual
-            amount = float(expense.amount or 0)
-            category = expense.category
-            tx_type = expense.transaction_type or "cargo"
-            vendor_key = _normalize_vendor(expense.merchant_normalized or expense.vendor)
-            transaction_date = expense.date
-            merchant_category = expense.merchant_category
-            
-            # Inicializar análisis
-            reasons = []
-            suspicion_score = 0.0
-            vendor_stats = stats["vendors"].get(vendor_key) if vendor_key else None
-            category_stats = stats["categories"].get(category)
-            global_stats = stats["global"]
-            
-            # 1. Análisis de monto por comercio (usando la lógica completa del detector)
-            if vendor_stats and vendor_stats["count"] >= 3:
-                threshold = vendor_stats["mean"] + (sensitivity_config["multiplier"] * vendor_stats["std"])
-                if vendor_stats["std"] == 0:
-                    threshold = vendor_stats["mean"] * (1.5 + sensitivity_config["multiplier"] * 0.2)
-                if amount > threshold:
-                    multiplier = amount / vendor_stats["mean"] if vendor_stats["mean"] > 0 else 0
-                    score_increase = min(0.4, multiplier / 10)
-                    suspicion_score += score_increase
-                    reasons.append(
-                        f"Monto {multiplier:.1f}x mayor al promedio histórico en {expense.vendor or 'este comercio'} "
-                        f"(promedio: {vendor_stats['mean']:.0f}, observado: {amount:.0f})."
-                    )
-                
-                # Detección de cambio de tipo de transacción
-                historic_types = vendor_stats.get("types", {})
-                if (
-                    tx_type == "abono"
-                    and historic_types.get("abono", 0) == 0
-                    and historic_types.get("cargo", 0) >= 3
-                ):
-                    suspicion_score += 0.2
-                    reasons.append("Primer abono en un comercio que previamente solo registraba cargos.")
-            elif (
-                not vendor_stats
-                and global_stats["count"] >= 15
-                and amount > global_stats["p95"]
-            ):
-                suspicion_score += 0.3
-                reasons.append(
-                    f"Comercio nuevo con monto superior al percentil 95 de tu historial ({global_stats['p95']:.0f})."
-                )
-            
-            # 2. Análisis de categoría
-            if (
-                category_stats
-                and category_stats["count"] >= 5
-                and amount > (category_stats["p90"] * 1.4)
-            ):
-                multiplier = amount / category_stats["p90"] if category_stats["p90"] > 0 else 0
-                suspicion_score += min(0.25, multiplier / 15)
-                reasons.append(
-                    f"Monto {multiplier:.1f}x superior al percentil 90 para la categoría '{category}' "
-                    f"(percentil 90: {category_stats['p90']:.0f})."
-                )
-            
-            # 3. Análisis global de monto
-            if (
-                tx_type == "cargo"
-                and global_stats["count"] >= 20
-                and amount > global_stats["mean"] * (2.5 + sensitivity_config["multiplier"] * 0.5)
-            ):
-                multiplier = amount / global_stats["mean"] if global_stats["mean"] > 0 else 0
-                suspicion_score += min(0.3, multiplier / 12)
-                reasons.append(
-                    f"Cargo {multiplier:.1f}x superior a tu gasto promedio histórico ({global_stats['mean']:.0f})."
-                )
-            
-            # 4. Análisis de fecha/horario
-            if transaction_date:
-                date_analysis = _analyze_date_pattern(transaction_date, historical_expenses, stats)
-                if date_analysis["is_unusual"]:
-                    suspicion_score += date_analysis["score"]
-                    reasons.append(date_analysis["reason"])
-            
-            # 5. Análisis de frecuencia de comercio
-            if vendor_key and vendor_key in stats.get("vendor_frequency", {}):
-                freq_stats = stats["vendor_frequency"][vendor_key]
-                days_since_last = _days_since_last_transaction(transaction_date, freq_stats.get("last_date"))
-                if days_since_last > 0 and days_since_last > freq_stats.get("avg_interval", 0) * 3:
-                    suspicion_score += 0.15
-                    reasons.append(
-                        f"Transacción después de {days_since_last} días, cuando el intervalo promedio es de {freq_stats.get('avg_interval', 0):.0f} días."
-                    )
-            
-            # 6. Análisis de categoría de comercio atípica
-            if merchant_category and vendor_key:
-                vendor_categories = stats.get("vendor_categories", {}).get(vendor_key, set())
-                if merchant_category not in vendor_categories and len(vendor_categories) > 0:
-                    suspicion_score += 0.1
-                    reasons.append(
-                        f"Comercio con categoría '{merchant_category}' diferente a sus categorías históricas."
-                    )
-            
-            # Aplicar umbral de sensibilidad
-            suspicion_score = min(1.0, suspicion_score)
-            
-            if suspicion_score >= sensitivity_config["threshold"]:
-                expense.is_suspicious = True
-                expense.suspicion_score = float(suspicion_score)
-                
-                # Generar explicación mejorada con IA si hay razones
-                if reasons:
-                    historical_context = {
-                        "avg_amount": global_stats.get("mean", 0),
-                        "total_transactions": global_stats.get("count", 0),
-                    }
-                    tx_dict = {
-                        "date": transaction_date,
-                        "amount": amount,
-                        "vendor": expense.vendor,
-                        "merchant_normalized": expense.merchant_normalized,
-                        "category": category,
-                        "transaction_type": tx_type,
-                        "charge_archetype": expense.charge_archetype,
-                    }
-                    try:
-                        expense.suspicious_reason = openai_service.generate_suspicious_explanation(
-                            tx_dict, reasons, historical_context
-                        )
-                    except Exception as e:
-                        print(f"Error generando explicación con IA: {str(e)}")
-                        expense.suspicious_reason = " | ".join(reasons)
-                else:
-                    expense.suspicious_reason = "Movimiento marcado como sospechoso por el sistema."
-                suspicious_count += 1
-            else:
-                expense.is_suspicious = False
-                expense.suspicion_score = float(suspicion_score) if suspicion_score > 0 else None
-                expense.suspicious_reason = None
-            
-            db.add(expense)
-        
-        # Guardar todos los cambios
-        try:
-            db.commit()
-        except Exception as e:
-            db.rollback()
-            raise HTTPException(status_code=500, detail=f"Error al guardar cambios: {str(e)}")
-        
+    total = db.query(models.Expense).filter(models.Expense.account_id == account_id).count()
+    if total < 5:
         return {
-            "message": "Transacciones reprocesadas exitosamente",
-            "total": len(all_expenses),
-            "suspicious_count": suspicious_count
+            "message": "No hay suficientes transacciones para analizar. Se necesitan al menos 5 transacciones.",
+            "total": total,
+            "suspicious_count": 0
         }
-    except Exception as e:
-        db.rollback()
-        import traceback
-        print(f"Error completo: {traceback.format_exc()}")
-        raise HTTPException(status_code=500, detail=f"Error al reprocesar: {str(e)}")
+    
+    job, created = reprocess_job.start_job(db, accounts.get_sensitivity(db, account_id), account_id)
+    if created:
+        background_tasks.add_task(reprocess_job.run_job, job.id)
+    
+    progress = reprocess_job.job_progress(job)
+    progress["message"] = "Reproceso iniciado en segundo plano"
+    return progress
+
+
+@app.get("/expenses/reprocess-suspicious/jobs/{job_id}")
+def get_reprocess_job(job_id: int, db: Session = Depends(get_db), account_id: str = Depends(get_account_id)):
+    """Progreso del trabajo de reproceso: porcentaje, throughput y tiempo estimado."""
+    job = _get_account_job(db, job_id, account_id)
+    return reprocess_job.job_progress(job)
+
+
+@app.post("/expenses/reprocess-suspicious/jobs/{job_id}/cancel")
+def cancel_reprocess_job(job_id: int, db: Session = Depends(get_db), account_id: str = Depends(get_account_id)):
+    job = _get_account_job(db, job_id, account_id)
+    job = reprocess_job.request_cancel(db, job)
+    return reprocess_job.job_progress(job)
+
+
+@app.post("/expenses/reprocess-suspicious/jobs/{job_id}/resume")
+def resume_reprocess_job(
+    job_id: int,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    account_id: str = Depends(get_account_id),
+):
+    """Reanuda un trabajo cancelado o fallido desde su último checkpoint."""
+    job = _get_account_job(db, job_id, account_id)
+    if job.status not in ("failed", "cancelled"):
+        raise HTTPException(status_code=400, detail=f"Job is {job.status}, only failed or cancelled jobs can be resumed")
+    background_tasks.add_task(reprocess_job.run_job, job.id, ("failed", "cancelled"))
+    return reprocess_job.job_progress(job)
 
 
 @app.delete("/expenses/{expense_id}")
-def delete_expense(expense_id: int, db: Session = Depends(get_db)):
-    db_expense = db.query(models.Expense).filter(models.Expense.id == expense_id).first()
+def delete_expense(
+    expense_id: int,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    account_id: str = Depends(get_account_id),
+):
+    db_expense = _get_account_expense(db, expense_id, account_id)
     if db_expense is None:
         raise HTTPException(status_code=404, detail="Expense not found")
     
     try:
-        pdf_path = Path(db_expense.pdf_path)
-        if pdf_path.exists():
-            pdf_path.unlink()
+        _delete_uploaded_pdf(db_expense.pdf_path)
     except Exception as e:
         print(f"Error deleting PDF file: {str(e)}")
     
+    snapshot = _detector_snapshot(db_expense)
     db.delete(db_expense)
     db.commit()
+    # Sin la fila puede cambiar la periodicidad del comercio y el ticket promedio de la cuenta
+    _classify_charges(db, [snapshot], account_id)
+    background_tasks.add_task(
+        _rescore_dependents_task, [snapshot], accounts.get_sensitivity(db, account_id), account_id
+    )
     return {"message": "Expense deleted successfully"}
+
+
+# Campos que afectan las estadísticas del detector de transacciones sospechosas
+RESCORE_FIELDS = {"amount", "date", "vendor", "merchant_normalized", "category", "merchant_category", "transaction_type"}
+CHARGE_CLASS_FIELDS = {
+    "amount", "date", "vendor", "merchant_normalized", "merchant_category", "charge_archetype",
+    "is_fixed", "transaction_type",
+}
+
+
+def _detector_snapshot(expense: models.Expense) -> dict:
+    return {
+        "vendor": expense.vendor,
+        "merchant_normalized": expense.merchant_normalized,
+        "category": expense.category,
+        "date": expense.date,
+    }
+
+
+def _get_account_expense(db: Session, expense_id: int, account_id: str) -> Optional[models.Expense]:
+    return (
+        db.query(models.Expense)
+        .filter(models.Expense.account_id == account_id, models.Expense.id == expense_id)
+        .first()
+    )
+
+
+def _get_account_job(db: Session, job_id: int, account_id: str) -> models.ReprocessJob:
+    job = db.get(models.ReprocessJob, job_id)
+    if job is None or job.account_id != account_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+def _rescore_dependents_task(changed: List[dict], sensitivity: str, account_id: str):
+    """Tarea en segundo plano: usa su propia sesión porque la del request ya fue cerrada."""
+    db = SessionLocal()
+    try:
+        suspicious_detector.rescore_dependents(db, changed, sensitivity, account_id)
+        mark_write(account_id)
+    except Exception as e:
+        db.rollback()
+        print(f"Error en re-score incremental: {str(e)}")
+    finally:
+        db.close()
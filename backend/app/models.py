@@ -1,7 +1,10 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Numeric, Date, Text, Boolean
+from sqlalchemy import Column, Integer, String, Float, DateTime, Numeric, Date, Text, Boolean, JSON, Index, text
 from sqlalchemy.sql import func
 from app.database import Base
 
+# Cuenta de las filas anteriores a la columna `account_id` y de los requests sin `X-Account-Id`
+DEFAULT_ACCOUNT_ID = "default"
+
 
 class Item(Base):
     __tablename__ = "items"
@@ -17,24 +20,122 @@ class Item(Base):
 class Expense(Base):
     __tablename__ = "expenses"
 
+    # En PostgreSQL la clave primaria real es (account_id, id) porque la tabla está
+    # particionada por hash de account_id (migración 0004); los ids siguen siendo únicos
     id = Column(Integer, primary_key=True, index=True)
+    account_id = Column(String(64), nullable=False, default=DEFAULT_ACCOUNT_ID, server_default=DEFAULT_ACCOUNT_ID)
     category = Column(String, index=True, nullable=False)
-    amount = Column(Float, nullable=False)
-    date = Column(String, nullable=True)
-    vendor = Column(String, nullable=True)
+    amount = Column(Float, index=True, nullable=False)
+    date = Column(String, index=True, nullable=True)
+    vendor = Column(String, index=True, nullable=True)
     description = Column(Text, nullable=True)
     pdf_filename = Column(String, nullable=False)
     pdf_path = Column(String, nullable=False)
     analysis_method = Column(String, nullable=True)
     is_fixed = Column(String, default="variable")
     channel = Column(String, nullable=True)
-    merchant_normalized = Column(String, nullable=True)
+    merchant_normalized = Column(String, index=True, nullable=True)
     merchant_category = Column(String, nullable=True)
     transaction_type = Column(String, default="cargo")
     charge_archetype = Column(String, nullable=True)
     charge_origin = Column(Text, nullable=True)
+    # suscripciones / compras_diarias / pagos_excepcionales / otros (ver charge_classifier)
+    charge_class = Column(String(32), index=True, nullable=True)
     is_suspicious = Column(Boolean, default=False)
     suspicious_reason = Column(Text, nullable=True)
     suspicion_score = Column(Float, nullable=True)
+    # Sin métricas se guarda NULL de SQL (no JSON 'null') para que `IS NULL` las encuentre
+    detector_features = Column(JSON(none_as_null=True), nullable=True)
+    # Identidad del movimiento para deduplicar cartolas repetidas o traslapadas, única por
+    # cuenta (ver expense_store)
+    fingerprint = Column(String(64), nullable=True)
+    # Lo fija `expense_store.expense_values` al insertar (ISO-8601 UTC)
     created_at = Column(String, nullable=True)
     updated_at = Column(String, nullable=True)
+
+    # El índice GIN de trigramas para la búsqueda de texto (sólo PostgreSQL) vive en la
+    # migración 0002, ver `expense_filters.search_document`
+    __table_args__ = (
+        Index("ix_expenses_account_fingerprint", "account_id", "fingerprint", unique=True),
+        Index("ix_expenses_account_date", "account_id", "date"),
+        # Orden del listado paginado: created_at DESC, id DESC dentro de la cuenta
+        Index("ix_expenses_account_created", "account_id", "created_at", "id"),
+        Index(
+            "ix_expenses_suspicious_date",
+            "date",
+            postgresql_where=text("is_suspicious = true"),
+            sqlite_where=text("is_suspicious = 1"),
+        ),
+    )
+
+
+class ReprocessJob(Base):
+    __tablename__ = "reprocess_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    account_id = Column(String(64), nullable=False, index=True, default=DEFAULT_ACCOUNT_ID, server_default=DEFAULT_ACCOUNT_ID)
+    status = Column(String, nullable=False, default="pending")
+    sensitivity = Column(String, nullable=False, default="standard")
+    total = Column(Integer, default=0)
+    processed = Column(Integer, default=0)
+    suspicious_count = Column(Integer, default=0)
+    last_date = Column(String, nullable=True)
+    last_id = Column(Integer, nullable=True)
+    state = Column(JSON, nullable=True)
+    cancel_requested = Column(Boolean, default=False)
+    # Runner que tiene reclamado el trabajo (ver `reprocess_job.run_job`)
+    run_id = Column(String(32), nullable=True)
+    error = Column(Text, nullable=True)
+    started_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class MerchantKnowledge(Base):
+    __tablename__ = "merchant_knowledge"
+
+    id = Column(Integer, primary_key=True, index=True)
+    account_id = Column(String(64), nullable=False, default=DEFAULT_ACCOUNT_ID, server_default=DEFAULT_ACCOUNT_ID)
+    vendor_key = Column(String, nullable=False)
+    merchant_normalized = Column(String, nullable=True)
+    merchant_category = Column(String, nullable=True)
+    category = Column(String, nullable=True)
+    charge_archetype = Column(String, nullable=True)
+    charge_origin = Column(Text, nullable=True)
+    is_fixed = Column(String, nullable=True)
+    channel = Column(String, nullable=True)
+    occurrences = Column(Integer, default=0)
+    source = Column(String, default="history")
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index("ix_merchant_knowledge_account_vendor", "account_id", "vendor_key", unique=True),
+    )
+
+
+class IngestedFile(Base):
+    __tablename__ = "ingested_files"
+
+    id = Column(Integer, primary_key=True, index=True)
+    account_id = Column(String(64), nullable=False, default=DEFAULT_ACCOUNT_ID, server_default=DEFAULT_ACCOUNT_ID)
+    content_hash = Column(String(64), nullable=False)
+    filename = Column(String, nullable=False)
+    path = Column(String, nullable=False)
+    transactions = Column(Integer, default=0)
+    pages = Column(Integer, nullable=True)
+    seconds = Column(Float, nullable=True)
+    ingested_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_ingested_files_account_hash", "account_id", "content_hash", unique=True),
+    )
+
+
+class AccountSettings(Base):
+    __tablename__ = "account_settings"
+
+    account_id = Column(String(64), primary_key=True)
+    sensitivity = Column(String, nullable=False, default="standard")
+    # Última reconstrucción del diccionario de comercios de la cuenta (ver merchant_dictionary)
+    merchants_built_at = Column(DateTime(timezone=True), nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -37,6 +37,7 @@ class ExpenseBase(BaseModel):
     is_suspicious: bool = False
     suspicious_reason: Optional[str] = None
     suspicion_score: Optional[float] = None
+    detector_features: Optional[dict] = None
 
 
 class ExpenseCreate(ExpenseBase):
@@ -68,6 +69,7 @@ class Expense(ExpenseBase):
     pdf_filename: str
     pdf_path: str
     analysis_method: Optional[str] = None
+    charge_class: Optional[str] = None
     created_at: Optional[str] = None
     updated_at: Optional[str] = None
 
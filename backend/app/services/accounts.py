@@ -0,0 +1,54 @@
+"""Cuentas dueñas de las transacciones y sus ajustes.
+
+Cada request se asocia a una cuenta con el header `X-Account-Id`; sin header se usa
+`models.DEFAULT_ACCOUNT_ID`, que es donde quedaron las filas anteriores a las cuentas.
+Todas las consultas sobre `expenses` filtran `account_id = :cuenta`: en PostgreSQL la
+tabla está particionada por hash de `account_id` (migración 0004), así que el planner
+lee sólo la partición de la cuenta, y el historial del detector, las estadísticas y los
+listados no crecen con los datos de otros clientes.
+
+La sensibilidad del detector se guarda por cuenta en `account_settings`.
+"""
+from __future__ import annotations
+
+import re
+from typing import Optional
+
+from app import models
+from app.services import suspicious_detector
+
+ACCOUNT_HEADER = "X-Account-Id"
+
+_ACCOUNT_ID_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.@-]{0,63}$")
+
+
+class InvalidAccount(ValueError):
+    """El identificador de cuenta no cumple `_ACCOUNT_ID_PATTERN`."""
+
+
+def normalize_account_id(value: Optional[str]) -> str:
+    value = (value or "").strip()
+    if not value:
+        return models.DEFAULT_ACCOUNT_ID
+    if not _ACCOUNT_ID_PATTERN.match(value):
+        raise InvalidAccount(
+            f"{ACCOUNT_HEADER} must be 1-64 characters: letters, digits, '_', '.', '@' or '-'"
+        )
+    return value
+
+
+def get_sensitivity(db, account_id: str) -> str:
+    settings = db.get(models.AccountSettings, account_id)
+    if settings is None:
+        return suspicious_detector.DEFAULT_SENSITIVITY
+    return settings.sensitivity
+
+
+def set_sensitivity(db, account_id: str, sensitivity: str) -> None:
+    settings = db.get(models.AccountSettings, account_id)
+    if settings is None:
+        db.add(models.AccountSettings(account_id=account_id, sensitivity=sensitivity))
+    else:
+        settings.sensitivity = sensitivity
+    db.commit()
+
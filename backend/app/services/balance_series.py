@@ -0,0 +1,126 @@
+"""Serie de saldo acumulado para el dashboard, acotada en tamaño.
+
+El saldo de cierre diario se calcula en SQL (suma neta por día y suma acumulada con una
+función de ventana), así que la base retorna a lo más una fila por día con movimientos
+sin importar cuántas transacciones haya. Luego se agrupa por semana o mes (cierre del
+último día del período) y, si aún excede `max_points`, se reduce con LTTB
+(Largest-Triangle-Three-Buckets), que conserva picos y caídas de la curva.
+"""
+from __future__ import annotations
+
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import Session
+
+from app import models
+
+RESOLUTIONS = ("day", "week", "month")
+DEFAULT_MAX_POINTS = 500
+
+
+def balance_evolution(
+    db: Session,
+    month: Optional[str] = None,
+    resolution: str = "day",
+    max_points: int = DEFAULT_MAX_POINTS,
+    account_id: str = models.DEFAULT_ACCOUNT_ID,
+) -> List[Dict]:
+    points = bucket_balances(daily_balances(db, month, account_id), resolution)
+    return [{"date": period, "balance": balance} for period, balance in downsample_lttb(points, max_points)]
+
+
+def daily_balances(
+    db: Session, month: Optional[str] = None, account_id: str = models.DEFAULT_ACCOUNT_ID
+) -> List[Tuple[str, float]]:
+    """`(día, saldo de cierre)` ordenado por día; los abonos suman y el resto de movimientos resta."""
+    day = func.substr(models.Expense.date, 1, 10)
+    signed_amount = case(
+        (models.Expense.transaction_type == "abono", models.Expense.amount),
+        else_=-models.Expense.amount,
+    )
+    per_day = select(day.label("day"), func.sum(signed_amount).label("net")).where(
+        models.Expense.account_id == account_id, models.Expense.date.isnot(None)
+    )
+    if month:
+        per_day = per_day.where(models.Expense.date.like(f"{month}%"))
+    per_day = per_day.group_by(day).subquery()
+
+    running = select(
+        per_day.c.day,
+        func.sum(per_day.c.net).over(order_by=per_day.c.day).label("balance"),
+    ).order_by(per_day.c.day)
+    return [(row.day, float(row.balance or 0.0)) for row in db.execute(running)]
+
+
+def bucket_balances(daily: List[Tuple[str, float]], resolution: str) -> List[Tuple[str, float]]:
+    """Agrupa los cierres diarios por semana (lunes) o mes, con el cierre del último día."""
+    if resolution == "day":
+        return daily
+
+    buckets: Dict[str, float] = {}
+    for day, balance in daily:
+        if resolution == "month":
+            key = day[:7]
+        else:
+            parsed = _parse_day(day)
+            key = (parsed - timedelta(days=parsed.weekday())).isoformat() if parsed else day
+        # Los días vienen ordenados: el último asignado es el cierre del período
+        buckets[key] = balance
+    return list(buckets.items())
+
+
+def downsample_lttb(points: List[Tuple[str, float]], max_points: int) -> List[Tuple[str, float]]:
+    """Reduce la serie a `max_points` puntos con LTTB; conserva siempre el primero y el último."""
+    if max_points < 3 or len(points) <= max_points:
+        return points if len(points) <= max(max_points, 2) else [points[0], points[-1]]
+
+    xs = _x_positions(points)
+    ys = [balance for _, balance in points]
+    sampled = [0]
+    bucket_size = (len(points) - 2) / (max_points - 2)
+    selected = 0
+
+    for bucket in range(max_points - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+        # Promedio del bucket siguiente (o el último punto) como tercer vértice
+        next_start, next_end = end, min(int((bucket + 2) * bucket_size) + 1, len(points))
+        if next_start >= next_end:
+            next_start, next_end = len(points) - 1, len(points)
+        avg_x = sum(xs[next_start:next_end]) / (next_end - next_start)
+        avg_y = sum(ys[next_start:next_end]) / (next_end - next_start)
+
+        best_area, best_index = -1.0, start
+        for index in range(start, end):
+            area = abs(
+                (xs[selected] - avg_x) * (ys[index] - ys[selected])
+                - (xs[selected] - xs[index]) * (avg_y - ys[selected])
+            )
+            if area > best_area:
+                best_area, best_index = area, index
+        sampled.append(best_index)
+        selected = best_index
+
+    sampled.append(len(points) - 1)
+    return [points[index] for index in sampled]
+
+
+def _x_positions(points: List[Tuple[str, float]]) -> List[float]:
+    """Días desde el primer punto, para que LTTB respete la separación temporal real."""
+    xs: List[float] = []
+    for index, (period, _) in enumerate(points):
+        parsed = _parse_day(period if len(period) >= 10 else f"{period}-01")
+        if parsed is None or (xs and parsed.toordinal() <= xs[-1]):
+            xs.append(xs[-1] + 1 if xs else float(index))
+        else:
+            xs.append(float(parsed.toordinal()))
+    return xs
+
+
+def _parse_day(value: str) -> Optional[date]:
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        return None
@@ -0,0 +1,301 @@
+"""Clasificación de cargos (suscripciones, compras diarias, pagos excepcionales, otros).
+
+La clase se calcula al ingerir y se guarda en `Expense.charge_class` (indexada), de
+modo que el resumen del dashboard es un solo `GROUP BY`. Además de las palabras clave
+del arquetipo y la categoría de comercio, un comercio se considera suscripción si sus
+cargos se repiten con periodicidad regular (semanal, quincenal, mensual, trimestral o
+anual) y montos parecidos.
+
+Como la periodicidad depende del historial completo del comercio dentro de la cuenta, se
+reclasifican todas las filas de los comercios afectados (`classify_vendors`) al insertar,
+editar o eliminar. El umbral de `pagos_excepcionales` depende además del ticket promedio
+de toda la cuenta; cuando se mueve, `classify_ticket_drift` corrige las filas de otros
+comercios que quedaron del lado equivocado, así que no hace falta reconstruir.
+`start_rebuild` recalcula una cuenta o la tabla completa (o sólo las filas sin clase) en
+un hilo aparte.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import defaultdict
+from datetime import date
+from statistics import mean, median, pstdev
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, func, or_, update
+
+from app import models
+from app.database import SessionLocal
+
+CHARGE_CLASSES = ("suscripciones", "compras_diarias", "pagos_excepcionales", "otros")
+
+SUBSCRIPTION_KEYWORDS = ("suscripción", "suscripcion", "subscription", "recurrente", "mensual")
+DAILY_KEYWORDS = ("comida", "restaurante", "supermercado", "transporte", "gasolinera", "cafetería", "cafeteria")
+
+# Períodos reconocidos en días y tolerancia relativa de cada intervalo
+RECURRING_PERIODS = (7, 14, 30.4, 91.3, 365.25)
+PERIOD_TOLERANCE = 0.2
+# Fracción de intervalos que deben calzar con el período
+MIN_PERIODIC_SHARE = 0.7
+MIN_RECURRING_OCCURRENCES = 3
+# Coeficiente de variación máximo de los montos de una suscripción
+MAX_AMOUNT_VARIATION = 0.25
+EXCEPTIONAL_TICKET_MULTIPLIER = 3
+REBUILD_BATCH = 200
+
+_rebuild_lock = threading.Lock()
+_rebuild_status: Dict = {"running": False}
+
+
+def classify(
+    charge_archetype: Optional[str],
+    merchant_category: Optional[str],
+    is_fixed: Optional[str],
+    amount: float,
+    recurring: bool,
+    average_ticket: float,
+) -> str:
+    archetype = (charge_archetype or "").lower()
+    merchant = (merchant_category or "").lower()
+    if any(keyword in archetype for keyword in SUBSCRIPTION_KEYWORDS):
+        return "suscripciones"
+    if any(keyword in archetype or keyword in merchant for keyword in DAILY_KEYWORDS):
+        return "compras_diarias"
+    if recurring:
+        return "suscripciones"
+    if is_fixed == "fixed" or amount > average_ticket * EXCEPTIONAL_TICKET_MULTIPLIER:
+        return "pagos_excepcionales"
+    return "otros"
+
+
+def is_recurring(charges: List[Tuple[Optional[str], float]]) -> bool:
+    """`charges` son `(fecha, monto)` de los cargos de un comercio."""
+    dated = sorted((parsed, amount) for parsed, amount in ((_parse_day(day), amount) for day, amount in charges) if parsed)
+    days = sorted({parsed for parsed, _ in dated})
+    if len(days) < MIN_RECURRING_OCCURRENCES:
+        return False
+
+    amounts = [amount for _, amount in dated]
+    average = mean(amounts)
+    if average <= 0 or pstdev(amounts) / average > MAX_AMOUNT_VARIATION:
+        return False
+
+    intervals = [(current - previous).days for previous, current in zip(days, days[1:])]
+    typical = median(intervals)
+    for period in RECURRING_PERIODS:
+        tolerance = period * PERIOD_TOLERANCE
+        if abs(typical - period) > tolerance:
+            continue
+        matching = sum(1 for interval in intervals if abs(interval - period) <= tolerance)
+        return matching / len(intervals) >= MIN_PERIODIC_SHARE
+    return False
+
+
+def vendor_of(merchant_normalized: Optional[str], vendor: Optional[str]) -> Optional[str]:
+    return merchant_normalized or vendor
+
+
+def classify_vendors(
+    db,
+    vendor_keys: Iterable[Optional[str]],
+    average_ticket: Optional[float] = None,
+    account_id: str = models.DEFAULT_ACCOUNT_ID,
+) -> int:
+    """Reclasifica todas las filas de los comercios indicados en la cuenta. No hace commit.
+
+    Retorna cuántas filas cambiaron de clase.
+    """
+    keys = {key for key in vendor_keys if key}
+    if not keys:
+        return 0
+    if average_ticket is None:
+        average_ticket = _average_ticket(db, account_id)
+
+    expense = models.Expense
+    rows = (
+        db.query(
+            expense.id, expense.merchant_normalized, expense.vendor, expense.date, expense.amount,
+            expense.transaction_type, expense.charge_archetype, expense.merchant_category,
+            expense.is_fixed, expense.charge_class,
+        )
+        .filter(expense.account_id == account_id, or_(
+            expense.merchant_normalized.in_(keys),
+            and_(expense.merchant_normalized.is_(None), expense.vendor.in_(keys)),
+        ))
+        .all()
+    )
+    by_vendor: Dict[str, List] = defaultdict(list)
+    for row in rows:
+        by_vendor[vendor_of(row.merchant_normalized, row.vendor)].append(row)
+
+    changes = []
+    for vendor_rows in by_vendor.values():
+        recurring = is_recurring([(row.date, row.amount) for row in vendor_rows if row.transaction_type == "cargo"])
+        changes.extend(_changes(vendor_rows, recurring, average_ticket))
+    if changes:
+        db.execute(update(expense), changes)
+    return len(changes)
+
+
+def classify_rows(db, rows: Iterable[Dict], account_id: str = models.DEFAULT_ACCOUNT_ID) -> int:
+    """Reclasifica los comercios de filas recién insertadas o editadas. No hace commit."""
+    vendors = {vendor_of(row.get("merchant_normalized"), row.get("vendor")) for row in rows}
+    average_ticket = _average_ticket(db, account_id)
+    updated = classify_vendors(db, vendors, average_ticket, account_id)
+    if None in vendors:
+        updated += classify_unattributed(db, average_ticket, account_id)
+    return updated + classify_ticket_drift(db, average_ticket, account_id)
+
+
+def classify_ticket_drift(
+    db, average_ticket: Optional[float] = None, account_id: str = models.DEFAULT_ACCOUNT_ID
+) -> int:
+    """Reclasifica las filas cuya clase cambió sólo porque se movió el ticket promedio. No hace commit.
+
+    Entre `otros` y `pagos_excepcionales` decide únicamente el monto contra el umbral (las
+    demás clases tienen prioridad en `classify` y no dependen de él), así que basta buscar
+    las filas de esas dos clases que quedaron del lado equivocado.
+    """
+    if average_ticket is None:
+        average_ticket = _average_ticket(db, account_id)
+    threshold = average_ticket * EXCEPTIONAL_TICKET_MULTIPLIER
+    expense = models.Expense
+    rows = (
+        db.query(
+            expense.id, expense.amount, expense.charge_archetype, expense.merchant_category,
+            expense.is_fixed, expense.charge_class,
+        )
+        .filter(expense.account_id == account_id, or_(
+            and_(expense.charge_class == "otros", expense.amount > threshold),
+            and_(
+                expense.charge_class == "pagos_excepcionales",
+                expense.amount <= threshold,
+                func.coalesce(expense.is_fixed, "") != "fixed",
+            ),
+        ))
+        .all()
+    )
+    # Ninguna es recurrente: un comercio recurrente ya habría quedado en `suscripciones`
+    changes = _changes(rows, False, average_ticket)
+    if changes:
+        db.execute(update(expense), changes)
+    return len(changes)
+
+
+def classify_unattributed(
+    db, average_ticket: Optional[float] = None, account_id: str = models.DEFAULT_ACCOUNT_ID
+) -> int:
+    """Clasifica las filas sin comercio, que no tienen historial para medir periodicidad."""
+    if average_ticket is None:
+        average_ticket = _average_ticket(db, account_id)
+    expense = models.Expense
+    rows = (
+        db.query(
+            expense.id, expense.amount, expense.charge_archetype, expense.merchant_category,
+            expense.is_fixed, expense.charge_class,
+        )
+        .filter(expense.account_id == account_id, expense.merchant_normalized.is_(None), expense.vendor.is_(None))
+        .all()
+    )
+    changes = _changes(rows, False, average_ticket)
+    if changes:
+        db.execute(update(expense), changes)
+    return len(changes)
+
+
+def rebuild(db, only_missing: bool = False, account_id: Optional[str] = None) -> Dict:
+    """Clasifica una cuenta (o todas si `account_id` es None) por lotes de comercios, con
+    commit por lote."""
+    started = time.perf_counter()
+    expense = models.Expense
+    vendor_column = func.coalesce(expense.merchant_normalized, expense.vendor)
+    query = db.query(expense.account_id, vendor_column)
+    if account_id is not None:
+        query = query.filter(expense.account_id == account_id)
+    if only_missing:
+        query = query.filter(expense.charge_class.is_(None))
+    vendors_by_account: Dict[str, List[Optional[str]]] = defaultdict(list)
+    for account, key in query.distinct().all():
+        vendors_by_account[account].append(key)
+
+    total_vendors = sum(len(keys) for keys in vendors_by_account.values())
+    vendors_done = 0
+    updated = 0
+    for account, keys in vendors_by_account.items():
+        average_ticket = _average_ticket(db, account)
+        vendors = [key for key in keys if key]
+        for start in range(0, len(vendors), REBUILD_BATCH):
+            batch = vendors[start:start + REBUILD_BATCH]
+            updated += classify_vendors(db, batch, average_ticket, account)
+            db.commit()
+            vendors_done += len(batch)
+            _rebuild_status.update({"vendors_done": vendors_done, "updated": updated})
+        if None in keys:
+            updated += classify_unattributed(db, average_ticket, account)
+            db.commit()
+
+    result = {
+        "accounts": len(vendors_by_account),
+        "vendors": total_vendors,
+        "updated": updated,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    print(f"[ChargeClassifier] Clasificación {'de filas faltantes' if only_missing else 'completa'}: {result}")
+    return result
+
+
+def start_rebuild(only_missing: bool = False, account_id: Optional[str] = None) -> bool:
+    """Lanza `rebuild` en un hilo. Retorna False si ya hay uno en curso."""
+    if not _rebuild_lock.acquire(blocking=False):
+        return False
+    _rebuild_status.clear()
+    _rebuild_status.update({
+        "running": True, "account_id": account_id, "only_missing": only_missing, "vendors_done": 0, "updated": 0,
+    })
+
+    def run() -> None:
+        db = SessionLocal()
+        try:
+            _rebuild_status.update(rebuild(db, only_missing, account_id))
+        except Exception as e:
+            db.rollback()
+            _rebuild_status["error"] = str(e)
+            print(f"[ChargeClassifier] Error clasificando cargos: {str(e)}")
+        finally:
+            db.close()
+            _rebuild_status["running"] = False
+            _rebuild_lock.release()
+
+    threading.Thread(target=run, name="charge-classifier", daemon=True).start()
+    return True
+
+
+def rebuild_status() -> Dict:
+    return dict(_rebuild_status)
+
+
+def _changes(rows, recurring: bool, average_ticket: float) -> List[Dict]:
+    changes = []
+    for row in rows:
+        charge_class = classify(
+            row.charge_archetype, row.merchant_category, row.is_fixed, row.amount or 0.0, recurring, average_ticket
+        )
+        if charge_class != row.charge_class:
+            changes.append({"id": row.id, "charge_class": charge_class})
+    return changes
+
+
+def _average_ticket(db, account_id: str) -> float:
+    return float(
+        db.query(func.avg(models.Expense.amount)).filter(models.Expense.account_id == account_id).scalar() or 0.0
+    )
+
+
+def _parse_day(value: Optional[str]) -> Optional[date]:
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        return None
@@ -0,0 +1,75 @@
+"""Filtros de `/expenses/` resueltos en SQL.
+
+Todas las consultas se limitan a la cuenta del request (partición de `expenses` en
+PostgreSQL, ver `accounts`). Cada filtro usa un índice (ver
+`migrations/versions/0002_expense_filter_indexes.py`):
+B-tree en fecha, monto, comercio y vendor, índice parcial para `is_suspicious = true`
+y, en PostgreSQL, un índice GIN de trigramas sobre `search_document()` para la búsqueda
+de texto libre con `ILIKE '%término%'`. La expresión de búsqueda se arma con literales
+(no parámetros) para que coincida con la del índice.
+"""
+from __future__ import annotations
+
+from typing import Optional
+
+from sqlalchemy import func, literal_column, or_
+
+from app import models
+
+
+def search_document():
+    """`coalesce(vendor, '') || ' ' || coalesce(description, '') || ' ' || coalesce(charge_origin, '')`"""
+    empty = literal_column("''")
+    space = literal_column("' '")
+    return (
+        func.coalesce(models.Expense.vendor, empty)
+        .concat(space)
+        .concat(func.coalesce(models.Expense.description, empty))
+        .concat(space)
+        .concat(func.coalesce(models.Expense.charge_origin, empty))
+    )
+
+
+def apply_filters(
+    query,
+    account_id: str,
+    category: Optional[str] = None,
+    vendor: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    transaction_type: Optional[str] = None,
+    is_suspicious: Optional[bool] = None,
+    q: Optional[str] = None,
+):
+    """Aplica los filtros informados. Las fechas son `YYYY-MM-DD` inclusivas, como se guardan."""
+    expense = models.Expense
+    query = query.filter(expense.account_id == account_id)
+    if category:
+        query = query.filter(expense.category == category)
+    if vendor:
+        query = query.filter(or_(expense.merchant_normalized == vendor, expense.vendor == vendor))
+    if date_from:
+        query = query.filter(expense.date >= date_from)
+    if date_to:
+        query = query.filter(expense.date <= date_to)
+    if min_amount is not None:
+        query = query.filter(expense.amount >= min_amount)
+    if max_amount is not None:
+        query = query.filter(expense.amount <= max_amount)
+    if transaction_type:
+        query = query.filter(expense.transaction_type == transaction_type)
+    if is_suspicious is True:
+        query = query.filter(expense.is_suspicious.is_(True))
+    elif is_suspicious is False:
+        query = query.filter(or_(expense.is_suspicious.is_(False), expense.is_suspicious.is_(None)))
+    if q:
+        document = search_document()
+        for term in q.split():
+            query = query.filter(document.ilike(f"%{_escape_like(term)}%", escape="\\"))
+    return query
+
+
+def _escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
@@ -0,0 +1,210 @@
+"""Escritura de transacciones extraídas en `expenses`.
+
+Compartido por los endpoints de upload, el pipeline de ingesta y la ingesta masiva
+(`python -m app.ingest`), para que todos persistan exactamente los mismos campos.
+
+Cada fila lleva un `fingerprint` (fecha, monto, comercio normalizado, tipo y un número
+de secuencia para repeticiones idénticas del mismo día dentro de la cartola) con índice
+único por cuenta; las inserciones usan `ON CONFLICT DO NOTHING`, así que subir dos veces
+la misma cartola, o cartolas que se traslapan, no duplica movimientos.
+"""
+from __future__ import annotations
+
+import hashlib
+from collections import defaultdict
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import insert, or_, update
+
+from app import models
+from app.services.merchant_dictionary import vendor_key
+
+# Fingerprints por consulta `IN` al buscar colisiones en `backfill_fingerprints`
+BACKFILL_LOOKUP_BATCH = 1000
+
+
+def expense_values(transaction: Dict, pdf_filename: str, pdf_path: str, account_id: str = models.DEFAULT_ACCOUNT_ID) -> Dict:
+    return {
+        "account_id": account_id,
+        "category": transaction["category"],
+        "amount": transaction["amount"],
+        "date": transaction.get("date"),
+        "vendor": transaction.get("vendor"),
+        "description": transaction.get("description"),
+        "is_fixed": transaction.get("is_fixed", "variable"),
+        "channel": transaction.get("channel"),
+        "merchant_normalized": transaction.get("merchant_normalized"),
+        "merchant_category": transaction.get("merchant_category"),
+        "transaction_type": transaction.get("transaction_type", "cargo"),
+        "charge_archetype": transaction.get("charge_archetype"),
+        "charge_origin": transaction.get("charge_origin"),
+        "is_suspicious": transaction.get("is_suspicious", False),
+        "suspicious_reason": transaction.get("suspicious_reason"),
+        "suspicion_score": transaction.get("suspicion_score"),
+        "detector_features": transaction.get("detector_features"),
+        "pdf_filename": pdf_filename,
+        "pdf_path": str(pdf_path),
+        "analysis_method": transaction.get("analysis_method"),
+        "fingerprint": transaction.get("fingerprint"),
+        # ISO-8601 en UTC: como texto ordena cronológicamente (GET /expenses/ pagina por aquí)
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def fingerprint_key(transaction: Dict) -> Optional[Tuple[str, str, str, str]]:
+    """Campos normalizados que identifican un movimiento; `None` para filas de error."""
+    if transaction.get("analysis_method") == "failed" or not transaction.get("date"):
+        return None
+    try:
+        amount = Decimal(str(transaction.get("amount") or 0)).quantize(Decimal("0.01"))
+    except InvalidOperation:
+        return None
+    return (
+        str(transaction.get("date"))[:10],
+        str(abs(amount)),
+        vendor_key(transaction.get("vendor")) or "",
+        transaction.get("transaction_type") or "cargo",
+    )
+
+
+def compute_fingerprint(key: Tuple[str, str, str, str], sequence: int) -> str:
+    return hashlib.sha256("|".join((*key, str(sequence))).encode("utf-8")).hexdigest()
+
+
+def assign_fingerprints(transactions: List[Dict]) -> None:
+    """Asigna `fingerprint` a cada transacción de una misma cartola.
+
+    Movimientos idénticos del mismo día (p. ej. dos cafés del mismo monto) reciben
+    secuencias 0, 1, ... en el orden de la cartola, de modo que una cartola que se
+    traslapa con otra produce los mismos fingerprints para los días compartidos.
+    """
+    seen: Dict[Tuple, int] = defaultdict(int)
+    for transaction in transactions:
+        key = fingerprint_key(transaction)
+        if key is None:
+            transaction["fingerprint"] = None
+            continue
+        transaction["fingerprint"] = compute_fingerprint(key, seen[key])
+        seen[key] += 1
+
+
+def drop_existing(db, transactions: List[Dict], account_id: str = models.DEFAULT_ACCOUNT_ID) -> List[Dict]:
+    """Asigna fingerprints a toda la cartola y retorna sólo las transacciones que la cuenta aún no tiene.
+
+    Se llama antes de enriquecer y de correr el detector, para no pagar llamadas al LLM ni
+    explicaciones por movimientos que `insert_expenses` descartaría. Los fingerprints quedan
+    asignados con las secuencias de la cartola completa; no se deben recalcular sobre la
+    lista filtrada.
+    """
+    assign_fingerprints(transactions)
+    fingerprints = {transaction["fingerprint"] for transaction in transactions if transaction.get("fingerprint")}
+    if not fingerprints:
+        return transactions
+    existing = {
+        fingerprint for (fingerprint,) in db.query(models.Expense.fingerprint).filter(
+            models.Expense.account_id == account_id, models.Expense.fingerprint.in_(fingerprints)
+        )
+    }
+    return [transaction for transaction in transactions if transaction.get("fingerprint") not in existing]
+
+
+def insert_expenses(db, rows: List[Dict]) -> List[Dict]:
+    """Inserta las filas en un solo `executemany`, omitiendo fingerprints ya existentes.
+
+    Retorna las filas efectivamente insertadas. El commit queda a cargo del llamador.
+    """
+    if not rows:
+        return []
+    statement = _insert_ignoring_duplicates(db)
+    if statement is None:
+        db.execute(insert(models.Expense), rows)
+        return rows
+
+    inserted = set(db.execute(statement.returning(models.Expense.fingerprint), rows).scalars())
+    return [row for row in rows if row.get("fingerprint") is None or row["fingerprint"] in inserted]
+
+
+def backfill_fingerprints(db) -> int:
+    """Calcula el fingerprint de las filas antiguas que no lo tienen. No hace commit.
+
+    Lo ejecuta una sola vez la migración 0009. Sólo se leen las filas con clave calculable
+    (con fecha y que no son errores de extracción) y, para evitar colisiones, sólo los
+    fingerprints candidatos de sus cuentas, no la tabla completa. Los duplicados ya
+    existentes no se eliminan: reciben secuencias distintas, igual que repeticiones del
+    mismo día. Las cartolas que se suban después sí se deduplican.
+    """
+    expense = models.Expense
+    rows = (
+        db.query(
+            expense.id, expense.account_id, expense.date, expense.amount, expense.vendor,
+            expense.transaction_type, expense.analysis_method,
+        )
+        .filter(
+            expense.fingerprint.is_(None),
+            expense.date.isnot(None),
+            or_(expense.analysis_method.is_(None), expense.analysis_method != "failed"),
+        )
+        .order_by(expense.id)
+        .all()
+    )
+    pending = []
+    for row in rows:
+        key = fingerprint_key(row._asdict())
+        if key is not None:
+            pending.append([row.id, row.account_id, key, 0])
+    if not pending:
+        return 0
+
+    # Por rondas: cada fila prueba su secuencia actual y avanza si ya está tomada, en la
+    # base o por una fila anterior de esta misma pasada
+    claimed = set()
+    changes = []
+    while pending:
+        candidates = {(account, compute_fingerprint(key, sequence)) for _, account, key, sequence in pending}
+        taken = _existing_fingerprints(db, candidates)
+        retry = []
+        for item in pending:
+            expense_id, account, key, sequence = item
+            fingerprint = compute_fingerprint(key, sequence)
+            if (account, fingerprint) in taken or (account, fingerprint) in claimed:
+                item[3] += 1
+                retry.append(item)
+                continue
+            claimed.add((account, fingerprint))
+            changes.append({"id": expense_id, "fingerprint": fingerprint})
+        pending = retry
+
+    db.execute(update(expense), changes)
+    print(f"[ExpenseStore] Fingerprint calculado para {len(changes)} transacciones existentes")
+    return len(changes)
+
+
+def _existing_fingerprints(db, candidates: Set[Tuple[str, str]]) -> Set[Tuple[str, str]]:
+    by_account: Dict[str, List[str]] = defaultdict(list)
+    for account, fingerprint in candidates:
+        by_account[account].append(fingerprint)
+    existing = set()
+    for account, fingerprints in by_account.items():
+        for start in range(0, len(fingerprints), BACKFILL_LOOKUP_BATCH):
+            batch = fingerprints[start:start + BACKFILL_LOOKUP_BATCH]
+            existing.update(
+                (account, fingerprint)
+                for (fingerprint,) in db.query(models.Expense.fingerprint).filter(
+                    models.Expense.account_id == account, models.Expense.fingerprint.in_(batch)
+                )
+            )
+    return existing
+
+
+def _insert_ignoring_duplicates(db):
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        print(f"[ExpenseStore] Dialecto '{dialect}' sin ON CONFLICT: se inserta sin deduplicar")
+        return None
+    return dialect_insert(models.Expense).on_conflict_do_nothing(index_elements=["account_id", "fingerprint"])
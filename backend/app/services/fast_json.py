@@ -0,0 +1,114 @@
+"""Respuestas JSON rápidas para listados y estadísticas.
+
+Con `FAST_JSON_RESPONSES=1`, `/expenses/` y `/expenses/stats` consultan sólo las
+columnas del schema (tuplas, sin instanciar entidades ORM), arman los dicts directamente
+y los serializan con orjson, sin construir un modelo Pydantic por fila. La salida tiene
+las mismas claves, orden y valores por defecto que `schemas.Expense`.
+
+Las respuestas sobre `COMPRESSION_MIN_BYTES` se comprimen con brotli (si está instalado)
+o gzip según `Accept-Encoding`. Sin orjson se usa el `json` de la librería estándar.
+"""
+from __future__ import annotations
+
+import gzip
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from fastapi import Request, Response
+from pydantic_core import PydanticUndefined
+
+from app import models, schemas
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependencia opcional
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - dependencia opcional
+    brotli = None
+
+FAST_JSON_RESPONSES = os.getenv("FAST_JSON_RESPONSES", "").lower() in ("1", "true", "yes")
+COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "5"))
+BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "4"))
+
+# Mismo orden de campos que serializa `schemas.Expense`
+EXPENSE_FIELDS = tuple(schemas.Expense.model_fields)
+EXPENSE_COLUMNS = tuple(getattr(models.Expense, name) for name in EXPENSE_FIELDS)
+_EXPENSE_DEFAULTS = {
+    name: field.default
+    for name, field in schemas.Expense.model_fields.items()
+    if field.default is not None and field.default is not PydanticUndefined
+}
+_STRING_FIELDS = ("date", "created_at", "updated_at")
+
+
+def expense_rows(rows) -> List[Dict[str, Any]]:
+    """Convierte tuplas de `EXPENSE_COLUMNS` en dicts con la forma de `schemas.Expense`."""
+    defaults = _EXPENSE_DEFAULTS
+    result = []
+    for row in rows:
+        item = dict(zip(EXPENSE_FIELDS, row))
+        for name, default in defaults.items():
+            if item[name] is None:
+                item[name] = default
+        for name in _STRING_FIELDS:
+            value = item[name]
+            if value is not None and not isinstance(value, str):
+                item[name] = value.isoformat() if isinstance(value, (date, datetime)) else (str(value) or None)
+        result.append(item)
+    return result
+
+
+def dumps(payload: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def json_response(request: Request, payload: Any, headers: Optional[Dict[str, str]] = None) -> Response:
+    body = dumps(payload)
+    response_headers = dict(headers or {})
+    encoding = _negotiate_encoding(request.headers.get("accept-encoding", ""), len(body))
+    if encoding == "br":
+        body = brotli.compress(body, quality=BROTLI_QUALITY)
+    elif encoding == "gzip":
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+    if encoding:
+        response_headers["Content-Encoding"] = encoding
+    response_headers["Vary"] = "Accept-Encoding"
+    return Response(content=body, media_type="application/json", headers=response_headers)
+
+
+def _negotiate_encoding(accept_encoding: str, size: int) -> Optional[str]:
+    if size < COMPRESSION_MIN_BYTES:
+        return None
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        try:
+            quality = float(params.split("q=", 1)[1]) if "q=" in params else 1.0
+        except ValueError:
+            quality = 1.0
+        if quality > 0:
+            accepted.add(name.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
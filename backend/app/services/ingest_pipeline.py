@@ -0,0 +1,344 @@
+"""Pipeline de ingesta de cartolas por etapas con colas acotadas.
+
+Cada upload pasa por store -> convert -> extract -> enrich -> detect -> persist. Cada
+etapa tiene sus propios hilos y una `queue.Queue` acotada de entrada: si una etapa se
+atrasa, su cola se llena y las anteriores se bloquean al encolar (backpressure) en vez
+de acumular trabajo en memoria. Los hilos por etapa se configuran con
+`INGEST_<ETAPA>_WORKERS`, p. ej. más workers de Docling (CPU) en `convert` y más
+concurrencia de I/O hacia el LLM en `extract`/`enrich`.
+
+`convert` y `extract` se solapan por ventana de páginas: `convert` entrega el trabajo a
+`extract` antes de empezar y le pasa cada ventana de texto por una cola acotada
+(`INGEST_WINDOW_QUEUE_SIZE`) apenas Docling la produce, así que nunca hay más que unas
+pocas ventanas del documento en memoria.
+
+`detect` y `persist` se inyectan desde `main` al iniciar (`start`), para reutilizar la
+misma detección y persistencia que los demás endpoints de upload. Cada trabajo lleva la
+cuenta del request que lo encoló.
+"""
+from __future__ import annotations
+
+import os
+import queue
+import shutil
+import threading
+import time
+from concurrent.futures import Future
+from typing import BinaryIO, Callable, Dict, List, Optional
+
+from app import models
+from app.database import SessionLocal
+from app.services import expense_store, merchant_dictionary, metrics, openai_service, pdf_text
+
+STAGE_NAMES = ("store", "convert", "extract", "enrich", "detect", "persist")
+DEFAULT_WORKERS = {"store": 2, "convert": 1, "extract": 4, "enrich": 4, "detect": 2, "persist": 1}
+QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "8"))
+# Tiempo máximo esperando lugar en la primera cola antes de rechazar el upload
+SUBMIT_TIMEOUT = float(os.getenv("INGEST_SUBMIT_TIMEOUT_SECONDS", "30"))
+# Ventanas de texto convertidas que pueden esperar a `extract` por trabajo
+WINDOW_QUEUE_SIZE = int(os.getenv("INGEST_WINDOW_QUEUE_SIZE", "2"))
+# Etapas que pasan el trabajo a la siguiente antes de procesarlo y le envían resultados parciales
+STREAMING_STAGES = ("convert",)
+
+
+class PipelineBusy(RuntimeError):
+    """La cola de entrada sigue llena tras `SUBMIT_TIMEOUT`."""
+
+
+class IngestJob:
+    def __init__(self, source: BinaryIO, file_path: str, pdf_filename: str, account_id: str = models.DEFAULT_ACCOUNT_ID):
+        self.source: Optional[BinaryIO] = source
+        self.file_path = file_path
+        self.pdf_filename = pdf_filename
+        self.account_id = account_id
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+        self.timings: Dict[str, float] = {}
+        self.report: Dict = {}
+        self.context: Dict = {}
+        # Texto de cada ventana (de `convert` a `extract`); `None` marca el fin
+        self.windows: "queue.Queue" = queue.Queue(maxsize=max(1, WINDOW_QUEUE_SIZE))
+        # Por ventana: (transacciones del LLM, transacciones parseadas pendientes de enriquecer)
+        self.extracted: List = []
+        self.transactions: List[Dict] = []
+        # Movimientos que la cuenta ya tenía, descartados antes de enriquecer y detectar
+        self.duplicates_skipped = 0
+        self.extraction_path: Optional[str] = None
+        self.created: List[Dict] = []
+
+
+class Stage:
+    def __init__(self, name: str, handler: Callable[[IngestJob], None], workers: int, queue_size: int):
+        self.name = name
+        self.handler = handler
+        self.streaming = name in STREAMING_STAGES
+        self.workers = max(1, workers)
+        self.queue: "queue.Queue[IngestJob]" = queue.Queue(maxsize=queue_size)
+        self.next: Optional[Stage] = None
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.max_seconds = 0.0
+        self.wait_seconds = 0.0
+
+    def start(self) -> None:
+        for index in range(self.workers):
+            threading.Thread(target=self._work, name=f"ingest-{self.name}-{index}", daemon=True).start()
+
+    def _work(self) -> None:
+        while True:
+            job = self.queue.get()
+            started = time.monotonic()
+            with self.lock:
+                self.in_flight += 1
+                self.wait_seconds += started - job.enqueued_at
+            if self.streaming:
+                self._forward(job)
+            ok = False
+            try:
+                self.handler(job)
+                ok = True
+            except Exception as e:
+                print(f"[IngestPipeline] Error en etapa '{self.name}' para {job.pdf_filename}: {str(e)}")
+                if not job.future.done():
+                    job.future.set_exception(e)
+            finally:
+                elapsed = time.monotonic() - started
+                with self.lock:
+                    self.in_flight -= 1
+                    self.busy_seconds += elapsed
+                    self.max_seconds = max(self.max_seconds, elapsed)
+                    if ok:
+                        self.processed += 1
+                    else:
+                        self.failed += 1
+                self.queue.task_done()
+
+            if not ok:
+                continue
+            job.timings[self.name] = round(elapsed, 3)
+            if not self.streaming:
+                self._forward(job)
+
+    def _forward(self, job: IngestJob) -> None:
+        if self.next is not None:
+            job.enqueued_at = time.monotonic()
+            # Bloquea si la siguiente etapa está saturada
+            self.next.queue.put(job)
+        elif not job.future.done():
+            job.future.set_result(job)
+
+    def stats(self, uptime: float) -> Dict:
+        with self.lock:
+            completed = self.processed + self.failed
+            return {
+                "workers": self.workers,
+                "queue_depth": self.queue.qsize(),
+                "queue_capacity": self.queue.maxsize,
+                "in_flight": self.in_flight,
+                "processed": self.processed,
+                "failed": self.failed,
+                "avg_seconds": round(self.busy_seconds / completed, 3) if completed else None,
+                "max_seconds": round(self.max_seconds, 3),
+                "avg_queue_wait_seconds": round(self.wait_seconds / completed, 3) if completed else None,
+                "throughput_per_minute": round(self.processed / uptime * 60, 2) if uptime > 0 else 0.0,
+                "utilization": round(self.busy_seconds / (uptime * self.workers), 3) if uptime > 0 else 0.0,
+            }
+
+
+class IngestPipeline:
+    def __init__(self, handlers: Dict[str, Callable[[IngestJob], None]], workers: Dict[str, int], queue_size: int):
+        self.stages = [Stage(name, handlers[name], workers[name], queue_size) for name in STAGE_NAMES]
+        for current, following in zip(self.stages, self.stages[1:]):
+            current.next = following
+        self.started_at = time.monotonic()
+
+    def start(self) -> None:
+        for stage in self.stages:
+            stage.start()
+        print(
+            "[IngestPipeline] Iniciado: "
+            + ", ".join(f"{stage.name}={stage.workers}" for stage in self.stages)
+            + f" workers, colas de {self.stages[0].queue.maxsize}"
+        )
+
+    def submit(self, job: IngestJob, timeout: float = SUBMIT_TIMEOUT) -> Future:
+        job.enqueued_at = time.monotonic()
+        try:
+            self.stages[0].queue.put(job, timeout=timeout)
+        except queue.Full:
+            raise PipelineBusy("El pipeline de ingesta está saturado, intenta nuevamente en unos segundos")
+        return job.future
+
+    def stats(self) -> Dict:
+        uptime = time.monotonic() - self.started_at
+        return {
+            "uptime_seconds": round(uptime, 1),
+            "stages": {stage.name: stage.stats(uptime) for stage in self.stages},
+        }
+
+
+_pipeline: Optional[IngestPipeline] = None
+
+
+def start(detect: Callable, persist: Callable) -> IngestPipeline:
+    """Crea e inicia el pipeline global.
+
+    `detect(transactions, db, account_id)` retorna las transacciones anotadas y
+    `persist(transactions, db, pdf_filename, file_path, account_id)` las filas creadas.
+    """
+    global _pipeline
+    if _pipeline is None:
+        handlers = {
+            "store": _store,
+            "convert": _convert,
+            "extract": _extract,
+            "enrich": _enrich,
+            "detect": _detect_handler(detect),
+            "persist": _persist_handler(persist),
+        }
+        workers = {
+            name: int(os.getenv(f"INGEST_{name.upper()}_WORKERS", str(DEFAULT_WORKERS[name])))
+            for name in STAGE_NAMES
+        }
+        _pipeline = IngestPipeline(handlers, workers, QUEUE_SIZE)
+        _pipeline.start()
+    return _pipeline
+
+
+def submit(source: BinaryIO, file_path: str, pdf_filename: str, account_id: str = models.DEFAULT_ACCOUNT_ID) -> Future:
+    if _pipeline is None:
+        raise RuntimeError("El pipeline de ingesta no está iniciado")
+    return _pipeline.submit(IngestJob(source, file_path, pdf_filename, account_id))
+
+
+def stats() -> Dict:
+    if _pipeline is None:
+        return {"uptime_seconds": 0.0, "stages": {}}
+    return _pipeline.stats()
+
+
+def _collect_metrics() -> List:
+    if _pipeline is None:
+        return []
+    samples = []
+    for stage in _pipeline.stages:
+        labels = {"stage": stage.name}
+        with stage.lock:
+            in_flight, processed, failed, busy = stage.in_flight, stage.processed, stage.failed, stage.busy_seconds
+        samples.extend([
+            ("ingest_queue_depth", "gauge", "Trabajos esperando en la cola de cada etapa", labels, stage.queue.qsize()),
+            ("ingest_in_flight", "gauge", "Trabajos en proceso por etapa", labels, in_flight),
+            ("ingest_stage_processed_total", "counter", "Trabajos completados por etapa", labels, processed),
+            ("ingest_stage_failed_total", "counter", "Trabajos fallidos por etapa", labels, failed),
+            ("ingest_stage_busy_seconds_total", "counter", "Tiempo acumulado de trabajo por etapa", labels, busy),
+        ])
+    return samples
+
+
+metrics.register_collector(_collect_metrics)
+
+
+def _store(job: IngestJob) -> None:
+    with open(job.file_path, "wb") as buffer:
+        shutil.copyfileobj(job.source, buffer)
+    job.source = None
+
+
+def _convert(job: IngestJob) -> None:
+    # El trabajo ya está en `extract`: siempre se cierra la cola para no dejarlo esperando
+    try:
+        for _, text in pdf_text.iter_text_windows(job.file_path, job.report):
+            # Bloquea si `extract` va atrasado con este documento
+            job.windows.put(text)
+    except pdf_text.PDFLimitExceeded as e:
+        # `extract` la relanza para que llegue al llamador (413)
+        job.windows.put(e)
+    except Exception as e:
+        print(f"Error analizando PDF con GPT-4o: {str(e)}")
+        job.context["error"] = str(e)
+    finally:
+        job.windows.put(None)
+
+
+def _extract(job: IngestJob) -> None:
+    while True:
+        window_text = job.windows.get()
+        if window_text is None:
+            return
+        if isinstance(window_text, pdf_text.PDFLimitExceeded):
+            raise window_text
+        if job.context.get("error"):
+            # Se sigue vaciando la cola para que `convert` no quede bloqueado
+            continue
+        try:
+            job.extracted.append(openai_service.extract_window(window_text, job.context))
+        except Exception as e:
+            print(f"Error analizando PDF con GPT-4o: {str(e)}")
+            job.context["error"] = str(e)
+
+
+def _enrich(job: IngestJob) -> None:
+    if job.context.get("error"):
+        job.transactions = openai_service.finalize_transactions([], job.context)
+        return
+
+    db = SessionLocal()
+    try:
+        extracted: List[Dict] = []
+        parsed_ids = set()
+        for llm_transactions, parsed in job.extracted:
+            extracted.extend(llm_transactions)
+            if parsed:
+                extracted.extend(parsed)
+                parsed_ids.update(id(transaction) for transaction in parsed)
+        if extracted:
+            job.extraction_path = "table_parser" if id(extracted[0]) in parsed_ids else extracted[0].get("extraction_path")
+
+        # Una cartola ya subida no vuelve a pasar por el LLM de enriquecimiento ni por el detector
+        new = expense_store.drop_existing(db, extracted, job.account_id)
+        job.duplicates_skipped = len(extracted) - len(new)
+        to_enrich = [transaction for transaction in new if id(transaction) in parsed_ids]
+        enriched = {}
+        if to_enrich:
+            enriched = dict(zip(map(id, to_enrich), openai_service.enrich_parsed_transactions(
+                to_enrich, merchant_lookup=lambda vendors: merchant_dictionary.lookup(db, vendors, job.account_id)
+            )))
+        transactions = [enriched.get(id(transaction), transaction) for transaction in new]
+        if extracted and not transactions:
+            # Todo estaba registrado: no se agrega la fila de "sin transacciones"
+            job.transactions = []
+        else:
+            job.transactions = openai_service.finalize_transactions(transactions, job.context)
+    except Exception as e:
+        print(f"Error analizando PDF con GPT-4o: {str(e)}")
+        job.context["error"] = str(e)
+        job.transactions = openai_service.finalize_transactions([], job.context)
+    finally:
+        db.close()
+    job.extracted = []
+
+
+def _detect_handler(detect: Callable) -> Callable[[IngestJob], None]:
+    def handler(job: IngestJob) -> None:
+        db = SessionLocal()
+        try:
+            job.transactions = detect(job.transactions, db, job.account_id)
+        finally:
+            db.close()
+    return handler
+
+
+def _persist_handler(persist: Callable) -> Callable[[IngestJob], None]:
+    def handler(job: IngestJob) -> None:
+        db = SessionLocal()
+        try:
+            job.created = persist(job.transactions, db, job.pdf_filename, job.file_path, job.account_id)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    return handler
@@ -0,0 +1,435 @@
+"""Capa resiliente sobre el cliente de OpenAI.
+
+Todas las llamadas al LLM pasan por `chat_completion`, que agrega:
+- deadline por llamada (incluye los reintentos),
+- reintentos con backoff exponencial y jitter ante 429, 5xx, timeouts y errores de conexión,
+- un semáforo global que limita las llamadas concurrentes,
+- un circuit breaker que, tras varios fallos seguidos, rechaza llamadas de inmediato
+  (`CircuitOpenError`) para que los llamadores usen su texto de respaldo,
+- contadores de latencia, reintentos y tokens por modelo (`stats_snapshot`).
+
+`achat_completion` es la variante asíncrona (AsyncOpenAI) con la misma política de
+deadline, reintentos, breaker y el mismo límite global de concurrencia. Las corrutinas
+corren en un único event loop de fondo (`run_async`) con un solo cliente asíncrono, así
+que uploads y reprocesos simultáneos comparten el pool de conexiones y el límite.
+
+El SDK de OpenAI se importa recién al crear el primer cliente, para no pagar su carga
+en el arranque de procesos que no llaman al LLM.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+from app.services import metrics, profiling
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+
+DEFAULT_OPENAI_BASE_URL = "https://api.openai.com/v1"
+
+DEFAULT_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "120"))
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+BACKOFF_BASE_SECONDS = float(os.getenv("OPENAI_BACKOFF_BASE_SECONDS", "0.5"))
+BACKOFF_MAX_SECONDS = float(os.getenv("OPENAI_BACKOFF_MAX_SECONDS", "8"))
+MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("OPENAI_BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("OPENAI_BREAKER_RESET_SECONDS", "30"))
+
+
+class CircuitOpenError(RuntimeError):
+    """El circuito está abierto: el proveedor falló repetidamente y no se intenta la llamada."""
+
+
+class DeadlineExceededError(TimeoutError):
+    """Se agotó el deadline de la llamada (incluyendo reintentos)."""
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.half_open_probe = False
+
+    @property
+    def state(self) -> str:
+        with self.lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """En estado half-open sólo deja pasar una llamada de prueba a la vez."""
+        with self.lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.half_open_probe:
+                self.half_open_probe = True
+                return True
+            return False
+
+    def release_probe(self) -> None:
+        """Libera la llamada de prueba half-open si no llegó a ejecutarse."""
+        with self.lock:
+            self.half_open_probe = False
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.half_open_probe = False
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.half_open_probe or self.consecutive_failures >= self.failure_threshold:
+                if self.opened_at is None or self.half_open_probe:
+                    print(f"[LLMClient] Circuit breaker abierto tras {self.consecutive_failures} fallos consecutivos")
+                self.opened_at = time.monotonic()
+            self.half_open_probe = False
+
+
+class LLMStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[str, float] = defaultdict(float)
+        self.models: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+
+    def increment(self, name: str, value: float = 1) -> None:
+        with self.lock:
+            self.counters[name] += value
+        metrics.LLM_EVENTS.inc(value, event=name)
+
+    def record_call(self, model: str, seconds: float, ok: bool) -> None:
+        with self.lock:
+            self.counters["calls"] += 1
+            self.counters["successes" if ok else "failures"] += 1
+            self.counters["latency_seconds_total"] += seconds
+            self.models[model]["calls"] += 1
+            self.models[model]["latency_seconds_total"] += seconds
+            self.models[model]["latency_seconds_max"] = max(self.models[model]["latency_seconds_max"], seconds)
+        metrics.LLM_REQUEST_SECONDS.observe(seconds, model=model, outcome="ok" if ok else "error")
+        profiling.record(f"llm.{model}", seconds)
+
+    def record_usage(self, model: str, usage) -> None:
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        with self.lock:
+            self.models[model]["prompt_tokens"] += prompt_tokens
+            self.models[model]["completion_tokens"] += completion_tokens
+        metrics.LLM_TOKENS.inc(prompt_tokens, model=model, kind="prompt")
+        metrics.LLM_TOKENS.inc(completion_tokens, model=model, kind="completion")
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            counters = dict(self.counters)
+            models = {model: dict(values) for model, values in self.models.items()}
+        calls = counters.get("calls", 0)
+        counters["latency_seconds_avg"] = counters.get("latency_seconds_total", 0) / calls if calls else 0.0
+        return {"counters": counters, "models": models}
+
+
+_client: Optional[OpenAI] = None
+_client_lock = threading.Lock()
+# Cupos compartidos por `chat_completion` y `achat_completion`
+_semaphore = threading.BoundedSemaphore(MAX_CONCURRENCY)
+_async_loop: Optional[asyncio.AbstractEventLoop] = None
+_async_client: Optional[AsyncOpenAI] = None
+_async_lock = threading.Lock()
+# Intervalo con el que una corrutina reintenta tomar un cupo sin bloquear el event loop
+SLOT_POLL_SECONDS = 0.02
+breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+stats = LLMStats()
+
+
+def get_client() -> OpenAI:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import OpenAI
+
+                # Los reintentos los maneja esta capa, no el SDK.
+                # OPENAI_BASE_URL permite apuntar a un servidor compatible (p. ej. loadtest/fake_openai.py)
+                _client = OpenAI(
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    base_url=os.getenv("OPENAI_BASE_URL") or DEFAULT_OPENAI_BASE_URL,
+                    timeout=DEFAULT_TIMEOUT,
+                    max_retries=0,
+                )
+    return _client
+
+
+def run_async(coroutine):
+    """Ejecuta la corrutina en el event loop de fondo y espera su resultado.
+
+    El cliente asíncrono queda ligado a ese loop, así que se reutiliza entre lotes.
+    No se debe llamar desde el propio loop de fondo.
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, _get_async_loop()).result()
+
+
+def _get_async_loop() -> asyncio.AbstractEventLoop:
+    global _async_loop
+    if _async_loop is None:
+        with _async_lock:
+            if _async_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-async", daemon=True).start()
+                _async_loop = loop
+    return _async_loop
+
+
+def _get_async_client() -> AsyncOpenAI:
+    # Sólo se llama desde el loop de fondo, que es un único hilo
+    global _async_client
+    if _async_client is None:
+        from openai import AsyncOpenAI
+
+        _async_client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=os.getenv("OPENAI_BASE_URL") or DEFAULT_OPENAI_BASE_URL,
+            timeout=DEFAULT_TIMEOUT,
+            max_retries=0,
+        )
+    return _async_client
+
+
+async def _acquire_slot(deadline: float) -> bool:
+    # El semáforo es de hilos: se sondea sin bloquear para no detener el event loop
+    while not _semaphore.acquire(blocking=False):
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(SLOT_POLL_SECONDS)
+    return True
+
+
+def chat_completion(*, timeout: Optional[float] = None, **kwargs):
+    """`client.chat.completions.create` con deadline, reintentos, límite de concurrencia y breaker.
+
+    Con `stream=True` los reintentos cubren sólo el establecimiento de la respuesta; una
+    vez que empiezan a llegar fragmentos no se reintenta. El cupo de concurrencia se
+    mantiene hasta que el stream se agota o se cierra (ver `SlotStream`).
+    """
+    model = kwargs.get("model", "unknown")
+    deadline = time.monotonic() + (timeout or DEFAULT_TIMEOUT)
+
+    if not breaker.allow():
+        stats.increment("circuit_rejections")
+        raise CircuitOpenError("OpenAI no disponible (circuit breaker abierto)")
+
+    if not _semaphore.acquire(timeout=max(0.0, deadline - time.monotonic())):
+        stats.increment("deadline_exceeded")
+        breaker.release_probe()
+        raise DeadlineExceededError("Deadline agotado esperando un cupo de concurrencia para OpenAI")
+
+    handed_off = False
+    try:
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                stats.increment("deadline_exceeded")
+                breaker.record_failure()
+                raise DeadlineExceededError(f"Deadline agotado tras {attempt} intentos")
+
+            started = time.monotonic()
+            try:
+                response = get_client().with_options(timeout=remaining).chat.completions.create(**kwargs)
+            except _retryable_errors() as e:
+                stats.record_call(model, time.monotonic() - started, ok=False)
+                attempt += 1
+                delay = _backoff_delay(attempt, e)
+                if attempt > MAX_RETRIES or time.monotonic() + delay >= deadline:
+                    breaker.record_failure()
+                    raise
+                stats.increment("retries")
+                print(f"[LLMClient] {type(e).__name__} en {model}, reintento {attempt}/{MAX_RETRIES} en {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            except Exception:
+                # Errores 4xx no recuperables (request inválido, autenticación): no indican caída
+                stats.record_call(model, time.monotonic() - started, ok=False)
+                breaker.record_success()
+                raise
+
+            stats.record_call(model, time.monotonic() - started, ok=True)
+            breaker.record_success()
+            if kwargs.get("stream"):
+                handed_off = True
+                return SlotStream(response)
+            stats.record_usage(model, getattr(response, "usage", None))
+            return response
+    finally:
+        if not handed_off:
+            _semaphore.release()
+
+
+class SlotStream:
+    """Stream de fragmentos que libera el cupo de concurrencia al agotarse o cerrarse.
+
+    Así una extracción larga por SSE cuenta contra `OPENAI_MAX_CONCURRENCY` mientras se
+    consume, no sólo mientras se establece la respuesta.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._lock = threading.Lock()
+        self._released = False
+
+    def __iter__(self):
+        try:
+            yield from self._stream
+        finally:
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        try:
+            close = getattr(self._stream, "close", None)
+            if close is not None:
+                close()
+        finally:
+            _semaphore.release()
+
+    def __del__(self):
+        # Un stream abandonado sin iterar ni cerrar no debe quedarse con el cupo
+        self.close()
+
+
+async def achat_completion(*, timeout: Optional[float] = None, **kwargs):
+    """Versión asíncrona de `chat_completion`; se ejecuta dentro de `run_async`.
+
+    Toma cupo del mismo semáforo global que las llamadas síncronas.
+    """
+    model = kwargs.get("model", "unknown")
+    deadline = time.monotonic() + (timeout or DEFAULT_TIMEOUT)
+
+    if not breaker.allow():
+        stats.increment("circuit_rejections")
+        raise CircuitOpenError("OpenAI no disponible (circuit breaker abierto)")
+
+    if not await _acquire_slot(deadline):
+        stats.increment("deadline_exceeded")
+        breaker.release_probe()
+        raise DeadlineExceededError("Deadline agotado esperando un cupo de concurrencia para OpenAI")
+
+    try:
+        return await _achat_with_retries(model, deadline, kwargs)
+    finally:
+        _semaphore.release()
+
+
+async def _achat_with_retries(model: str, deadline: float, kwargs: Dict):
+    client = _get_async_client()
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            stats.increment("deadline_exceeded")
+            breaker.record_failure()
+            raise DeadlineExceededError(f"Deadline agotado tras {attempt} intentos")
+
+        started = time.monotonic()
+        try:
+            response = await client.with_options(timeout=remaining).chat.completions.create(**kwargs)
+        except _retryable_errors() as e:
+            stats.record_call(model, time.monotonic() - started, ok=False)
+            attempt += 1
+            delay = _backoff_delay(attempt, e)
+            if attempt > MAX_RETRIES or time.monotonic() + delay >= deadline:
+                breaker.record_failure()
+                raise
+            stats.increment("retries")
+            print(f"[LLMClient] {type(e).__name__} en {model}, reintento {attempt}/{MAX_RETRIES} en {delay:.2f}s")
+            await asyncio.sleep(delay)
+            continue
+        except Exception:
+            stats.record_call(model, time.monotonic() - started, ok=False)
+            breaker.record_success()
+            raise
+
+        stats.record_call(model, time.monotonic() - started, ok=True)
+        breaker.record_success()
+        stats.record_usage(model, getattr(response, "usage", None))
+        return response
+
+
+def record_usage(model: str, usage) -> None:
+    """Registra tokens de respuestas en streaming (último fragmento con `include_usage`)."""
+    stats.record_usage(model, usage)
+
+
+def stats_snapshot() -> Dict:
+    snapshot = stats.snapshot()
+    snapshot["circuit_breaker"] = {
+        "state": breaker.state,
+        "consecutive_failures": breaker.consecutive_failures,
+    }
+    snapshot["config"] = {
+        "timeout_seconds": DEFAULT_TIMEOUT,
+        "max_retries": MAX_RETRIES,
+        "max_concurrency": MAX_CONCURRENCY,
+    }
+    return snapshot
+
+
+def _collect_metrics():
+    return [
+        ("llm_circuit_breaker_open", "gauge", "1 si el circuit breaker del LLM está abierto o en prueba", {},
+         0 if breaker.state == "closed" else 1),
+    ]
+
+
+metrics.register_collector(_collect_metrics)
+
+
+@lru_cache(maxsize=1)
+def _retryable_errors() -> Tuple[type, ...]:
+    import openai
+
+    return (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+    )
+
+
+def _backoff_delay(attempt: int, error: Exception) -> float:
+    """Backoff exponencial con jitter completo; respeta Retry-After si el proveedor lo envía."""
+    delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            pass
+    return delay
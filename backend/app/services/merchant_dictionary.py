@@ -0,0 +1,184 @@
+"""Diccionario de comercios aprendido desde el historial y las correcciones del usuario.
+
+Mapea el texto crudo del comercio (tal como aparece en la cartola) a los campos de
+enriquecimiento ya conocidos, para no volver a pedirlos al LLM en cada subida.
+
+El diccionario es por cuenta (`MerchantKnowledge.account_id`): se aprende sólo del
+historial y las correcciones de la misma cuenta, y sólo se consulta y lista dentro de ella.
+La primera consulta de una cuenta lo reconstruye desde su historial y lo marca en
+`AccountSettings.merchants_built_at`, aunque no haya salido ningún comercio aprendible.
+"""
+from __future__ import annotations
+
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+from app import models
+
+# Campos que el diccionario puede completar sin LLM
+KNOWLEDGE_FIELDS = (
+    "merchant_normalized", "merchant_category", "category", "charge_archetype",
+    "charge_origin", "is_fixed", "channel",
+)
+
+# Una entrada aprendida del historial se usa sólo si se vio al menos estas veces
+MIN_OCCURRENCES = 2
+
+# Valores de relleno que no aportan conocimiento
+PLACEHOLDER_VALUES = {
+    "Análisis pendiente",
+    "La IA no pudo identificar el origen exacto.",
+}
+
+_CODE_TOKEN = re.compile(r"^(?=.*\d)[a-z0-9]{4,}$|^\d+$")
+
+
+def vendor_key(raw: Optional[str]) -> Optional[str]:
+    """Normaliza el nombre crudo: minúsculas, sin tildes ni códigos de referencia.
+
+    'UBER *TRIP 8842 SANTIAGO' y 'Uber trip 1290 santiago' producen la misma clave.
+    """
+    if not raw:
+        return None
+    text = unicodedata.normalize("NFKD", raw).encode("ascii", "ignore").decode("ascii").lower()
+    tokens = [token for token in re.split(r"[^a-z0-9]+", text) if token and not _CODE_TOKEN.match(token)]
+    return " ".join(tokens) or None
+
+
+def lookup(
+    db, raw_vendors: Iterable[Optional[str]], account_id: str = models.DEFAULT_ACCOUNT_ID
+) -> Dict[str, Dict]:
+    """Retorna {vendor crudo: campos conocidos} para los comercios confiables del diccionario de la cuenta."""
+    _ensure_built(db, account_id)
+    keys_by_raw = {raw: vendor_key(raw) for raw in raw_vendors if raw}
+    keys = {key for key in keys_by_raw.values() if key}
+    if not keys:
+        return {}
+
+    entries = {
+        entry.vendor_key: entry
+        for entry in db.query(models.MerchantKnowledge)
+        .filter(models.MerchantKnowledge.account_id == account_id, models.MerchantKnowledge.vendor_key.in_(keys))
+        .all()
+    }
+    known = {}
+    for raw, key in keys_by_raw.items():
+        entry = entries.get(key)
+        if entry is None:
+            continue
+        if entry.source != "user" and (entry.occurrences or 0) < MIN_OCCURRENCES:
+            continue
+        known[raw] = {
+            field: getattr(entry, field)
+            for field in KNOWLEDGE_FIELDS
+            if getattr(entry, field) is not None
+        }
+    return known
+
+
+def rebuild_from_expenses(db, account_id: str = models.DEFAULT_ACCOUNT_ID) -> int:
+    """Reconstruye las entradas de historial de la cuenta votando el valor más frecuente de cada campo.
+
+    Las entradas corregidas por el usuario (`source='user'`) no se sobrescriben.
+    """
+    votes: Dict[str, Dict[str, Counter]] = defaultdict(lambda: defaultdict(Counter))
+    occurrences: Counter = Counter()
+    rows = (
+        db.query(models.Expense.vendor, *[getattr(models.Expense, field) for field in KNOWLEDGE_FIELDS])
+        .filter(models.Expense.account_id == account_id)
+        .all()
+    )
+    for row in rows:
+        key = vendor_key(row[0])
+        if not key:
+            continue
+        occurrences[key] += 1
+        for field, value in zip(KNOWLEDGE_FIELDS, row[1:]):
+            if value and value not in PLACEHOLDER_VALUES:
+                votes[key][field][value] += 1
+
+    existing = {
+        entry.vendor_key: entry
+        for entry in db.query(models.MerchantKnowledge).filter(models.MerchantKnowledge.account_id == account_id)
+    }
+    for key, count in occurrences.items():
+        entry = existing.get(key)
+        if entry is None:
+            entry = models.MerchantKnowledge(account_id=account_id, vendor_key=key, source="history")
+            db.add(entry)
+        entry.occurrences = count
+        if entry.source == "user":
+            continue
+        for field in KNOWLEDGE_FIELDS:
+            counter = votes[key].get(field)
+            setattr(entry, field, counter.most_common(1)[0][0] if counter else None)
+
+    settings = db.get(models.AccountSettings, account_id)
+    if settings is None:
+        settings = models.AccountSettings(account_id=account_id)
+        db.add(settings)
+    settings.merchants_built_at = datetime.now(timezone.utc)
+    db.commit()
+    print(f"[MerchantDictionary] Diccionario de la cuenta '{account_id}' reconstruido con {len(occurrences)} comercios")
+    return len(occurrences)
+
+
+def learn(db, transactions: List[Dict], account_id: str = models.DEFAULT_ACCOUNT_ID) -> None:
+    """Incorpora al diccionario de la cuenta los comercios de un lote recién enriquecido."""
+    by_key: Dict[str, List[Dict]] = defaultdict(list)
+    for transaction in transactions:
+        key = vendor_key(transaction.get("vendor"))
+        if key:
+            by_key[key].append(transaction)
+    if not by_key:
+        return
+
+    existing = {
+        entry.vendor_key: entry
+        for entry in db.query(models.MerchantKnowledge)
+        .filter(models.MerchantKnowledge.account_id == account_id, models.MerchantKnowledge.vendor_key.in_(list(by_key)))
+        .all()
+    }
+    for key, group in by_key.items():
+        entry = existing.get(key)
+        if entry is None:
+            entry = models.MerchantKnowledge(account_id=account_id, vendor_key=key, source="history", occurrences=0)
+            db.add(entry)
+            for field in KNOWLEDGE_FIELDS:
+                values = [tx.get(field) for tx in group if tx.get(field) and tx.get(field) not in PLACEHOLDER_VALUES]
+                setattr(entry, field, Counter(values).most_common(1)[0][0] if values else None)
+        entry.occurrences = (entry.occurrences or 0) + len(group)
+    db.commit()
+
+
+def learn_from_correction(db, expense: models.Expense) -> None:
+    """Registra la corrección del usuario como fuente prioritaria para el comercio."""
+    key = vendor_key(expense.vendor)
+    if not key:
+        return
+    entry = (
+        db.query(models.MerchantKnowledge)
+        .filter(models.MerchantKnowledge.account_id == expense.account_id, models.MerchantKnowledge.vendor_key == key)
+        .first()
+    )
+    if entry is None:
+        entry = models.MerchantKnowledge(account_id=expense.account_id, vendor_key=key, occurrences=1)
+        db.add(entry)
+    entry.source = "user"
+    for field in KNOWLEDGE_FIELDS:
+        value = getattr(expense, field)
+        if value and value not in PLACEHOLDER_VALUES:
+            setattr(entry, field, value)
+    db.commit()
+    print(f"[MerchantDictionary] Corrección del usuario registrada para '{key}'")
+
+
+def _ensure_built(db, account_id: str) -> None:
+    settings = db.get(models.AccountSettings, account_id)
+    if settings is not None and settings.merchants_built_at is not None:
+        return
+    if db.query(models.Expense.id).filter(models.Expense.account_id == account_id).first() is not None:
+        rebuild_from_expenses(db, account_id)
@@ -0,0 +1,211 @@
+"""Métricas en formato de texto de Prometheus, sin dependencias externas.
+
+Registro en memoria de contadores, gauges e histogramas con labels, expuesto por
+`GET /metrics`. Los servicios registran sus mediciones con los objetos definidos al
+final del módulo; los valores que ya viven en otro lado (colas del pipeline, estado del
+circuit breaker) se leen al momento del scrape con `register_collector`.
+"""
+from __future__ import annotations
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_metrics: List["_Metric"] = []
+_collectors: List[Callable[[], List[Tuple[str, str, str, Dict[str, str], float]]]] = []
+_registry_lock = threading.Lock()
+
+# Consultas SQL del request en curso (la lista se comparte con el threadpool de FastAPI)
+_request_queries: contextvars.ContextVar[Optional[List[int]]] = contextvars.ContextVar("request_queries", default=None)
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        with _registry_lock:
+            _metrics.append(self)
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self.lock:
+            items = list(self.values.items())
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in items]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self.lock:
+            self.values[self._key(labels)] = float(value)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            # [conteo por bucket..., suma, total]
+            series = self.series.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> List[str]:
+        with self.lock:
+            items = [(key, list(series)) for key, series in self.series.items()]
+        lines = []
+        for key, series in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), key + (_number(bound),))} {_number(cumulative)}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), key + ('+Inf',))} {_number(series[-1])}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {_number(series[-1])}")
+        return lines
+
+
+def register_collector(collector: Callable[[], List[Tuple[str, str, str, Dict[str, str], float]]]) -> None:
+    """Registra una función que, en cada scrape, retorna `(nombre, tipo, ayuda, labels, valor)`."""
+    with _registry_lock:
+        _collectors.append(collector)
+
+
+def render() -> str:
+    with _registry_lock:
+        metrics = list(_metrics)
+        collectors = list(_collectors)
+
+    lines: List[str] = []
+    for metric in metrics:
+        lines.extend(metric.render())
+
+    described = set()
+    for collector in collectors:
+        try:
+            samples = collector()
+        except Exception as e:
+            print(f"[Metrics] Error en colector: {str(e)}")
+            continue
+        for name, type_name, documentation, labels, value in samples:
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {type_name}")
+            lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def start_request() -> contextvars.Token:
+    return _request_queries.set([0])
+
+
+def finish_request(token: contextvars.Token) -> int:
+    queries = _request_queries.get()
+    _request_queries.reset(token)
+    return queries[0] if queries else 0
+
+
+def instrument_engine(engine) -> None:
+    """Cuenta las consultas SQL del engine, en total y por request."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count_query(conn, cursor, statement, parameters, context, executemany):
+        DB_QUERIES.inc(operation=(statement.lstrip().split(" ", 1)[0] or "other").upper())
+        queries = _request_queries.get()
+        if queries is not None:
+            queries[0] += 1
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+# HTTP
+HTTP_REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Latencia de requests HTTP por ruta", ("method", "route", "status"))
+HTTP_REQUESTS_IN_PROGRESS = Gauge("http_requests_in_progress", "Requests HTTP en curso", ("method",))
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request", "Consultas SQL ejecutadas por request", ("route",),
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000),
+)
+DB_QUERIES = Counter("db_queries_total", "Consultas SQL ejecutadas", ("operation",))
+DB_READ_ROUTING = Counter("db_read_routing_total", "Sesiones de endpoints de lectura por destino", ("target",))
+
+# PDFs y Docling
+DOCLING_SECONDS = Histogram("docling_conversion_seconds", "Duración de la conversión Docling por ventana de páginas")
+PDF_PAGES = Histogram("pdf_pages", "Páginas por PDF procesado", buckets=(1, 2, 5, 10, 20, 50, 100, 200, 400))
+PDF_REJECTED = Counter("pdf_rejected_total", "PDFs rechazados por exceder límites", ("reason",))
+
+# LLM
+LLM_REQUEST_SECONDS = Histogram("llm_request_duration_seconds", "Latencia de llamadas al LLM", ("model", "outcome"))
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens consumidos por modelo", ("model", "kind"))
+LLM_EVENTS = Counter("llm_events_total", "Reintentos, timeouts y rechazos del cliente LLM", ("event",))
+
+# Detector
+DETECTOR_STAGE_SECONDS = Histogram("detector_stage_duration_seconds", "Duración de las etapas del detector", ("stage",))
+DETECTOR_HISTORY_SIZE = Gauge("detector_history_size", "Transacciones de historial usadas en la última detección")
+DETECTOR_FLAGGED = Counter("detector_flagged_total", "Transacciones marcadas como sospechosas", ("source",))
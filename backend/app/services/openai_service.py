@@ -1,24 +1,30 @@
 import os
 import json
-from typing import Dict, List
+import time
+import asyncio
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 from datetime import datetime
 from decimal import Decimal
-from openai import OpenAI
+from app.services import llm_client, pdf_text, prompt_compactor, statement_parser
 
-try:
-    from docling.document_converter import DocumentConverter
-    _docling_import_error = None
-except Exception as exc:  # pragma: no cover - best-effort guard for optional dep
-    DocumentConverter = None  # type: ignore[assignment]
-    _docling_import_error = exc
+def get_openai_client():
+    return llm_client.get_client()
 
-client = None
+EXTRACTION_MODEL = "gpt-5.1"
+ENRICHMENT_MODEL = "gpt-4o-mini"
+EXPLANATION_MODEL = "gpt-4o-mini"
+# Cartolas pequeñas (tras compactar) se extraen con un modelo más rápido
+FAST_EXTRACTION_MODEL = os.getenv("OPENAI_FAST_EXTRACTION_MODEL", "gpt-4o-mini")
+SMALL_STATEMENT_TOKENS = int(os.getenv("EXTRACTION_SMALL_STATEMENT_TOKENS", "3000"))
+# Máximo de tokens de cartola por llamada; sobre eso el texto se divide en partes
+EXTRACTION_INPUT_TOKEN_BUDGET = int(os.getenv("EXTRACTION_INPUT_TOKEN_BUDGET", "30000"))
 
-def get_openai_client():
-    global client
-    if client is None:
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    return client
+# Deadlines por llamada (incluyen reintentos); las explicaciones corren dentro del detector
+EXTRACTION_TIMEOUT = float(os.getenv("OPENAI_EXTRACTION_TIMEOUT_SECONDS", "180"))
+ENRICHMENT_TIMEOUT = float(os.getenv("OPENAI_ENRICHMENT_TIMEOUT_SECONDS", "60"))
+EXPLANATION_TIMEOUT = float(os.getenv("OPENAI_EXPLANATION_TIMEOUT_SECONDS", "15"))
+# Explicaciones simultáneas por lote (ver `generate_suspicious_explanations`)
+EXPLANATION_CONCURRENCY = int(os.getenv("OPENAI_EXPLANATION_CONCURRENCY", "8"))
 
 EXPENSE_CATEGORIES = [
     "Salud",
@@ -33,51 +39,110 @@ EXPENSE_CATEGORIES = [
     "Otros"
 ]
 
+# Categorías de merchants para clasificación granular
+MERCHANT_CATEGORIES = [
+    "Supermercado", "Restaurante", "Comida rápida", "Cafetería", 
+    "Transporte app", "Transporte público", "Gasolinera",
+    "Farmacia", "Hospital/Clínica", "Gimnasio", "Suscripción streaming",
+    "Suscripción software", "Suscripción servicio", "Tienda retail",
+    "Ropa/Calzado", "Electrónica", "Librería", "Servicios públicos",
+    "Banco/Financiera", "Seguros", "Educación", "Entretenimiento",
+    "Hotelería", "Otros"
+]
+
+ENRICHMENT_FIELDS = (
+    "category", "merchant_normalized", "merchant_category", "charge_archetype",
+    "charge_origin", "is_fixed", "channel",
+)
+
 
 def extract_text_from_pdf(pdf_path: str) -> str:
-    if DocumentConverter is None:
-        missing = "Docling no está instalado" if _docling_import_error is None else str(_docling_import_error)
-        raise RuntimeError(
-            "Docling no está disponible para procesar PDFs. "
-            f"Instálalo o revisa dependencias del sistema: {missing}"
-        )
-    try:
-        converter = DocumentConverter()
-        result = converter.convert(pdf_path)
-        return result.document.export_to_markdown()
-    except Exception as e:
-        print(f"Error extracting text from PDF with Docling: {str(e)}")
-        return ""
+    """Markdown completo del PDF; para archivos grandes preferir `pdf_text.iter_text_windows`."""
+    return "\n\n".join(text for _, text in pdf_text.iter_text_windows(pdf_path))
 
 
-def process_expense_pdf(pdf_path: str) -> List[Dict]:
-    client = get_openai_client()
+def process_expense_pdf(pdf_path: str, merchant_lookup: Optional[Callable[[List[str]], Dict[str, Dict]]] = None, report: Optional[Dict] = None) -> List[Dict]:
+    """Extrae las transacciones de una cartola.
+
+    El PDF se convierte por ventanas de páginas (`pdf_text`) y cada ventana se extrae
+    apenas está lista, sin mantener el documento completo en memoria. En cada ventana se
+    intenta primero el parser determinístico de tablas (`statement_parser`); si reconoce
+    el formato, el LLM sólo completa los campos de enriquecimiento. Si no, se envía el
+    texto de la ventana al LLM. Cada transacción indica la ruta usada en `extraction_path`.
+
+    `merchant_lookup` recibe los nombres crudos de comercios y retorna los campos ya
+    conocidos (ver `merchant_dictionary.lookup`); esos comercios no se envían al LLM.
+    `report` se completa con páginas, ventanas y RSS pico. Lanza
+    `pdf_text.PDFLimitExceeded` si el archivo excede los límites configurados.
+    """
     try:
-        # Extract text instead of images
-        pdf_text = extract_text_from_pdf(pdf_path)
-        
-        if not pdf_text.strip():
-            return [_default_response("No se pudo extraer texto del PDF. Asegúrate de que no sea una imagen escaneada.")]
-        
-        categories_str = ", ".join(EXPENSE_CATEGORIES)
+        transactions: List[Dict] = []
+        context: Dict = {}
+        for _, window_text in pdf_text.iter_text_windows(pdf_path, report):
+            llm_transactions, parsed = extract_window(window_text, context)
+            transactions.extend(llm_transactions)
+            if parsed:
+                transactions.extend(enrich_parsed_transactions(parsed, merchant_lookup))
+        return finalize_transactions(transactions, context)
         
-        # Definir categorías de merchants para clasificación granular
-        merchant_categories = [
-            "Supermercado", "Restaurante", "Comida rápida", "Cafetería", 
-            "Transporte app", "Transporte público", "Gasolinera",
-            "Farmacia", "Hospital/Clínica", "Gimnasio", "Suscripción streaming",
-            "Suscripción software", "Suscripción servicio", "Tienda retail",
-            "Ropa/Calzado", "Electrónica", "Librería", "Servicios públicos",
-            "Banco/Financiera", "Seguros", "Educación", "Entretenimiento",
-            "Hotelería", "Otros"
-        ]
-        merchant_categories_str = ", ".join(merchant_categories)
-        
-        prompt_text = f"""Analiza el siguiente TEXTO extraído de una CARTOLA BANCARIA y extrae TODAS LAS TRANSACCIONES con un análisis detallado de cada una.
+    except pdf_text.PDFLimitExceeded:
+        raise
+    except Exception as e:
+        print(f"Error analizando PDF con GPT-4o: {str(e)}")
+        return [_default_response(f"Error en el análisis: {str(e)}")]
+
+
+def extract_window(window_text: str, context: Dict) -> Tuple[List[Dict], Optional[List[Dict]]]:
+    """Extrae una ventana de texto: retorna `(transacciones del LLM, transacciones parseadas)`.
+
+    Las parseadas por `statement_parser` quedan pendientes de `enrich_parsed_transactions`.
+    `context` se comparte entre las ventanas de un mismo PDF.
+    """
+    if not window_text.strip():
+        return [], None
+    context["has_text"] = True
+    window_text, parsed = _parse_window(window_text, context)
+    if parsed:
+        return [], parsed
+    return _extract_with_llm(window_text), None
+
+
+def finalize_transactions(transactions: List[Dict], context: Dict) -> List[Dict]:
+    """Reemplaza un resultado vacío (o fallido) por la respuesta por defecto que explica el motivo."""
+    if context.get("error"):
+        return [_default_response(f"Error en el análisis: {context['error']}")]
+    if not context.get("has_text"):
+        return [_default_response("No se pudo extraer texto del PDF. Asegúrate de que no sea una imagen escaneada.")]
+    return transactions if transactions else [_default_response("No se encontraron transacciones")]
+
+
+def _parse_window(window_text: str, context: Dict) -> Tuple[str, Optional[List[Dict]]]:
+    """Aplica el parser de tablas a una ventana, arrastrando el año de la cartola entre ventanas.
+
+    Retorna el texto (con el año antepuesto si la ventana no lo menciona, para el LLM)
+    y las transacciones parseadas, o `None` si el formato no se reconoce.
+    """
+    year = statement_parser.statement_year(window_text)
+    if year:
+        context.setdefault("year", year)
+    elif context.get("year"):
+        window_text = f"Año de la cartola: {context['year']}\n{window_text}"
+
+    parsed = statement_parser.parse_statement(window_text, default_year=context.get("year"))
+    if parsed:
+        print(f"[OpenAIService] Formato de tabla reconocido: {len(parsed)} transacciones sin extracción LLM")
+    return window_text, parsed
+
+
+def _build_extraction_prompt(statement_text: str) -> str:
+    categories_str = ", ".join(EXPENSE_CATEGORIES)
+    merchant_categories_str = ", ".join(MERCHANT_CATEGORIES)
+    
+    prompt_text = f"""Analiza el siguiente TEXTO extraído de una CARTOLA BANCARIA y extrae TODAS LAS TRANSACCIONES con un análisis detallado de cada una.
 
 TEXTO DE LA CARTOLA:
 \"\"\"
-{pdf_text}
+{statement_text}
 \"\"\"
 
 CATEGORÍAS DISPONIBLES: {categories_str}
@@ -90,9 +155,9 @@ INSTRUCCIONES DETALLADAS:
 4. Para cada transacción, realiza un análisis profundo:
 
    a) CATEGORÍA: Asigna una de las categorías disponibles basándote en el tipo de gasto.
-   
+
    b) MERCHANT_NORMALIZED: Normaliza el nombre del comercio eliminando códigos, referencias bancarias innecesarias, y unificando variaciones (ej: "MCDONALDS", "MC DONALDS" → "McDonald's").
-   
+
    c) MERCHANT_CATEGORY: Clasifica el comercio en una categoría informativa específica. Ejemplos:
       - McDonald's, Burger King, KFC → "Comida rápida"
       - Uber, DiDi, Cabify → "Transporte app"
@@ -100,7 +165,7 @@ INSTRUCCIONES DETALLADAS:
       - Jumbo, Lider, Tottus → "Supermercado"
       - Banco Estado, Banco de Chile → "Banco/Financiera"
       - Si es una transferencia entre cuentas propias → "Banco/Financiera"
-   
+
    d) CHARGE_ARCHETYPE: Identifica el tipo general de transacción de manera descriptiva. Ejemplos:
       - "Suscripción mensual de streaming"
       - "Compra de comida rápida"
@@ -112,7 +177,7 @@ INSTRUCCIONES DETALLADAS:
       - "Abono por transferencia recibida"
       - "Salario o ingreso fijo"
       - "Pago excepcional o único"
-   
+
    e) CHARGE_ORIGIN: Proporciona una explicación DETALLADA y ÚTIL del origen y razón del cargo/abono. 
       NO uses solo la categoría genérica. Sé específico y descriptivo. Ejemplos:
       - En lugar de "Comida" → "Compra de comida rápida en McDonald's, probablemente almuerzo o cena del día"
@@ -123,9 +188,9 @@ INSTRUCCIONES DETALLADAS:
       - Para transferencias: "Transferencia entre cuentas propias del mismo banco, movimiento interno de fondos"
       - Para suscripciones: "Cobro recurrente mensual de suscripción a [servicio], renovación automática"
       - Para compras: "Compra realizada en [comercio] mediante [método de pago], probablemente [contexto según monto y hora]"
-   
+
    f) IS_FIXED: Determina si es "fixed" (gastos recurrentes como suscripciones, servicios básicos) o "variable" (compras ocasionales).
-   
+
    g) CHANNEL: Identifica el canal: "online" (compras por internet, apps), "pos" (pago en tienda física), "atm" (cajero automático), o null si no aplica.
 
 IMPORTANTE: 
@@ -156,68 +221,318 @@ Responde SOLAMENTE con un JSON válido con la siguiente estructura:
 
 Si no hay transacciones, responde: {{ "transactions": [] }}
 """
+    return prompt_text
+
+
+def _extraction_messages(statement_text: str) -> List[Dict]:
+    return [
+        {
+            "role": "system",
+            "content": "Eres un experto analista financiero que extrae datos estructurados de cartolas bancarias."
+        },
+        {
+            "role": "user",
+            "content": _build_extraction_prompt(statement_text)
+        }
+    ]
+
 
-        response = client.chat.completions.create(
-            model="gpt-5.1",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "Eres un experto analista financiero que extrae datos estructurados de cartolas bancarias."
-                },
-                {
-                    "role": "user",
-                    "content": prompt_text
-                }
-            ],
+def _prepare_extraction(statement_text: str) -> Tuple[str, List[str]]:
+    """Compacta el texto, elige el modelo según su tamaño y lo divide según el presupuesto de tokens."""
+    tokens_before = prompt_compactor.estimate_tokens(statement_text)
+    compacted = prompt_compactor.compact_statement(statement_text) or statement_text
+    tokens_after = prompt_compactor.estimate_tokens(compacted)
+    model = FAST_EXTRACTION_MODEL if tokens_after <= SMALL_STATEMENT_TOKENS else EXTRACTION_MODEL
+    parts = prompt_compactor.split_by_budget(compacted, EXTRACTION_INPUT_TOKEN_BUDGET)
+    reduction = (1 - tokens_after / tokens_before) * 100 if tokens_before else 0.0
+    print(
+        f"[OpenAIService] Compactación: ~{tokens_before} -> ~{tokens_after} tokens de entrada "
+        f"({reduction:.0f}% menos), modelo {model}, {len(parts)} parte(s)"
+    )
+    return model, parts
+
+
+def _log_usage(model: str, usage) -> None:
+    if usage is None:
+        return
+    print(
+        f"[OpenAIService] Uso {model}: {getattr(usage, 'prompt_tokens', 0)} tokens de entrada, "
+        f"{getattr(usage, 'completion_tokens', 0)} de salida"
+    )
+
+
+def _extract_with_llm(statement_text: str) -> List[Dict]:
+    model, parts = _prepare_extraction(statement_text)
+    validated_transactions: List[Dict] = []
+    for part in parts:
+        response = llm_client.chat_completion(
+            timeout=EXTRACTION_TIMEOUT,
+            model=model,
+            messages=_extraction_messages(part),
             response_format={ "type": "json_object" }
         )
+        _log_usage(model, getattr(response, "usage", None))
         
         result_text = response.choices[0].message.content.strip()
         data = json.loads(result_text)
         transactions = data.get("transactions", [])
         
-        validated_transactions = []
-        for result in transactions:
-            if "category" not in result or not result["category"] or not isinstance(result["category"], str):
-                result["category"] = "Otros"
-            else:
-                result["category"] = result["category"].strip()
-                if not result["category"]:
-                    result["category"] = "Otros"
-            
-            if "amount" in result:
-                result["amount"] = Decimal(str(result["amount"]))
-            else:
-                result["amount"] = Decimal("0")
-            
-            if result.get("date"):
-                try:
-                    datetime.strptime(result["date"], "%Y-%m-%d")
-                except:
-                    result["date"] = None
-
-            if not result.get("charge_archetype"):
-                result["charge_archetype"] = "Análisis pendiente"
-
-            if not result.get("charge_origin"):
-                result["charge_origin"] = "La IA no pudo identificar el origen exacto."
-            
-            # Validar y normalizar merchant_category
-            if not result.get("merchant_category"):
-                result["merchant_category"] = None
-            else:
-                result["merchant_category"] = result["merchant_category"].strip()
-                if not result["merchant_category"]:
-                    result["merchant_category"] = None
-            
-            result["analysis_method"] = "gpt-4o-text"
-            validated_transactions.append(result)
-        
-        return validated_transactions if validated_transactions else [_default_response("No se encontraron transacciones")]
-        
-    except Exception as e:
-        print(f"Error analizando PDF con GPT-4o: {str(e)}")
-        return [_default_response(f"Error en el análisis: {str(e)}")]
+        validated_transactions.extend(_validate_transaction(result, "gpt-4o-text") for result in transactions)
+    for result in validated_transactions:
+        result["extraction_path"] = "llm"
+    
+    return validated_transactions
+
+
+def _validate_transaction(result: Dict, analysis_method: str) -> Dict:
+    if "category" not in result or not result["category"] or not isinstance(result["category"], str):
+        result["category"] = "Otros"
+    else:
+        result["category"] = result["category"].strip()
+        if not result["category"]:
+            result["category"] = "Otros"
+    
+    if "amount" in result:
+        result["amount"] = Decimal(str(result["amount"]))
+    else:
+        result["amount"] = Decimal("0")
+    
+    if result.get("date"):
+        try:
+            datetime.strptime(result["date"], "%Y-%m-%d")
+        except:
+            result["date"] = None
+
+    if not result.get("charge_archetype"):
+        result["charge_archetype"] = "Análisis pendiente"
+
+    if not result.get("charge_origin"):
+        result["charge_origin"] = "La IA no pudo identificar el origen exacto."
+    
+    # Validar y normalizar merchant_category
+    if not result.get("merchant_category"):
+        result["merchant_category"] = None
+    else:
+        result["merchant_category"] = result["merchant_category"].strip()
+        if not result["merchant_category"]:
+            result["merchant_category"] = None
+    
+    result["analysis_method"] = analysis_method
+    return result
+
+
+def enrich_parsed_transactions(parsed: List[Dict], merchant_lookup: Optional[Callable[[List[str]], Dict[str, Dict]]] = None) -> List[Dict]:
+    """Completa los campos que el parser de tablas no puede inferir.
+
+    Los comercios conocidos se enriquecen localmente con `merchant_lookup`; sólo los
+    desconocidos van al LLM, en un prompt con únicamente las líneas ya extraídas (sin el
+    texto completo de la cartola). Si el enriquecimiento falla, las transacciones se
+    conservan con valores por defecto para no perder los datos ya extraídos.
+    """
+    known: Dict[str, Dict] = {}
+    if merchant_lookup is not None:
+        try:
+            known = merchant_lookup([tx["vendor"] for tx in parsed])
+        except Exception as e:
+            print(f"Error consultando diccionario de comercios: {str(e)}")
+
+    enrichment: Dict[int, Dict] = {}
+    unknown = [index for index, tx in enumerate(parsed) if tx["vendor"] not in known]
+    print(f"[OpenAIService] Enriquecimiento: {len(parsed) - len(unknown)} comercios conocidos, {len(unknown)} al LLM")
+    if unknown:
+        try:
+            subset = _request_enrichment([parsed[index] for index in unknown])
+            enrichment = {unknown[position]: fields for position, fields in subset.items() if position < len(unknown)}
+        except Exception as e:
+            print(f"Error enriqueciendo transacciones con IA: {str(e)}")
+
+    validated_transactions = []
+    for index, transaction in enumerate(parsed):
+        fields = known.get(transaction["vendor"]) or enrichment.get(index, {})
+        for field in ENRICHMENT_FIELDS:
+            if fields.get(field) is not None:
+                transaction[field] = fields[field]
+        result = _validate_transaction(transaction, "table-parser")
+        result["extraction_path"] = "table_parser"
+        validated_transactions.append(result)
+    return validated_transactions
+
+
+def _request_enrichment(parsed: List[Dict]) -> Dict[int, Dict]:
+    lines = "\n".join(
+        f"{index};{tx['date']};{tx['transaction_type']};{tx['amount']};{tx['description']}"
+        for index, tx in enumerate(parsed)
+    )
+    prompt_text = f"""Clasifica estas transacciones de una cartola bancaria chilena (formato: índice;fecha;tipo;monto CLP;descripción).
+
+{lines}
+
+CATEGORÍAS DISPONIBLES: {", ".join(EXPENSE_CATEGORIES)}
+CATEGORÍAS DE MERCHANTS: {", ".join(MERCHANT_CATEGORIES)}
+
+Para cada índice entrega: category, merchant_normalized (nombre limpio del comercio), merchant_category,
+charge_archetype (tipo general descriptivo), charge_origin (explicación breve y específica del origen del cargo/abono),
+is_fixed ("fixed" para recurrentes como suscripciones y servicios, "variable" si no) y channel ("online" | "pos" | "atm" | null).
+
+Responde SOLAMENTE con JSON: {{"transactions": [{{"index": 0, "category": "...", "merchant_normalized": "...", "merchant_category": "...", "charge_archetype": "...", "charge_origin": "...", "is_fixed": "variable", "channel": null}}]}}"""
+
+    response = llm_client.chat_completion(
+        timeout=ENRICHMENT_TIMEOUT,
+        model=ENRICHMENT_MODEL,
+        messages=[
+            {
+                "role": "system",
+                "content": "Eres un experto analista financiero que clasifica transacciones de cartolas bancarias."
+            },
+            {
+                "role": "user",
+                "content": prompt_text
+            }
+        ],
+        response_format={ "type": "json_object" }
+    )
+    _log_usage(ENRICHMENT_MODEL, getattr(response, "usage", None))
+    data = json.loads(response.choices[0].message.content.strip())
+    enrichment = {}
+    for item in data.get("transactions", []):
+        try:
+            enrichment[int(item.get("index"))] = item
+        except (TypeError, ValueError):
+            continue
+    return enrichment
+
+
+def stream_expense_pdf(pdf_path: str, merchant_lookup: Optional[Callable[[List[str]], Dict[str, Dict]]] = None, report: Optional[Dict] = None) -> Iterator[Dict]:
+    """Versión en streaming de `process_expense_pdf`.
+
+    Por cada ventana de páginas emite eventos `{"type": "stage", ...}` al iniciar/terminar
+    Docling y la extracción, y `{"type": "transaction", "transaction": ...}` por cada
+    transacción validada apenas se completa su objeto JSON en la respuesta del LLM, sin
+    esperar la respuesta completa.
+    """
+    started = time.perf_counter()
+    report = report if report is not None else {}
+    windows = pdf_text.plan_windows(pdf_path, report)
+    context: Dict = {}
+    emitted = 0
+
+    for page_range in windows:
+        stage_started = time.perf_counter()
+        window_info = {"pages": page_range, "total_pages": report.get("pages")}
+        yield {"type": "stage", "stage": "docling", "status": "started", **window_info}
+        window_text = pdf_text.convert_window(pdf_path, page_range, report)
+        yield {"type": "stage", "stage": "docling", "status": "completed", **window_info, "elapsed": round(time.perf_counter() - stage_started, 3)}
+
+        if not window_text.strip():
+            continue
+        context["has_text"] = True
+        window_text, parsed = _parse_window(window_text, context)
+
+        stage_started = time.perf_counter()
+        path = "table_parser" if parsed else "llm"
+        yield {"type": "stage", "stage": "llm", "status": "started", "path": path, **window_info}
+        if parsed:
+            for transaction in enrich_parsed_transactions(parsed, merchant_lookup):
+                emitted += 1
+                yield {"type": "transaction", "transaction": transaction}
+        else:
+            for transaction in _stream_llm_extraction(window_text):
+                emitted += 1
+                if emitted == 1:
+                    print(f"[OpenAIService] Primera transacción recibida en {time.perf_counter() - started:.2f}s")
+                yield {"type": "transaction", "transaction": transaction}
+        yield {"type": "stage", "stage": "llm", "status": "completed", "path": path, **window_info, "elapsed": round(time.perf_counter() - stage_started, 3)}
+
+    if not context.get("has_text"):
+        yield {"type": "transaction", "transaction": _default_response("No se pudo extraer texto del PDF. Asegúrate de que no sea una imagen escaneada.")}
+    elif not emitted:
+        yield {"type": "transaction", "transaction": _default_response("No se encontraron transacciones")}
+
+
+def _stream_llm_extraction(window_text: str) -> Iterator[Dict]:
+    model, parts = _prepare_extraction(window_text)
+    for part in parts:
+        stream = llm_client.chat_completion(
+            timeout=EXTRACTION_TIMEOUT,
+            model=model,
+            messages=_extraction_messages(part),
+            response_format={ "type": "json_object" },
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        parser = IncrementalTransactionParser()
+        for chunk in stream:
+            if getattr(chunk, "usage", None):
+                llm_client.record_usage(model, chunk.usage)
+                _log_usage(model, chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            for result in parser.feed(delta):
+                transaction = _validate_transaction(result, "gpt-4o-text")
+                transaction["extraction_path"] = "llm"
+                yield transaction
+
+
+class IncrementalTransactionParser:
+    """Parser JSON incremental para `{"transactions": [ {...}, {...} ]}`.
+
+    Recibe fragmentos arbitrarios del texto generado y retorna cada objeto del arreglo
+    `transactions` en cuanto se cierra, respetando strings y caracteres escapados.
+    """
+
+    def __init__(self, key: str = "transactions"):
+        self.marker = f'"{key}"'
+        self.prefix = ""
+        self.in_array = False
+        self.finished = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.current: List[str] = []
+
+    def feed(self, text: str) -> List[Dict]:
+        completed: List[Dict] = []
+        for char in text:
+            if self.finished:
+                break
+            if not self.in_array:
+                self.prefix += char
+                if char == "[" and self.marker in self.prefix:
+                    self.in_array = True
+                continue
+
+            if self.depth == 0:
+                if char == "{":
+                    self.depth = 1
+                    self.current = [char]
+                elif char == "]":
+                    self.finished = True
+                continue
+
+            self.current.append(char)
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    try:
+                        completed.append(json.loads("".join(self.current)))
+                    except json.JSONDecodeError as e:
+                        print(f"[OpenAIService] Objeto de transacción inválido en streaming: {str(e)}")
+                    self.current = []
+        return completed
 
 
 def _default_response(error_msg: str) -> Dict:
@@ -242,11 +557,67 @@ def get_categories() -> list:
 
 
 def generate_suspicious_explanation(transaction: Dict, suspicious_reasons: List[str], historical_context: Dict) -> str:
-    """Genera una explicación detallada y contextual usando IA sobre por qué una transacción es sospechosa."""
-    client = get_openai_client()
+    """Genera una explicación detallada y contextual usando IA sobre por qué una transacción es sospechosa.
+
+    Si OpenAI no está disponible (circuit breaker abierto, deadline agotado) retorna de
+    inmediato la explicación basada en reglas.
+    """
     
     try:
-        context_prompt = f"""Analiza la siguiente transacción sospechosa y genera una explicación clara y útil para el usuario.
+        response = llm_client.chat_completion(
+            timeout=EXPLANATION_TIMEOUT,
+            **_explanation_request(transaction, suspicious_reasons, historical_context)
+        )
+        
+        explanation = response.choices[0].message.content.strip()
+        return explanation if explanation else " | ".join(suspicious_reasons)
+        
+    except Exception as e:
+        print(f"Error generando explicación con IA: {str(e)}")
+        # Fallback a explicación simple
+        return " | ".join(suspicious_reasons)
+
+
+def generate_suspicious_explanations(items: List[Tuple[Dict, List[str], Dict]]) -> List[str]:
+    """Genera en paralelo las explicaciones de un lote de `(transacción, razones, contexto)`.
+
+    Las llamadas corren concurrentemente con AsyncOpenAI en el loop compartido de
+    `llm_client.run_async`, acotadas por `EXPLANATION_CONCURRENCY` dentro del lote y por el
+    límite global `OPENAI_MAX_CONCURRENCY` entre todos los lotes y llamadas síncronas, de modo
+    que el lote tarda aproximadamente lo que la llamada más lenta. Retorna las explicaciones en el mismo orden; cada una cae a las razones
+    técnicas si su llamada falla.
+    """
+    if not items:
+        return []
+
+    started = time.monotonic()
+    explanations = llm_client.run_async(_explain_all(items))
+
+    print(f"[OpenAI] {len(items)} explicaciones generadas en {time.monotonic() - started:.2f}s")
+    return explanations
+
+
+async def _explain_all(items: List[Tuple[Dict, List[str], Dict]]) -> List[str]:
+    semaphore = asyncio.Semaphore(EXPLANATION_CONCURRENCY)
+
+    async def explain(transaction: Dict, reasons: List[str], historical_context: Dict) -> str:
+        async with semaphore:
+            try:
+                response = await llm_client.achat_completion(
+                    timeout=EXPLANATION_TIMEOUT,
+                    **_explanation_request(transaction, reasons, historical_context)
+                )
+                explanation = response.choices[0].message.content.strip()
+                return explanation if explanation else " | ".join(reasons)
+            except Exception as e:
+                print(f"Error generando explicación con IA: {str(e)}")
+                return " | ".join(reasons)
+
+    return await asyncio.gather(*(explain(*item) for item in items))
+
+
+def _explanation_request(transaction: Dict, suspicious_reasons: List[str], historical_context: Dict) -> Dict:
+    context_prompt = f"""Analiza la siguiente transacción sospechosa y genera una explicación clara y útil para el usuario.
 
 TRANSACCIÓN:
 - Fecha: {transaction.get('date', 'N/A')}
@@ -270,26 +641,18 @@ NO repitas las razones técnicas literalmente, sino explícalas de manera natura
 
 Responde SOLO con la explicación, sin formato adicional."""
 
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "Eres un asistente financiero experto que explica de manera clara y útil por qué ciertas transacciones son inusuales para un usuario específico."
-                },
-                {
-                    "role": "user",
-                    "content": context_prompt
-                }
-            ],
-            temperature=0.3,
-            max_tokens=150
-        )
-        
-        explanation = response.choices[0].message.content.strip()
-        return explanation if explanation else " | ".join(suspicious_reasons)
-        
-    except Exception as e:
-        print(f"Error generando explicación con IA: {str(e)}")
-        # Fallback a explicación simple
-        return " | ".join(suspicious_reasons)
+    return {
+        "model": EXPLANATION_MODEL,
+        "messages": [
+            {
+                "role": "system",
+                "content": "Eres un asistente financiero experto que explica de manera clara y útil por qué ciertas transacciones son inusuales para un usuario específico."
+            },
+            {
+                "role": "user",
+                "content": context_prompt
+            }
+        ],
+        "temperature": 0.3,
+        "max_tokens": 150,
+    }
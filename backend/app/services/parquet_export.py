@@ -0,0 +1,303 @@
+"""Exportación de `expenses` a Parquet particionado, para análisis fuera de la base de producción.
+
+Estructura (particiones estilo Hive, legibles con `pyarrow.dataset`, DuckDB, Spark o pandas):
+
+    EXPORT_DIR/expenses/account_id=<cuenta>/month=<YYYY-MM>/part-<primer id>.parquet
+    EXPORT_DIR/_watermarks.json
+
+Cada exportación de una cuenta es incremental: sólo lee las filas con `id` mayor que la
+marca de agua guardada y escribe un archivo nuevo por mes tocado. Con `full=True` se
+reescribe la cuenta completa en un directorio temporal que luego reemplaza al anterior;
+hace falta para recoger ediciones y eliminaciones, que la marca de agua por `id` no ve.
+
+Los ids no se confirman en orden (el pipeline, el upload por SSE y `python -m app.ingest`
+insertan en paralelo): un id menor puede aparecer después de exportado uno mayor y la
+marca de agua lo saltaría para siempre. Por eso cada exportación se detiene antes de la
+primera fila con `created_at` dentro de los últimos `EXPORT_SAFETY_LAG_SECONDS`; esas
+filas, y cualquier id menor que todavía no se confirmaba, quedan para la próxima. El
+margen tiene que ser mayor que la transacción de inserción más larga.
+
+La lectura usa un cursor de servidor (`yield_per`) y cada lote de `EXPORT_BATCH_ROWS` filas
+se escribe como un row group apenas llega, así que la memoria no depende del tamaño de la
+tabla. Si hay réplica (`DATABASE_READ_URL`) la exportación lee de ella.
+
+`load_history` lee el snapshot de una cuenta con memory mapping, para reproducir el
+detector sin tocar la base (`suspicious_detector.replay_history`, `python -m app.export replay`).
+pyarrow se importa recién al exportar o leer.
+"""
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import threading
+import time
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from sqlalchemy import Boolean, Float, Integer, JSON, func, select
+
+from app import models
+from app.database import ReadSessionLocal
+
+EXPORT_DIR = Path(os.getenv("EXPORT_DIR", "/app/exports"))
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "50000"))
+EXPORT_COMPRESSION = os.getenv("EXPORT_COMPRESSION", "zstd")
+EXPORT_SAFETY_LAG_SECONDS = int(os.getenv("EXPORT_SAFETY_LAG_SECONDS", "300"))
+
+EXPORT_COLUMNS = tuple(models.Expense.__table__.columns)
+UNKNOWN_MONTH = "unknown"
+
+# Campos que usa el detector para armar su historial (ver `suspicious_detector._build_stats`)
+HistoryRow = namedtuple("HistoryRow", (
+    "id", "date", "amount", "vendor", "merchant_normalized", "merchant_category", "category",
+    "transaction_type", "charge_archetype", "is_suspicious",
+))
+
+_export_lock = threading.Lock()
+_export_status: Dict = {"running": False}
+
+
+class ArrowUnavailable(RuntimeError):
+    """pyarrow no está instalado."""
+
+
+def export_expenses(
+    db,
+    account_id: Optional[str] = None,
+    full: bool = False,
+    export_dir: Path = EXPORT_DIR,
+    batch_rows: int = EXPORT_BATCH_ROWS,
+) -> Dict:
+    """Exporta una cuenta (o todas si `account_id` es None) y actualiza sus marcas de agua."""
+    started = time.perf_counter()
+    pa, pq = _arrow()
+    if account_id is None:
+        account_ids = [account for (account,) in db.query(models.Expense.account_id).distinct().all()]
+    else:
+        account_ids = [account_id]
+
+    watermarks = read_watermarks(export_dir)
+    results = {}
+    for account in account_ids:
+        previous = 0 if full else watermarks.get(account, {}).get("last_id", 0)
+        result = _export_account(db, pa, pq, account, previous, full, export_dir, batch_rows)
+        if result["rows"] or full:
+            watermarks[account] = {
+                "last_id": result["last_id"],
+                "exported_at": datetime.now(timezone.utc).isoformat(),
+                "rows": (0 if full else watermarks.get(account, {}).get("rows", 0)) + result["rows"],
+            }
+            _write_watermarks(export_dir, watermarks)
+        results[account] = result
+        _export_status["accounts_done"] = len(results)
+
+    summary = {
+        "full": full,
+        "accounts": results,
+        "rows": sum(result["rows"] for result in results.values()),
+        "files": sum(result["files"] for result in results.values()),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    print(
+        f"[ParquetExport] Exportación {'completa' if full else 'incremental'}: {summary['rows']} filas "
+        f"en {summary['files']} archivos de {len(results)} cuentas en {summary['seconds']}s"
+    )
+    return summary
+
+
+def _export_account(db, pa, pq, account_id: str, since_id: int, full: bool, export_dir: Path, batch_rows: int) -> Dict:
+    target = account_dir(export_dir, account_id)
+    # La exportación completa se arma aparte y reemplaza el directorio al final. Los nombres
+    # temporales empiezan con "." para que los lectores de datasets los ignoren.
+    output = target.with_name(f".{target.name}.tmp-{os.getpid()}") if full else target
+    if full and output.exists():
+        shutil.rmtree(output)
+
+    schema = _schema(pa)
+    expense = models.Expense
+    statement = (
+        select(*EXPORT_COLUMNS)
+        .where(expense.account_id == account_id, expense.id > since_id)
+        .order_by(expense.id)
+        .execution_options(yield_per=batch_rows)
+    )
+    held_from = _first_unsettled_id(db, account_id, since_id)
+    if held_from is not None:
+        statement = statement.where(expense.id < held_from)
+
+    writers: Dict[str, object] = {}
+    pending_paths: Dict[Path, Path] = {}
+    rows = 0
+    last_id = since_id
+    file_id = since_id + 1
+    try:
+        for batch in db.execute(statement).partitions():
+            by_month: Dict[str, List] = defaultdict(list)
+            for row in batch:
+                by_month[_month(row.date)].append(row)
+            for month, month_rows in by_month.items():
+                writer = writers.get(month)
+                if writer is None:
+                    path = output / f"month={month}" / f"part-{file_id:012d}.parquet"
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    temporary = path.with_name(f".{path.name}.tmp")
+                    writer = pq.ParquetWriter(str(temporary), schema, compression=EXPORT_COMPRESSION)
+                    writers[month] = writer
+                    pending_paths[temporary] = path
+                writer.write_table(pa.Table.from_pydict(_columns(month_rows), schema=schema))
+            rows += len(batch)
+            last_id = batch[-1].id
+            _export_status["rows"] = _export_status.get("rows", 0) + len(batch)
+    except Exception:
+        for writer in writers.values():
+            writer.close()
+        for temporary in pending_paths:
+            temporary.unlink(missing_ok=True)
+        if full:
+            shutil.rmtree(output, ignore_errors=True)
+        raise
+
+    for writer in writers.values():
+        writer.close()
+    for temporary, path in pending_paths.items():
+        temporary.rename(path)
+
+    if full:
+        previous = target.with_name(f".{target.name}.old-{os.getpid()}")
+        if target.exists():
+            target.rename(previous)
+        if output.exists():
+            output.rename(target)
+        shutil.rmtree(previous, ignore_errors=True)
+
+    return {
+        "rows": rows,
+        "files": len(pending_paths),
+        "months": sorted(writers),
+        "since_id": since_id,
+        "last_id": last_id,
+        "held_from_id": held_from,
+    }
+
+
+def _first_unsettled_id(db, account_id: str, since_id: int) -> Optional[int]:
+    """Primer id insertado dentro del margen de seguridad; desde ahí no se exporta todavía."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=EXPORT_SAFETY_LAG_SECONDS)).isoformat()
+    expense = models.Expense
+    return db.execute(
+        select(func.min(expense.id)).where(
+            expense.account_id == account_id,
+            expense.id > since_id,
+            expense.created_at >= cutoff,
+        )
+    ).scalar()
+
+
+def start_export(account_id: Optional[str] = None, full: bool = False) -> bool:
+    """Lanza `export_expenses` en un hilo. Retorna False si ya hay una exportación en curso."""
+    _arrow()
+    if not _export_lock.acquire(blocking=False):
+        return False
+    _export_status.clear()
+    _export_status.update({"running": True, "account_id": account_id, "full": full, "accounts_done": 0, "rows": 0})
+
+    def run() -> None:
+        db = ReadSessionLocal()
+        try:
+            _export_status.update(export_expenses(db, account_id, full))
+        except Exception as e:
+            _export_status["error"] = str(e)
+            print(f"[ParquetExport] Error exportando a Parquet: {str(e)}")
+        finally:
+            db.close()
+            _export_status["running"] = False
+            _export_lock.release()
+
+    threading.Thread(target=run, name="parquet-export", daemon=True).start()
+    return True
+
+
+def export_status() -> Dict:
+    return dict(_export_status)
+
+
+def load_history(account_id: str, export_dir: Path = EXPORT_DIR) -> List[HistoryRow]:
+    """Historial del detector desde el snapshot Parquet de la cuenta, leído con memory mapping."""
+    _arrow()
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+
+    path = account_dir(export_dir, account_id)
+    if not path.exists():
+        return []
+    dataset = ds.dataset(
+        str(path), format="parquet", partitioning="hive", filesystem=fs.LocalFileSystem(use_mmap=True)
+    )
+    if not dataset.files:
+        return []
+    table = dataset.to_table(columns=list(HistoryRow._fields))
+    columns = [table.column(name).to_pylist() for name in HistoryRow._fields]
+    return [HistoryRow(*values) for values in zip(*columns)]
+
+
+def account_dir(export_dir: Path, account_id: str) -> Path:
+    return Path(export_dir) / "expenses" / f"account_id={account_id}"
+
+
+def read_watermarks(export_dir: Path = EXPORT_DIR) -> Dict[str, Dict]:
+    path = Path(export_dir) / "_watermarks.json"
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+def _write_watermarks(export_dir: Path, watermarks: Dict[str, Dict]) -> None:
+    path = Path(export_dir) / "_watermarks.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix(".json.tmp")
+    temporary.write_text(json.dumps(watermarks, indent=2, sort_keys=True))
+    temporary.replace(path)
+
+
+def _schema(pa):
+    fields = []
+    for column in EXPORT_COLUMNS:
+        if isinstance(column.type, Integer):
+            arrow_type = pa.int64()
+        elif isinstance(column.type, Float):
+            arrow_type = pa.float64()
+        elif isinstance(column.type, Boolean):
+            arrow_type = pa.bool_()
+        else:
+            # Texto y JSON (serializado)
+            arrow_type = pa.string()
+        fields.append(pa.field(column.name, arrow_type, nullable=column.nullable))
+    return pa.schema(fields)
+
+
+def _columns(rows: List) -> Dict[str, List]:
+    columns = {}
+    for index, column in enumerate(EXPORT_COLUMNS):
+        values = [row[index] for row in rows]
+        if isinstance(column.type, JSON):
+            values = [json.dumps(value, ensure_ascii=False) if value is not None else None for value in values]
+        columns[column.name] = values
+    return columns
+
+
+def _month(value: Optional[str]) -> str:
+    if value and len(value) >= 7 and value[4] == "-":
+        return value[:7]
+    return UNKNOWN_MONTH
+
+
+def _arrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ArrowUnavailable("pyarrow no está instalado: pip install pyarrow") from e
+    return pa, pq
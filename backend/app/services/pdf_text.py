@@ -0,0 +1,201 @@
+"""Conversión de PDFs a Markdown por ventanas de páginas con memoria acotada.
+
+Docling mantiene en memoria las imágenes y el layout de todas las páginas que convierte,
+así que una cartola anual de cientos de páginas puede ocupar gigabytes. Aquí el PDF se
+convierte de a `PDF_PAGE_WINDOW` páginas; cada ventana se entrega como texto y su
+documento se libera antes de convertir la siguiente. Los límites de tamaño, páginas y
+memoria rechazan archivos patológicos antes (o durante) la conversión.
+
+El límite de memoria se aplica al crecimiento del RSS durante la conversión de cada
+ventana respecto del RSS con que empezó, muestreado en un hilo mientras Docling trabaja,
+para no culpar a un PDF por la memoria que ya usaban el proceso u otras conversiones.
+Sin `/proc` el RSS es desconocido y el límite no se aplica.
+
+Docling (y sus modelos de layout) se importa recién en `get_converter`, la primera vez
+que se convierte un PDF o al precalentar la API (`WARMUP_ON_STARTUP`, `POST /warmup`).
+"""
+from __future__ import annotations
+
+import gc
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.services import metrics, profiling
+
+MAX_PDF_BYTES = int(os.getenv("MAX_PDF_BYTES", str(50 * 1024 * 1024)))
+MAX_PDF_PAGES = int(os.getenv("MAX_PDF_PAGES", "400"))
+PDF_PAGE_WINDOW = int(os.getenv("PDF_PAGE_WINDOW", "20"))
+# MB que puede crecer el RSS al convertir una ventana; 0 desactiva el límite de memoria
+MAX_RSS_MB = float(os.getenv("MAX_RSS_MB", "3072"))
+RSS_SAMPLE_SECONDS = float(os.getenv("RSS_SAMPLE_SECONDS", "0.1"))
+
+_converter = None
+_converter_lock = threading.Lock()
+
+
+class PDFLimitExceeded(ValueError):
+    """El PDF excede los límites configurados de tamaño, páginas o memoria."""
+
+
+def check_pdf_limits(pdf_path: str) -> Optional[int]:
+    """Valida tamaño y número de páginas antes de convertir. Retorna las páginas si se conocen."""
+    size = os.path.getsize(pdf_path)
+    if size > MAX_PDF_BYTES:
+        metrics.PDF_REJECTED.inc(reason="size")
+        raise PDFLimitExceeded(
+            f"El PDF pesa {size / 1024 / 1024:.1f} MB; el máximo permitido es {MAX_PDF_BYTES / 1024 / 1024:.0f} MB"
+        )
+
+    pages = count_pages(pdf_path)
+    if pages is not None and pages > MAX_PDF_PAGES:
+        metrics.PDF_REJECTED.inc(reason="pages")
+        raise PDFLimitExceeded(f"El PDF tiene {pages} páginas; el máximo permitido es {MAX_PDF_PAGES}")
+    return pages
+
+
+def count_pages(pdf_path: str) -> Optional[int]:
+    try:
+        from pdf2image import pdfinfo_from_path
+
+        return int(pdfinfo_from_path(pdf_path)["Pages"])
+    except Exception as e:
+        # Sin poppler no se conoce el total: se convierte de una vez con `max_num_pages`
+        print(f"[PDFText] No se pudo contar páginas de {pdf_path}: {str(e)}")
+        return None
+
+
+def page_windows(pages: int, window: int = PDF_PAGE_WINDOW) -> Iterator[Tuple[int, int]]:
+    """Rangos de páginas 1-indexados e inclusivos, como los espera Docling."""
+    window = max(1, window)
+    for start in range(1, pages + 1, window):
+        yield start, min(pages, start + window - 1)
+
+
+def iter_text_windows(pdf_path: str, report: Optional[Dict] = None) -> Iterator[Tuple[Optional[Tuple[int, int]], str]]:
+    """Convierte el PDF por ventanas y entrega `((primera, última), markdown)` de cada una.
+
+    `report` (si se pasa) se completa con páginas, ventanas, el RSS pico observado y el
+    mayor crecimiento de una ventana. Lanza `PDFLimitExceeded` si el PDF excede los límites
+    o una ventana hace crecer el RSS más de `MAX_RSS_MB`.
+    """
+    report = report if report is not None else {}
+    for page_range in plan_windows(pdf_path, report):
+        yield page_range, convert_window(pdf_path, page_range, report)
+
+
+def plan_windows(pdf_path: str, report: Dict) -> List[Optional[Tuple[int, int]]]:
+    """Valida los límites y retorna los rangos a convertir (`[None]` si no se conoce el total)."""
+    pages = check_pdf_limits(pdf_path)
+    if pages:
+        metrics.PDF_PAGES.observe(pages)
+    rss = current_rss_mb()
+    report.update({
+        "pages": pages,
+        "windows": 0,
+        "window_size": PDF_PAGE_WINDOW,
+        "peak_rss_mb": round(rss, 1) if rss is not None else None,
+        "peak_growth_mb": 0.0 if rss is not None else None,
+    })
+    return list(page_windows(pages)) if pages else [None]
+
+
+def convert_window(pdf_path: str, page_range: Optional[Tuple[int, int]], report: Dict) -> str:
+    converter = get_converter()
+    started = time.perf_counter()
+    sampler = RSSSampler()
+    try:
+        if page_range is None:
+            result = converter.convert(pdf_path, max_num_pages=MAX_PDF_PAGES, max_file_size=MAX_PDF_BYTES)
+        else:
+            result = converter.convert(pdf_path, page_range=page_range)
+        text = result.document.export_to_markdown()
+    except Exception as e:
+        print(f"Error extracting text from PDF with Docling: {str(e)}")
+        return ""
+    finally:
+        # La última muestra se toma con el documento aún en memoria
+        sampler.stop()
+        elapsed = time.perf_counter() - started
+        metrics.DOCLING_SECONDS.observe(elapsed)
+        profiling.record("docling", elapsed)
+
+    del result
+    gc.collect()
+    report["windows"] = report.get("windows", 0) + 1
+    if sampler.peak is None:
+        return text
+    growth = sampler.peak - sampler.baseline
+    report["peak_rss_mb"] = round(max(report.get("peak_rss_mb") or 0.0, sampler.peak), 1)
+    report["peak_growth_mb"] = round(max(report.get("peak_growth_mb") or 0.0, growth), 1)
+    if MAX_RSS_MB and growth > MAX_RSS_MB:
+        metrics.PDF_REJECTED.inc(reason="memory")
+        where = f"en las páginas {page_range[0]}-{page_range[1]}" if page_range else "al convertir el PDF"
+        raise PDFLimitExceeded(
+            f"La conversión superó el límite de memoria (+{growth:.0f} MB > {MAX_RSS_MB:.0f} MB) {where}"
+        )
+    return text
+
+
+class RSSSampler:
+    """Muestrea el RSS en un hilo desde su creación hasta `stop`; `peak` es None sin `/proc`."""
+
+    def __init__(self, interval: float = RSS_SAMPLE_SECONDS):
+        self.baseline = current_rss_mb()
+        self.peak = self.baseline
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+        if self.baseline is not None:
+            self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self._interval):
+            self._sample()
+
+    def _sample(self) -> None:
+        rss = current_rss_mb()
+        if rss is not None:
+            self.peak = max(self.peak, rss)
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._sample()
+
+
+def get_converter():
+    """Reutiliza el `DocumentConverter`: crearlo carga los modelos de layout cada vez."""
+    global _converter
+    if _converter is None:
+        with _converter_lock:
+            if _converter is None:
+                started = time.perf_counter()
+                try:
+                    from docling.document_converter import DocumentConverter
+                except Exception as exc:  # pragma: no cover - best-effort guard for optional dep
+                    raise RuntimeError(
+                        "Docling no está disponible para procesar PDFs. "
+                        f"Instálalo o revisa dependencias del sistema: {str(exc)}"
+                    )
+                _converter = DocumentConverter()
+                print(f"[PDFText] Docling cargado en {time.perf_counter() - started:.2f}s")
+    return _converter
+
+
+def current_rss_mb() -> Optional[float]:
+    """RSS actual del proceso en MB (`/proc`); None si no está disponible.
+
+    `ru_maxrss` no sirve de reemplazo: es el máximo histórico del proceso y, una vez sobre
+    el límite, haría rechazar todos los PDFs siguientes.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            resident_pages = int(statm.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, IndexError):
+        return None
@@ -0,0 +1,225 @@
+"""Perfilado opcional por request con un tracer local de spans.
+
+Se activa para todos los requests con `PROFILING=1`, o request a request con el header
+`X-Profile: 1`. Mientras hay un trace activo, `span(nombre)` mide bloques de código y
+los agrega en un árbol por nombre (llamadas y tiempo total), al estilo de pyinstrument:
+las consultas SQL (eventos de SQLAlchemy), Docling, el LLM y las etapas del detector
+quedan como nodos del request. Sin trace activo `span` no mide nada.
+
+Al terminar el request el árbol se resume en el header `Server-Timing` y, si el request
+está entre los `PROFILE_SLOWEST` más lentos vistos desde el arranque, se escribe un
+reporte de texto en `PROFILE_DIR` (se borra el reporte que deja de estar en el top).
+"""
+from __future__ import annotations
+
+import contextvars
+import heapq
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+PROFILING_ENABLED = os.getenv("PROFILING", "").lower() in ("1", "true", "yes")
+PROFILE_HEADER = "X-Profile"
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "/app/profiles"))
+# 0 desactiva los reportes en disco
+PROFILE_SLOWEST = int(os.getenv("PROFILE_SLOWEST", "10"))
+# Entradas máximas en Server-Timing (los navegadores y proxies limitan el tamaño del header)
+SERVER_TIMING_ENTRIES = 20
+
+_current: contextvars.ContextVar[Optional[Tuple["Trace", "Span"]]] = contextvars.ContextVar("profiling_span", default=None)
+_slowest: List[Tuple[float, str]] = []
+_slowest_lock = threading.Lock()
+_TOKEN_CHARS = re.compile(r"[^A-Za-z0-9_.\-]")
+
+
+class Span:
+    __slots__ = ("name", "calls", "seconds", "children")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.children: Dict[str, Span] = {}
+
+    def self_seconds(self) -> float:
+        return max(0.0, self.seconds - sum(child.seconds for child in self.children.values()))
+
+
+class Trace:
+    def __init__(self, name: str):
+        self.root = Span(name)
+        self.root.calls = 1
+        self.started = time.perf_counter()
+        self.started_at = datetime.now()
+        # Los spans de hilos del threadpool comparten el árbol del request
+        self.lock = threading.Lock()
+
+    def child(self, parent: Span, name: str) -> Span:
+        with self.lock:
+            node = parent.children.get(name)
+            if node is None:
+                node = parent.children[name] = Span(name)
+            return node
+
+
+class _SpanContext:
+    __slots__ = ("trace", "node", "token", "started")
+
+    def __init__(self, trace: Trace, parent: Span, name: str):
+        self.trace = trace
+        self.node = trace.child(parent, name)
+
+    def __enter__(self):
+        self.token = _current.set((self.trace, self.node))
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.started
+        _current.reset(self.token)
+        with self.trace.lock:
+            self.node.calls += 1
+            self.node.seconds += elapsed
+        return False
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def wants_profile(headers) -> bool:
+    return PROFILING_ENABLED or headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "yes")
+
+
+def start_trace(name: str) -> contextvars.Token:
+    trace = Trace(name)
+    return _current.set((trace, trace.root))
+
+
+def finish_trace(token: contextvars.Token) -> Trace:
+    trace, _ = _current.get()
+    _current.reset(token)
+    trace.root.seconds = time.perf_counter() - trace.started
+    return trace
+
+
+def active() -> bool:
+    return _current.get() is not None
+
+
+def span(name: str):
+    """Mide el bloque como hijo del span actual; no hace nada si el request no se perfila."""
+    current = _current.get()
+    if current is None:
+        return _NOOP
+    return _SpanContext(current[0], current[1], name)
+
+
+def record(name: str, seconds: float) -> None:
+    """Agrega una duración medida en otro lado (p. ej. en los hilos del pipeline de ingesta)."""
+    current = _current.get()
+    if current is None:
+        return
+    trace, parent = current
+    node = trace.child(parent, name)
+    with trace.lock:
+        node.calls += 1
+        node.seconds += seconds
+
+
+def server_timing(trace: Trace) -> str:
+    """Header `Server-Timing` con el total y el tiempo por nombre de span (sumado en todo el árbol)."""
+    totals: Dict[str, List[float]] = {}
+    stack = list(trace.root.children.values())
+    while stack:
+        node = stack.pop()
+        entry = totals.setdefault(node.name, [0.0, 0])
+        entry[0] += node.seconds
+        entry[1] += node.calls
+        stack.extend(node.children.values())
+
+    entries = [f"total;dur={trace.root.seconds * 1000:.1f}", f"app;dur={trace.root.self_seconds() * 1000:.1f};desc=\"sin span\""]
+    ranked = sorted(totals.items(), key=lambda item: item[1][0], reverse=True)[:SERVER_TIMING_ENTRIES]
+    for name, (seconds, calls) in ranked:
+        entries.append(f"{_TOKEN_CHARS.sub('_', name)};dur={seconds * 1000:.1f};desc=\"{calls}x\"")
+    return ", ".join(entries)
+
+
+def render_report(trace: Trace) -> str:
+    total = trace.root.seconds or 1e-9
+    lines = [f"{trace.root.name}  {trace.root.seconds * 1000:.1f} ms  ({trace.started_at.isoformat(timespec='seconds')})", ""]
+
+    def walk(node: Span, depth: int) -> None:
+        lines.append(
+            f"{node.seconds * 1000:10.1f} ms {node.seconds / total * 100:5.1f}%  "
+            f"{'  ' * depth}{node.name}  x{node.calls}  (propio {node.self_seconds() * 1000:.1f} ms)"
+        )
+        for child in sorted(node.children.values(), key=lambda item: item.seconds, reverse=True):
+            walk(child, depth + 1)
+
+    walk(trace.root, 0)
+    return "\n".join(lines) + "\n"
+
+
+def maybe_dump(trace: Trace) -> Optional[str]:
+    """Escribe el reporte si el request está entre los `PROFILE_SLOWEST` más lentos."""
+    if PROFILE_SLOWEST <= 0:
+        return None
+    seconds = trace.root.seconds
+    with _slowest_lock:
+        if len(_slowest) >= PROFILE_SLOWEST and seconds <= _slowest[0][0]:
+            return None
+        name = f"{trace.started_at:%Y%m%d-%H%M%S}-{_TOKEN_CHARS.sub('_', trace.root.name)}-{seconds * 1000:.0f}ms.txt"
+        path = PROFILE_DIR / name
+        try:
+            PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+            path.write_text(render_report(trace))
+        except OSError as e:
+            print(f"[Profiling] No se pudo escribir el reporte {path}: {str(e)}")
+            return None
+        heapq.heappush(_slowest, (seconds, str(path)))
+        if len(_slowest) > PROFILE_SLOWEST:
+            _, evicted = heapq.heappop(_slowest)
+            try:
+                os.remove(evicted)
+            except OSError:
+                pass
+    return str(path)
+
+
+def instrument_engine(engine) -> None:
+    """Cada consulta SQL del request perfilado queda como span `sql.<operación>`."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start_query(conn, cursor, statement, parameters, context, executemany):
+        current = _current.get()
+        if current is None:
+            return
+        operation = (statement.lstrip().split(" ", 1)[0] or "other").lower()
+        query_span = _SpanContext(current[0], current[1], f"sql.{operation}").__enter__()
+        conn.info.setdefault("profiling_spans", []).append(query_span)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _end_query(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get("profiling_spans")
+        if spans:
+            spans.pop().__exit__(None, None, None)
+
+    @event.listens_for(engine, "handle_error")
+    def _failed_query(exception_context):
+        conn = exception_context.connection
+        spans = conn.info.get("profiling_spans") if conn is not None else None
+        if spans:
+            spans.pop().__exit__(None, None, None)
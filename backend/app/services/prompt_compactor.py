@@ -0,0 +1,174 @@
+"""Compactación del texto de cartolas antes de enviarlo al LLM.
+
+El Markdown de Docling incluye encabezados de página, textos legales, resúmenes de saldo
+y el encabezado de la tabla repetido en cada página. `compact_statement` deja sólo las
+líneas que pueden contener movimientos (más el encabezado de cada tabla una vez) y
+convierte las tablas a filas delimitadas por `|` sin relleno. `estimate_tokens` usa
+tiktoken si está instalado y, si no, una aproximación por caracteres.
+"""
+from __future__ import annotations
+
+import re
+from typing import List, Optional
+
+from app.services.statement_parser import (
+    AMOUNT_HEADERS, CHARGE_HEADERS, DATE_HEADERS, DEPOSIT_HEADERS, DESCRIPTION_HEADERS, SEPARATOR_CELL,
+    SKIP_DESCRIPTIONS, _normalize_header,
+)
+
+# Caracteres por token aproximados para texto en español cuando no hay tiktoken
+CHARS_PER_TOKEN = 3.5
+
+BOILERPLATE_PATTERNS = re.compile(
+    r"(pagina \d+ de \d+|^pagina \d+$|www\.|https?://|informese|\bcmf\b|garantia estatal|"
+    r"servicio al cliente|atencion (al )?cliente|\bfono\b|\bley n|tasa de interes|"
+    r"costo anual equivalente|carga anual equivalente|<!-- image -->)"
+)
+PAGE_NUMBER = re.compile(r"^pagina \d+( de \d+)?$")
+MARKDOWN_DECORATION = re.compile(r"^[#>*\-\s]+|\*\*|__")
+DIGIT = re.compile(r"\d")
+# Las líneas que empiezan con fecha son movimientos: nunca se deduplican
+LEADING_DATE = re.compile(r"^\d{1,4}[/.-]\d{1,2}\b")
+HEADER_TOKENS = frozenset(
+    DATE_HEADERS + DESCRIPTION_HEADERS + CHARGE_HEADERS + DEPOSIT_HEADERS + AMOUNT_HEADERS
+    + ("saldo", "saldos", "saldo diario", "n documento", "documento", "sucursal", "cuota", "cuotas")
+)
+
+_encoding = None
+_encoding_loaded = False
+
+
+def compact_statement(markdown: str) -> str:
+    """Retorna una versión densa del Markdown de la cartola con sólo contenido relevante.
+
+    Sólo se descartan como repetidas las líneas de texto que reaparecen en otra página
+    (el texto se corta en "páginas" al terminar una tabla o en "Página N de M"): dos
+    movimientos idénticos del mismo día se conservan.
+    """
+    lines: List[str] = []
+    text_segments = {}
+    seen_headers = set()
+    dropped_columns: set = set()
+    header_width = 0
+    segment = 0
+    in_table = False
+
+    for raw_line in markdown.splitlines():
+        stripped = raw_line.strip()
+        if not stripped:
+            continue
+
+        if stripped.startswith("|"):
+            in_table = True
+            cells = [re.sub(r"\s+", " ", cell).strip() for cell in stripped.strip("|").split("|")]
+            if all(SEPARATOR_CELL.match(cell) for cell in cells if cell) or not any(cells):
+                continue
+            normalized = [_normalize_header(cell) for cell in cells]
+            is_header = _is_table_header(cells, normalized)
+            if is_header:
+                # La columna de saldo no aporta a la extracción
+                dropped_columns = {i for i, cell in enumerate(normalized) if cell.startswith("saldo")}
+                header_width = len(cells)
+            if len(cells) == header_width:
+                cells = [cell for i, cell in enumerate(cells) if i not in dropped_columns]
+            if is_header:
+                # Docling repite el encabezado en cada página
+                signature = tuple(normalized)
+                if signature in seen_headers:
+                    continue
+                seen_headers.add(signature)
+            lines.append("|".join(cells))
+            continue
+
+        if in_table:
+            in_table = False
+            segment += 1
+        text = re.sub(r"\s+", " ", MARKDOWN_DECORATION.sub("", stripped)).strip()
+        normalized_text = _normalize_header(text)
+        if PAGE_NUMBER.match(normalized_text):
+            segment += 1
+            continue
+        if not text or not DIGIT.search(text):
+            continue
+        if BOILERPLATE_PATTERNS.search(normalized_text) or SKIP_DESCRIPTIONS.match(normalized_text):
+            continue
+        if not LEADING_DATE.match(normalized_text):
+            # Encabezados de página repetidos (cuenta, período, titular)
+            first_segment = text_segments.setdefault(normalized_text, segment)
+            if first_segment != segment:
+                continue
+        lines.append(text)
+
+    return "\n".join(lines)
+
+
+def _is_table_header(cells: List[str], normalized: List[str]) -> bool:
+    """Fila sin cifras con al menos dos títulos de columna conocidos.
+
+    Una fila sin cifras cualquiera (p. ej. la continuación de una descripción larga) no
+    cuenta como encabezado, para no perder las columnas descartadas de la tabla.
+    """
+    if any(DIGIT.search(cell) for cell in cells):
+        return False
+    return sum(1 for cell in normalized if cell in HEADER_TOKENS) >= 2
+
+
+def estimate_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def split_by_budget(text: str, max_tokens: int) -> List[str]:
+    """Divide el texto compactado en partes de a lo más `max_tokens` tokens estimados.
+
+    Corta sólo entre líneas y repite al inicio de cada parte las líneas previas a la
+    primera tabla (cuenta, período) y el último encabezado de tabla visto, para que el
+    LLM conserve el año y el significado de las columnas.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+
+    lines = text.splitlines()
+    # Sin tablas (texto libre) no hay preámbulo que repetir
+    first_table = next((i for i, line in enumerate(lines) if "|" in line), 0)
+    preamble = lines[:first_table]
+
+    parts: List[str] = []
+    current: List[str] = list(preamble)
+    current_tokens = estimate_tokens("\n".join(preamble))
+    header: Optional[str] = None
+    has_rows = False
+
+    for line in lines[first_table:]:
+        is_header = "|" in line and not DIGIT.search(line)
+        line_tokens = estimate_tokens(line) + 1
+        if has_rows and current_tokens + line_tokens > max_tokens:
+            parts.append("\n".join(current))
+            current = preamble + ([header] if header and not is_header else [])
+            current_tokens = estimate_tokens("\n".join(current))
+            has_rows = False
+        if is_header:
+            header = line
+        else:
+            has_rows = True
+        current.append(line)
+        current_tokens += line_tokens
+
+    if has_rows:
+        parts.append("\n".join(current))
+    return parts
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoding = None
+    return _encoding
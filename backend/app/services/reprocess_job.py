@@ -0,0 +1,309 @@
+"""Reproceso de banderas sospechosas como trabajo en segundo plano, por bloques y reanudable."""
+from __future__ import annotations
+
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, or_, update
+
+from app import models
+from app.database import SessionLocal
+from app.services import metrics, suspicious_detector
+
+CHUNK_SIZE = int(os.getenv("REPROCESS_CHUNK_SIZE", "500"))
+# El runner renueva `updated_at` en cada bloque; un trabajo 'running' sin renovar por más
+# de esto se considera abandonado y otro proceso puede tomarlo. Debe superar lo que tarda
+# un bloque, incluidas las explicaciones de la IA.
+LEASE_SECONDS = int(os.getenv("REPROCESS_LEASE_SECONDS", "300"))
+
+ACTIVE_STATUSES = ("pending", "running")
+
+# Progreso en memoria para calcular throughput del proceso actual (no sobrevive reinicios)
+_run_progress: Dict[int, Dict[str, float]] = {}
+
+
+def start_job(db, sensitivity: str, account_id: str = models.DEFAULT_ACCOUNT_ID) -> Tuple[models.ReprocessJob, bool]:
+    """Crea un trabajo nuevo para la cuenta o retorna el que ya está en curso.
+
+    El segundo valor indica si el trabajo es nuevo: sólo entonces el llamador debe lanzar
+    `run_job`; uno existente ya tiene (o tendrá) su propio runner.
+    """
+    active = (
+        db.query(models.ReprocessJob)
+        .filter(models.ReprocessJob.account_id == account_id, models.ReprocessJob.status.in_(ACTIVE_STATUSES))
+        .order_by(models.ReprocessJob.id.desc())
+        .first()
+    )
+    if active is not None:
+        return active, False
+
+    job = models.ReprocessJob(
+        account_id=account_id,
+        status="pending",
+        sensitivity=sensitivity,
+        total=db.query(models.Expense).filter(models.Expense.account_id == account_id).count(),
+        processed=0,
+        suspicious_count=0,
+        state={"chunks": 0},
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job, True
+
+
+def request_cancel(db, job: models.ReprocessJob) -> models.ReprocessJob:
+    """Marca el trabajo para cancelarse; el runner lo detiene al terminar el bloque actual."""
+    if job.status == "pending":
+        job.status = "cancelled"
+        job.finished_at = datetime.now(timezone.utc)
+    elif job.status == "running":
+        job.cancel_requested = True
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def run_job(job_id: int, from_statuses: Tuple[str, ...] = ("pending",), previous_run_id: Optional[str] = None) -> None:
+    """Ejecuta (o reanuda desde el checkpoint) un trabajo de reproceso.
+
+    Las transacciones se recorren en orden cronológico; cada una se compara sólo con las
+    anteriores usando `HistoryAccumulator`. Cada `CHUNK_SIZE` filas se hace commit junto
+    con el checkpoint (último id/fecha procesados y contadores), de modo que un fallo sólo
+    pierde el bloque en curso. Al reanudar, el acumulador se reconstruye recorriendo las
+    filas ya procesadas sin volver a puntuarlas ni llamar a la IA.
+
+    El trabajo se reclama con un UPDATE condicionado a `from_statuses`, así que si varios
+    procesos intentan correrlo (p. ej. cada worker al arrancar) sólo uno lo toma; uno
+    'running' sólo se reclama con la renovación vencida (`LEASE_SECONDS`). Cada checkpoint,
+    la cancelación y el cierre se escriben con `WHERE run_id = :run_id`: si otro runner lo
+    tomó, el bloque en curso se descarta con rollback y éste se detiene.
+    """
+    run_id = uuid.uuid4().hex
+    db = SessionLocal(expire_on_commit=False)
+    try:
+        if not _claim(db, job_id, run_id, from_statuses, previous_run_id):
+            print(f"[ReprocessJob] Trabajo #{job_id} no está en {'/'.join(from_statuses)} o ya lo tomó otro proceso")
+            return
+        job = db.get(models.ReprocessJob, job_id)
+
+        sensitivity_config = suspicious_detector.get_sensitivity_config(job.sensitivity)
+        all_expenses = (
+            db.query(models.Expense)
+            .filter(models.Expense.account_id == job.account_id)
+            .order_by(models.Expense.date, models.Expense.id)
+            .all()
+        )
+        total = len(all_expenses)
+        processed = job.processed or 0
+        suspicious_count = job.suspicious_count or 0
+
+        accumulator = suspicious_detector.HistoryAccumulator()
+        start_index = 0
+        if job.last_id is not None:
+            for index, expense in enumerate(all_expenses):
+                accumulator.add(expense)
+                if expense.id == job.last_id:
+                    start_index = index + 1
+                    break
+            else:
+                # La fila del checkpoint ya no existe: se reinicia desde el principio
+                accumulator = suspicious_detector.HistoryAccumulator()
+                processed = 0
+                suspicious_count = 0
+            print(f"[ReprocessJob] Trabajo #{job.id} reanudado desde la posición {start_index} de {total}")
+
+        _run_progress[job.id] = {"started": time.monotonic(), "processed": 0}
+        state = dict(job.state or {})
+
+        for chunk_start in range(start_index, len(all_expenses), CHUNK_SIZE):
+            db.refresh(job, attribute_names=["cancel_requested", "run_id"])
+            if job.run_id != run_id:
+                print(f"[ReprocessJob] Trabajo #{job.id} reclamado por otro runner; se detiene éste")
+                return
+            if job.cancel_requested:
+                if _finish(db, job_id, run_id, status="cancelled"):
+                    print(f"[ReprocessJob] Trabajo #{job.id} cancelado en {processed}/{total}")
+                return
+
+            chunk_started = time.perf_counter()
+            chunk = all_expenses[chunk_start:chunk_start + CHUNK_SIZE]
+            pending: List = []
+            chunk_flagged = 0
+            for expense in chunk:
+                stats = accumulator.stats_for(suspicious_detector._expense_to_transaction(expense))
+                if suspicious_detector.rescore_expense_with_stats(
+                    expense, stats, sensitivity_config, pending_explanations=pending
+                ):
+                    chunk_flagged += 1
+                accumulator.add(expense)
+            # Las explicaciones del chunk se generan en paralelo antes del checkpoint
+            suspicious_detector.explain_pending(pending)
+
+            last = chunk[-1]
+            state["chunks"] = state.get("chunks", 0) + 1
+            state["history_count"] = accumulator.count
+            checkpoint = {
+                "total": total,
+                "processed": chunk_start + len(chunk),
+                "suspicious_count": suspicious_count + chunk_flagged,
+                "last_id": last.id,
+                "last_date": last.date,
+                "state": dict(state),
+            }
+            # El checkpoint (y el heartbeat) se escriben en la misma transacción que las filas
+            # re-puntuadas, sólo si el trabajo sigue siendo de este runner
+            if not _update_owned(db, job_id, run_id, **checkpoint):
+                db.rollback()
+                print(f"[ReprocessJob] Trabajo #{job.id} reclamado por otro runner; se descarta el bloque en curso")
+                return
+            db.commit()
+            processed = checkpoint["processed"]
+            suspicious_count = checkpoint["suspicious_count"]
+            metrics.DETECTOR_FLAGGED.inc(chunk_flagged, source="reprocess")
+            metrics.DETECTOR_STAGE_SECONDS.observe(time.perf_counter() - chunk_started, stage="reprocess_chunk")
+            metrics.DETECTOR_HISTORY_SIZE.set(accumulator.count)
+            _run_progress[job.id]["processed"] += len(chunk)
+
+        if _finish(db, job_id, run_id, status="completed", total=total, processed=total):
+            print(f"[ReprocessJob] Trabajo #{job.id} completado: {suspicious_count} sospechosas de {total}")
+    except Exception as e:
+        db.rollback()
+        print(f"[ReprocessJob] Error en trabajo #{job_id}: {str(e)}")
+        _finish(db, job_id, run_id, status="failed", error=str(e))
+    finally:
+        db.close()
+
+
+def _update_owned(db, job_id: int, run_id: str, **values) -> bool:
+    """UPDATE del trabajo condicionado a que siga reclamado por `run_id`; renueva el heartbeat. No hace commit."""
+    job = models.ReprocessJob
+    result = db.execute(
+        update(job)
+        .where(job.id == job_id, job.run_id == run_id)
+        .values(updated_at=func.now(), **values)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def _finish(db, job_id: int, run_id: str, **values) -> bool:
+    if _update_owned(db, job_id, run_id, finished_at=datetime.now(timezone.utc), **values):
+        db.commit()
+        return True
+    db.rollback()
+    return False
+
+
+def _claim(db, job_id: int, run_id: str, from_statuses: Tuple[str, ...], previous_run_id: Optional[str]) -> bool:
+    job = models.ReprocessJob
+    conditions = [job.id == job_id, job.status.in_(from_statuses)]
+    if "running" in from_statuses:
+        # Un trabajo 'running' sólo se toma si sigue con el runner que se observó y éste
+        # dejó de renovar el heartbeat
+        conditions.append(job.run_id.is_(None) if previous_run_id is None else job.run_id == previous_run_id)
+        conditions.append(or_(job.updated_at.is_(None), job.updated_at < _lease_cutoff()))
+    result = db.execute(
+        update(job)
+        .where(*conditions)
+        .values(status="running", run_id=run_id, cancel_requested=False, error=None, finished_at=None, updated_at=func.now())
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def _lease_cutoff() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(seconds=LEASE_SECONDS)
+
+
+def run_job_in_thread(job_id: int, from_statuses: Tuple[str, ...] = ("pending",), previous_run_id: Optional[str] = None) -> threading.Thread:
+    thread = threading.Thread(
+        target=run_job, args=(job_id, from_statuses, previous_run_id), name=f"reprocess-job-{job_id}", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def resume_interrupted_jobs() -> None:
+    """Reanuda trabajos pendientes o que quedaron 'running' por una caída del proceso.
+
+    Corre en cada worker al arrancar; el reclamo de `run_job` garantiza que cada trabajo
+    quede con un solo runner. Un trabajo 'running' con heartbeat vigente puede seguir vivo
+    en otro worker: se vigila en un hilo y se toma sólo si deja de renovarse.
+    """
+    db = SessionLocal()
+    try:
+        jobs = (
+            db.query(models.ReprocessJob.id, models.ReprocessJob.status, models.ReprocessJob.run_id)
+            .filter(models.ReprocessJob.status.in_(ACTIVE_STATUSES))
+            .all()
+        )
+    finally:
+        db.close()
+    for job_id, status, run_id in jobs:
+        if status == "running":
+            threading.Thread(
+                target=_resume_when_stale, args=(job_id, run_id), name=f"reprocess-lease-{job_id}", daemon=True
+            ).start()
+            continue
+        print(f"[ReprocessJob] Reanudando trabajo interrumpido #{job_id}")
+        run_job_in_thread(job_id, (status,), run_id)
+
+
+def _resume_when_stale(job_id: int, run_id: Optional[str]) -> None:
+    """Espera a que venza la renovación del runner observado y entonces intenta reclamar el trabajo."""
+    while True:
+        db = SessionLocal()
+        try:
+            job = db.get(models.ReprocessJob, job_id)
+            if job is None or job.status != "running" or job.run_id != run_id:
+                return
+            heartbeat = job.updated_at
+        finally:
+            db.close()
+        if heartbeat is not None and heartbeat.tzinfo is None:
+            heartbeat = heartbeat.replace(tzinfo=timezone.utc)
+        if heartbeat is None or heartbeat < _lease_cutoff():
+            print(f"[ReprocessJob] Reanudando trabajo interrumpido #{job_id}")
+            run_job(job_id, ("running",), run_id)
+            return
+        # Con el runner vivo el heartbeat avanza y el reclamo no prospera; se vuelve a mirar
+        time.sleep(max(1.0, (heartbeat - _lease_cutoff()).total_seconds()))
+
+
+def job_progress(job: models.ReprocessJob) -> Dict:
+    total = job.total or 0
+    processed = job.processed or 0
+    percent = (processed / total * 100) if total else 100.0
+
+    throughput: Optional[float] = None
+    eta_seconds: Optional[float] = None
+    run = _run_progress.get(job.id)
+    if run and job.status == "running":
+        elapsed = time.monotonic() - run["started"]
+        if elapsed > 0 and run["processed"] > 0:
+            throughput = run["processed"] / elapsed
+            eta_seconds = max(0, total - processed) / throughput
+
+    return {
+        "job_id": job.id,
+        "account_id": job.account_id,
+        "status": job.status,
+        "sensitivity": job.sensitivity,
+        "total": total,
+        "processed": processed,
+        "percent": round(percent, 2),
+        "suspicious_count": job.suspicious_count or 0,
+        "throughput_per_second": round(throughput, 2) if throughput is not None else None,
+        "eta_seconds": round(eta_seconds, 1) if eta_seconds is not None else None,
+        "checkpoint": {"last_id": job.last_id, "last_date": job.last_date},
+        "cancel_requested": bool(job.cancel_requested),
+        "error": job.error,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
@@ -0,0 +1,212 @@
+"""Parser determinístico de cartolas bancarias a partir de las tablas Markdown de Docling.
+
+Reconoce los formatos habituales de cartolas chilenas: columnas de fecha, descripción
+y cargos/abonos separados (cuenta corriente, cuenta vista) o una sola columna de monto
+(tarjeta de crédito, donde los montos negativos son pagos/abonos). Si la estructura no
+se reconoce retorna `None` y la extracción cae al LLM.
+"""
+from __future__ import annotations
+
+import re
+import unicodedata
+from collections import Counter
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional
+
+DATE_HEADERS = ("fecha", "fecha operacion", "fecha movimiento", "fecha mov", "fecha transaccion", "dia")
+DESCRIPTION_HEADERS = (
+    "descripcion", "detalle", "glosa", "movimiento", "concepto", "comercio",
+    "descripcion movimiento", "detalle movimiento", "lugar de operacion", "descripcion operacion",
+)
+CHARGE_HEADERS = (
+    "cargo", "cargos", "debito", "debitos", "giro", "giros", "cheques y otros cargos",
+    "monto cargo", "cargos ($)", "egresos",
+)
+DEPOSIT_HEADERS = (
+    "abono", "abonos", "credito", "creditos", "deposito", "depositos",
+    "depositos y otros abonos", "monto abono", "abonos ($)", "ingresos",
+)
+AMOUNT_HEADERS = ("monto", "importe", "valor", "monto operacion", "monto ($)", "valor cuota", "monto total")
+
+# Filas de resumen que no son transacciones aunque tengan fecha. Se exige la frase completa
+# (seguida a lo más de montos o fechas) para no descartar comercios como "TOTAL ENERGIES".
+SKIP_DESCRIPTIONS = re.compile(
+    r"^(?:saldos?(?: (?:anterior|inicial|final|disponible|contable|promedio|actual|al|a la fecha|del periodo))?"
+    r"|total(?:es)?(?: (?:de |del )?(?:cargos|abonos|compras|pagos|giros|depositos|movimientos|operaciones"
+    r"|facturado|a pagar|periodo|mes|general))?"
+    r"|subtotal(?:es)?|resumen(?: de (?:cuenta|movimientos|cargos|abonos|operaciones))?"
+    r"|traspaso (?:a|de) pagina|pagina(?: \d+ de \d+)?)"
+    r"[\s:$()\-\d.,/]*$"
+)
+
+DATE_PATTERNS = [
+    (re.compile(r"^(\d{4})-(\d{1,2})-(\d{1,2})$"), ("y", "m", "d")),
+    (re.compile(r"^(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})$"), ("d", "m", "y")),
+    (re.compile(r"^(\d{1,2})[/.-](\d{1,2})[/.-](\d{2})$"), ("d", "m", "yy")),
+    (re.compile(r"^(\d{1,2})[/.-](\d{1,2})$"), ("d", "m")),
+]
+
+SEPARATOR_CELL = re.compile(r"^:?-{3,}:?$")
+YEAR_PATTERN = re.compile(r"\b(20\d{2})\b")
+
+
+def parse_statement(markdown: str, default_year: Optional[int] = None) -> Optional[List[Dict]]:
+    """Extrae transacciones de las tablas reconocibles del Markdown de una cartola.
+
+    Retorna `None` si ninguna tabla tiene un formato conocido, para que el llamador
+    use la extracción completa con LLM. `default_year` se usa para fechas sin año cuando
+    el texto no menciona el año (p. ej. ventanas de páginas posteriores a la primera).
+    """
+    default_year = statement_year(markdown) or default_year
+    transactions: List[Dict] = []
+    recognized = False
+
+    for table in _iter_tables(markdown):
+        layout = None
+        for row in table:
+            candidate = _detect_layout(row)
+            if candidate:
+                # Docling repite el encabezado en cada página
+                layout = candidate
+                recognized = True
+                continue
+            if layout is None:
+                continue
+            transaction = _parse_row(row, layout, default_year)
+            if transaction:
+                transactions.append(transaction)
+
+    if not recognized or not transactions:
+        return None
+    return transactions
+
+
+def _iter_tables(markdown: str) -> List[List[List[str]]]:
+    tables: List[List[List[str]]] = []
+    current: List[List[str]] = []
+    for line in markdown.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("|"):
+            cells = [cell.strip() for cell in stripped.strip("|").split("|")]
+            if all(SEPARATOR_CELL.match(cell) for cell in cells if cell):
+                continue
+            current.append(cells)
+        elif current:
+            tables.append(current)
+            current = []
+    if current:
+        tables.append(current)
+    return tables
+
+
+def _normalize_header(cell: str) -> str:
+    text = unicodedata.normalize("NFKD", cell).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"\s+", " ", text.lower().strip(" .:*"))
+
+
+def _detect_layout(cells: List[str]) -> Optional[Dict[str, int]]:
+    headers = [_normalize_header(cell) for cell in cells]
+    layout: Dict[str, int] = {}
+    for index, header in enumerate(headers):
+        if not header:
+            continue
+        if "date" not in layout and header in DATE_HEADERS:
+            layout["date"] = index
+        elif "description" not in layout and header in DESCRIPTION_HEADERS:
+            layout["description"] = index
+        elif "charge" not in layout and header in CHARGE_HEADERS:
+            layout["charge"] = index
+        elif "deposit" not in layout and header in DEPOSIT_HEADERS:
+            layout["deposit"] = index
+        elif "amount" not in layout and header in AMOUNT_HEADERS:
+            layout["amount"] = index
+
+    if "date" not in layout or "description" not in layout:
+        return None
+    if not ({"charge", "deposit"} & layout.keys()) and "amount" not in layout:
+        return None
+    return layout
+
+
+def _parse_row(cells: List[str], layout: Dict[str, int], default_year: Optional[int]) -> Optional[Dict]:
+    def cell(key: str) -> str:
+        index = layout.get(key)
+        return cells[index] if index is not None and index < len(cells) else ""
+
+    date = _parse_date(cell("date"), default_year)
+    description = re.sub(r"\s+", " ", cell("description")).strip()
+    if not date or not description:
+        return None
+    if SKIP_DESCRIPTIONS.match(_normalize_header(description)):
+        return None
+
+    charge = _parse_amount(cell("charge"))
+    deposit = _parse_amount(cell("deposit"))
+    if charge:
+        amount, transaction_type = abs(charge), "cargo"
+    elif deposit:
+        amount, transaction_type = abs(deposit), "abono"
+    else:
+        single = _parse_amount(cell("amount"))
+        if not single:
+            return None
+        # Formato tarjeta de crédito: los pagos y reversas aparecen con signo negativo
+        amount, transaction_type = abs(single), "abono" if single < 0 else "cargo"
+
+    return {
+        "date": date,
+        "amount": amount,
+        "vendor": description,
+        "description": description,
+        "transaction_type": transaction_type,
+    }
+
+
+def _parse_date(value: str, default_year: Optional[int]) -> Optional[str]:
+    value = value.strip()
+    for pattern, order in DATE_PATTERNS:
+        match = pattern.match(value)
+        if not match:
+            continue
+        parts = dict(zip(order, (int(group) for group in match.groups())))
+        year = parts.get("y")
+        if year is None and "yy" in parts:
+            year = 2000 + parts["yy"]
+        if year is None:
+            year = default_year
+        if year is None:
+            return None
+        try:
+            return datetime(year, parts["m"], parts["d"]).strftime("%Y-%m-%d")
+        except ValueError:
+            return None
+    return None
+
+
+def _parse_amount(value: str) -> Optional[Decimal]:
+    """Interpreta montos en formato chileno: '$ 1.234.567', '1.234,50', '-12.000', '(12.000)'."""
+    text = value.strip().replace("$", "").replace(" ", "")
+    if not text or text in ("-", "0"):
+        return None
+    negative = text.startswith("-") or text.endswith("-") or (text.startswith("(") and text.endswith(")"))
+    text = text.strip("-()")
+    if "," in text:
+        text = text.replace(".", "").replace(",", ".")
+    elif re.fullmatch(r"\d{1,3}(\.\d{3})+", text):
+        text = text.replace(".", "")
+    if not re.fullmatch(r"\d+(\.\d+)?", text):
+        return None
+    try:
+        amount = Decimal(text)
+    except InvalidOperation:
+        return None
+    if amount == 0:
+        return None
+    return -amount if negative else amount
+
+
+def statement_year(markdown: str) -> Optional[int]:
+    """Año más frecuente en el texto, para fechas sin año (dd/mm)."""
+    years = Counter(int(year) for year in YEAR_PATTERN.findall(markdown))
+    return years.most_common(1)[0][0] if years else None
@@ -1,13 +1,14 @@
 from __future__ import annotations
 
+from bisect import insort
 from collections import defaultdict
 from statistics import mean
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime, time
 import re
 
 from app import models
-from app.services import openai_service
+from app.services import metrics, openai_service, profiling
 
 # Niveles de sensibilidad
 SENSITIVITY_LEVELS = {
@@ -19,7 +20,7 @@ SENSITIVITY_LEVELS = {
 DEFAULT_SENSITIVITY = "standard"
 
 
-def annotate_transactions(transactions: List[Dict], db, sensitivity: str = DEFAULT_SENSITIVITY, exclude_vendors: Optional[List[str]] = None) -> List[Dict]:
+def annotate_transactions(transactions: List[Dict], db, sensitivity: str = DEFAULT_SENSITIVITY, exclude_vendors: Optional[List[str]] = None, account_id: str = models.DEFAULT_ACCOUNT_ID, history_snapshot: Optional[List] = None) -> List[Dict]:
     """Annotate transactions with suspicious flags using historical expenses.
     
     Args:
@@ -27,16 +28,23 @@ def annotate_transactions(transactions: List[Dict], db, sensitivity: str = DEFAU
         db: Database session
         sensitivity: Sensitivity level ('conservative', 'standard', 'strict')
         exclude_vendors: Optional list of vendor names to exclude from history (for current batch)
+        account_id: Account whose history is used as the baseline
+        history_snapshot: Optional preloaded history (e.g. from `parquet_export.load_history`) used instead of querying the database
     """
-    # Obtener historial completo
-    all_history = db.query(models.Expense).all()
-    sensitivity_config = SENSITIVITY_LEVELS.get(sensitivity, SENSITIVITY_LEVELS[DEFAULT_SENSITIVITY])
+    # Obtener historial completo de la cuenta
+    with metrics.DETECTOR_STAGE_SECONDS.time(stage="load_history"), profiling.span("detector.load_history"):
+        if history_snapshot is None:
+            all_history = db.query(models.Expense).filter(models.Expense.account_id == account_id).all()
+        else:
+            all_history = list(history_snapshot)
+    sensitivity_config = get_sensitivity_config(sensitivity)
     
     # Inicializar todas las transacciones
     for transaction in transactions:
         transaction.setdefault("is_suspicious", False)
         transaction.setdefault("suspicious_reason", None)
         transaction.setdefault("suspicion_score", 0.0)
+        transaction.setdefault("detector_features", None)
 
     # Si no hay historial, retornar sin análisis
     if not all_history:
@@ -60,133 +68,627 @@ def annotate_transactions(transactions: List[Dict], db, sensitivity: str = DEFAU
         history = all_history
         print(f"[SuspiciousDetector] Usando todo el historial ({len(history)} transacciones) - historial filtrado insuficiente")
 
-    stats = _build_stats(history)
+    metrics.DETECTOR_HISTORY_SIZE.set(len(history))
+    with metrics.DETECTOR_STAGE_SECONDS.time(stage="build_stats"), profiling.span("detector.build_stats"):
+        stats = _build_stats(history)
     print(f"[SuspiciousDetector] Analizando {len(transactions)} transacciones con historial de {len(history)} transacciones")
 
-    for transaction in transactions:
-        amount = float(transaction.get("amount") or 0)
-        category = transaction.get("category")
-        tx_type = transaction.get("transaction_type", "cargo")
-        vendor_key = _normalize_vendor(
-            transaction.get("merchant_normalized") or transaction.get("vendor")
+    historical_context = {
+        "avg_amount": stats["global"].get("mean", 0),
+        "total_transactions": stats["global"].get("count", 0),
+    }
+    # Primero se puntúa todo el lote; las explicaciones con IA se generan después en paralelo
+    pending: List[Tuple[Dict, List[str]]] = []
+    flagged = 0
+    with metrics.DETECTOR_STAGE_SECONDS.time(stage="score"), profiling.span("detector.score"):
+        for transaction in transactions:
+            with profiling.span("detector.features"):
+                features = compute_features(transaction, stats)
+            with profiling.span("detector.rules"):
+                suspicion_score, reasons = score_features(features, sensitivity_config)
+            transaction["detector_features"] = features
+
+            # Aplicar umbral de sensibilidad
+            transaction["suspicion_score"] = suspicion_score
+            if suspicion_score >= sensitivity_config["threshold"]:
+                transaction["is_suspicious"] = True
+                flagged += 1
+                if reasons:
+                    pending.append((transaction, reasons))
+                else:
+                    transaction["suspicious_reason"] = "Movimiento marcado como sospechoso por el sistema."
+    metrics.DETECTOR_FLAGGED.inc(flagged, source="upload")
+
+    with metrics.DETECTOR_STAGE_SECONDS.time(stage="explain"), profiling.span("detector.explain"):
+        explanations = openai_service.generate_suspicious_explanations(
+            [(transaction, reasons, historical_context) for transaction, reasons in pending]
         )
-        transaction_date = transaction.get("date")
-        merchant_category = transaction.get("merchant_category")
-
-        reasons: List[str] = []
-        suspicion_score = 0.0
-        vendor_stats = stats["vendors"].get(vendor_key) if vendor_key else None
-        category_stats = stats["categories"].get(category)
-        global_stats = stats["global"]
-
-        # 1. Análisis de monto por comercio
-        if vendor_stats and vendor_stats["count"] >= 3:
-            threshold = vendor_stats["mean"] + (sensitivity_config["multiplier"] * vendor_stats["std"])
-            if vendor_stats["std"] == 0:
-                threshold = vendor_stats["mean"] * (1.5 + sensitivity_config["multiplier"] * 0.2)
-            if amount > threshold:
-                multiplier = amount / vendor_stats["mean"] if vendor_stats["mean"] > 0 else 0
-                score_increase = min(0.4, multiplier / 10)
-                suspicion_score += score_increase
-                reasons.append(
-                    f"Monto {multiplier:.1f}x mayor al promedio histórico en {transaction.get('vendor') or 'este comercio'} "
-                    f"(promedio: {vendor_stats['mean']:.0f}, observado: {amount:.0f})."
-                )
+    for (transaction, _), explanation in zip(pending, explanations):
+        transaction["suspicious_reason"] = explanation
 
-            # Detección de cambio de tipo de transacción
-            historic_types = vendor_stats["types"]
-            if (
-                tx_type == "abono"
-                and historic_types.get("abono", 0) == 0
-                and historic_types.get("cargo", 0) >= 3
-            ):
-                suspicion_score += 0.2
-                reasons.append(
-                    "Primer abono en un comercio que previamente solo registraba cargos."
-                )
-        elif (
-            not vendor_stats
-            and global_stats["count"] >= 15
-            and amount > global_stats["p95"]
-        ):
-            suspicion_score += 0.3
+    return transactions
+
+
+def get_sensitivity_config(sensitivity: Optional[str]) -> Dict[str, float]:
+    return SENSITIVITY_LEVELS.get(sensitivity or DEFAULT_SENSITIVITY, SENSITIVITY_LEVELS[DEFAULT_SENSITIVITY])
+
+
+def compute_features(transaction: Dict, stats: Dict) -> Dict:
+    """Calcula las métricas crudas de cada regla, independientes de la sensibilidad.
+
+    El resultado se persiste en `Expense.detector_features`, de modo que cambiar el
+    nivel de sensibilidad sólo requiere volver a aplicar `score_features`.
+    """
+    amount = float(transaction.get("amount") or 0)
+    category = transaction.get("category")
+    tx_type = transaction.get("transaction_type") or "cargo"
+    vendor_key = _normalize_vendor(
+        transaction.get("merchant_normalized") or transaction.get("vendor")
+    )
+    transaction_date = transaction.get("date")
+    merchant_category = transaction.get("merchant_category")
+
+    vendor_stats = stats["vendors"].get(vendor_key) if vendor_key else None
+    category_stats = stats["categories"].get(category)
+    global_stats = stats["global"]
+
+    features: Dict = {
+        "amount": amount,
+        "transaction_type": tx_type,
+        "vendor_label": transaction.get("vendor"),
+        "category": category,
+        "merchant_category": merchant_category,
+        "vendor_count": 0,
+        "vendor_mean": 0.0,
+        "vendor_std": 0.0,
+        "vendor_z": None,
+        "vendor_ratio": None,
+        "first_abono": False,
+        "new_vendor_p95": None,
+        "category_count": 0,
+        "category_p90": 0.0,
+        "category_ratio": None,
+        "global_count": global_stats["count"],
+        "global_mean": global_stats["mean"],
+        "global_ratio": None,
+        "weekday": None,
+        "weekday_frequency": None,
+        "weekday_total": 0,
+        "days_since_last": None,
+        "avg_interval": None,
+        "interval_ratio": None,
+        "category_novelty": False,
+    }
+
+    # 1. Monto por comercio (z-score y razón respecto al promedio)
+    if vendor_stats:
+        features["vendor_count"] = vendor_stats["count"]
+        features["vendor_mean"] = vendor_stats["mean"]
+        features["vendor_std"] = vendor_stats["std"]
+        if vendor_stats["std"] > 0:
+            features["vendor_z"] = (amount - vendor_stats["mean"]) / vendor_stats["std"]
+        features["vendor_ratio"] = amount / vendor_stats["mean"] if vendor_stats["mean"] > 0 else 0.0
+
+        historic_types = vendor_stats["types"]
+        features["first_abono"] = (
+            tx_type == "abono"
+            and historic_types.get("abono", 0) == 0
+            and historic_types.get("cargo", 0) >= 3
+        )
+    elif global_stats["count"] >= 15:
+        features["new_vendor_p95"] = global_stats["p95"]
+
+    # 2. Razón respecto al percentil 90 de la categoría
+    if category_stats:
+        features["category_count"] = category_stats["count"]
+        features["category_p90"] = category_stats["p90"]
+        features["category_ratio"] = amount / category_stats["p90"] if category_stats["p90"] > 0 else 0.0
+
+    # 3. Razón respecto al promedio global
+    if global_stats["mean"] > 0:
+        features["global_ratio"] = amount / global_stats["mean"]
+
+    # 4. Frecuencia del día de la semana
+    if transaction_date:
+        weekday, frequency, total = _weekday_frequency(transaction_date, stats)
+        features["weekday"] = weekday
+        features["weekday_frequency"] = frequency
+        features["weekday_total"] = total
+
+    # 5. Intervalo desde la última transacción en el comercio
+    if vendor_key and vendor_key in stats["vendor_frequency"]:
+        freq_stats = stats["vendor_frequency"][vendor_key]
+        days_since_last = _days_since_last_transaction(transaction_date, freq_stats["last_date"])
+        avg_interval = freq_stats["avg_interval"]
+        features["days_since_last"] = days_since_last
+        features["avg_interval"] = avg_interval
+        if avg_interval > 0:
+            features["interval_ratio"] = days_since_last / avg_interval
+
+    # 6. Novedad de la categoría de comercio
+    if merchant_category and vendor_key:
+        vendor_categories = stats["vendor_categories"].get(vendor_key, set())
+        features["category_novelty"] = (
+            merchant_category not in vendor_categories and len(vendor_categories) > 0
+        )
+
+    return features
+
+
+def score_features(features: Dict, sensitivity_config: Dict[str, float]) -> Tuple[float, List[str]]:
+    """Aplica las reglas del detector sobre las métricas crudas y retorna (score, razones)."""
+    amount = features["amount"]
+    multiplier_config = sensitivity_config["multiplier"]
+    reasons: List[str] = []
+    suspicion_score = 0.0
+
+    # 1. Análisis de monto por comercio
+    if features["vendor_count"] >= 3:
+        vendor_mean = features["vendor_mean"]
+        threshold = vendor_mean + (multiplier_config * features["vendor_std"])
+        if features["vendor_std"] == 0:
+            threshold = vendor_mean * (1.5 + multiplier_config * 0.2)
+        if amount > threshold:
+            multiplier = features["vendor_ratio"] or 0
+            suspicion_score += min(0.4, multiplier / 10)
             reasons.append(
-                f"Comercio nuevo con monto superior al percentil 95 de tu historial ({global_stats['p95']:.0f})."
+                f"Monto {multiplier:.1f}x mayor al promedio histórico en {features.get('vendor_label') or 'este comercio'} "
+                f"(promedio: {vendor_mean:.0f}, observado: {amount:.0f})."
             )
 
-        # 2. Análisis de categoría
-        if (
-            category_stats
-            and category_stats["count"] >= 5
-            and amount > (category_stats["p90"] * 1.4)
-        ):
-            multiplier = amount / category_stats["p90"] if category_stats["p90"] > 0 else 0
-            suspicion_score += min(0.25, multiplier / 15)
+        # Detección de cambio de tipo de transacción
+        if features["first_abono"]:
+            suspicion_score += 0.2
             reasons.append(
-                f"Monto {multiplier:.1f}x superior al percentil 90 para la categoría '{category}' "
-                f"(percentil 90: {category_stats['p90']:.0f})."
+                "Primer abono en un comercio que previamente solo registraba cargos."
             )
+    elif (
+        features["new_vendor_p95"] is not None
+        and amount > features["new_vendor_p95"]
+    ):
+        suspicion_score += 0.3
+        reasons.append(
+            f"Comercio nuevo con monto superior al percentil 95 de tu historial ({features['new_vendor_p95']:.0f})."
+        )
+
+    # 2. Análisis de categoría
+    if (
+        features["category_count"] >= 5
+        and amount > (features["category_p90"] * 1.4)
+    ):
+        multiplier = features["category_ratio"] or 0
+        suspicion_score += min(0.25, multiplier / 15)
+        reasons.append(
+            f"Monto {multiplier:.1f}x superior al percentil 90 para la categoría '{features.get('category')}' "
+            f"(percentil 90: {features['category_p90']:.0f})."
+        )
 
-        # 3. Análisis global de monto
+    # 3. Análisis global de monto
+    if (
+        features["transaction_type"] == "cargo"
+        and features["global_count"] >= 20
+        and amount > features["global_mean"] * (2.5 + multiplier_config * 0.5)
+    ):
+        multiplier = features["global_ratio"] or 0
+        suspicion_score += min(0.3, multiplier / 12)
+        reasons.append(
+            f"Cargo {multiplier:.1f}x superior a tu gasto promedio histórico ({features['global_mean']:.0f})."
+        )
+
+    # 4. Análisis de fecha/horario (si está disponible)
+    if (
+        features["weekday_frequency"] is not None
+        and features["weekday_frequency"] < 0.05
+        and features["weekday_total"] > 20
+    ):
+        suspicion_score += 0.1
+        reasons.append(
+            f"Transacción en {_weekday_name(features['weekday'])}, día poco frecuente en tu historial."
+        )
+
+    # 5. Análisis de frecuencia de comercio
+    days_since_last = features["days_since_last"]
+    if (
+        days_since_last is not None
+        and days_since_last > 0
+        and days_since_last > features["avg_interval"] * 3
+    ):
+        suspicion_score += 0.15
+        reasons.append(
+            f"Transacción después de {days_since_last} días, cuando el intervalo promedio es de {features['avg_interval']:.0f} días."
+        )
+
+    # 6. Análisis de categoría de comercio atípica
+    if features["category_novelty"]:
+        suspicion_score += 0.1
+        reasons.append(
+            f"Comercio con categoría '{features.get('merchant_category')}' diferente a sus categorías históricas."
+        )
+
+    return min(1.0, suspicion_score), reasons
+
+
+def rescore_expense(expense: models.Expense, history: List[models.Expense], sensitivity_config: Dict[str, float], keep_existing_reason: bool = False, pending_explanations: Optional[List] = None) -> bool:
+    """Recalcula las banderas de una transacción persistida comparándola con su historial previo.
+
+    Con `keep_existing_reason=True` sólo se genera una nueva explicación si la transacción
+    pasa a ser sospechosa, evitando llamadas a la IA para banderas que no cambian.
+    """
+    return rescore_expense_with_stats(
+        expense, _build_stats(history), sensitivity_config, keep_existing_reason, pending_explanations
+    )
+
+
+def rescore_expense_with_stats(expense: models.Expense, stats: Dict, sensitivity_config: Dict[str, float], keep_existing_reason: bool = False, pending_explanations: Optional[List] = None) -> bool:
+    """Igual que `rescore_expense`, pero con estadísticas ya calculadas (p. ej. desde `HistoryAccumulator`).
+
+    Si se pasa `pending_explanations`, la explicación con IA no se genera aquí: se deja la
+    explicación por reglas y se encola el gasto para `explain_pending`.
+    """
+    was_suspicious = bool(expense.is_suspicious)
+
+    # Si no hay suficiente historial, no se analiza
+    if stats["global"]["count"] < 3:
+        expense.is_suspicious = False
+        expense.suspicion_score = None
+        expense.suspicious_reason = None
+        expense.detector_features = None
+        return False
+
+    tx_dict = _expense_to_transaction(expense)
+    features = compute_features(tx_dict, stats)
+    suspicion_score, reasons = score_features(features, sensitivity_config)
+    expense.detector_features = features
+
+    if suspicion_score < sensitivity_config["threshold"]:
+        expense.is_suspicious = False
+        expense.suspicion_score = float(suspicion_score) if suspicion_score > 0 else None
+        expense.suspicious_reason = None
+        return False
+
+    expense.is_suspicious = True
+    expense.suspicion_score = float(suspicion_score)
+    if keep_existing_reason and was_suspicious and expense.suspicious_reason:
+        return True
+
+    # Generar explicación mejorada con IA si hay razones
+    if reasons:
+        historical_context = {
+            "avg_amount": stats["global"].get("mean", 0),
+            "total_transactions": stats["global"].get("count", 0),
+        }
+        if pending_explanations is not None:
+            expense.suspicious_reason = " | ".join(reasons)
+            pending_explanations.append((expense, tx_dict, reasons, historical_context))
+            return True
+        try:
+            expense.suspicious_reason = openai_service.generate_suspicious_explanation(
+                tx_dict, reasons, historical_context
+            )
+        except Exception as e:
+            print(f"Error generando explicación con IA: {str(e)}")
+            expense.suspicious_reason = " | ".join(reasons)
+    else:
+        expense.suspicious_reason = "Movimiento marcado como sospechoso por el sistema."
+    return True
+
+
+def explain_pending(pending_explanations: List) -> None:
+    """Genera concurrentemente las explicaciones encoladas por `rescore_expense_with_stats`."""
+    explanations = openai_service.generate_suspicious_explanations(
+        [(tx_dict, reasons, context) for _, tx_dict, reasons, context in pending_explanations]
+    )
+    for (expense, _, _, _), explanation in zip(pending_explanations, explanations):
+        expense.suspicious_reason = explanation
+    pending_explanations.clear()
+
+
+def rescore_dependents(db, changed: List[Dict], sensitivity: str = DEFAULT_SENSITIVITY, account_id: str = models.DEFAULT_ACCOUNT_ID) -> List[Dict]:
+    """Re-evalúa sólo las transacciones cuyo score depende de las filas modificadas.
+
+    `changed` contiene instantáneas (antes y/o después del cambio) con `vendor`,
+    `merchant_normalized`, `category` y `date`. Se recalculan las transacciones del mismo
+    comercio o categoría con fecha igual o posterior a la más antigua de las instantáneas,
+    cada una contra su historial cronológico previo, igual que `/expenses/reprocess-suspicious`:
+    el historial se recorre una sola vez con `HistoryAccumulator` y sólo se puntúan las
+    filas afectadas. Las estadísticas globales también cambian, pero su efecto es marginal y queda para el
+    reproceso completo.
+    """
+    vendor_keys = {
+        _normalize_vendor(snapshot.get("merchant_normalized") or snapshot.get("vendor"))
+        for snapshot in changed
+    } - {None}
+    categories = {snapshot.get("category") for snapshot in changed} - {None}
+    dates = [snapshot.get("date") for snapshot in changed if snapshot.get("date")]
+    since_date = min(dates) if dates else None
+
+    if not vendor_keys and not categories:
+        return []
+
+    sensitivity_config = get_sensitivity_config(sensitivity)
+    all_expenses = (
+        db.query(models.Expense)
+        .filter(models.Expense.account_id == account_id)
+        .order_by(models.Expense.date, models.Expense.id)
+        .all()
+    )
+
+    changes: List[Dict] = []
+    pending: List = []
+    rescored = 0
+    accumulator = HistoryAccumulator()
+    for expense in all_expenses:
+        vendor_key = _normalize_vendor(expense.merchant_normalized or expense.vendor)
         if (
-            tx_type == "cargo"
-            and stats["global"]["count"] >= 20
-            and amount > stats["global"]["mean"] * (2.5 + sensitivity_config["multiplier"] * 0.5)
+            (since_date and (not expense.date or expense.date < since_date))
+            or (vendor_key not in vendor_keys and expense.category not in categories)
         ):
-            multiplier = amount / stats["global"]["mean"] if stats["global"]["mean"] > 0 else 0
-            suspicion_score += min(0.3, multiplier / 12)
-            reasons.append(
-                f"Cargo {multiplier:.1f}x superior a tu gasto promedio histórico ({stats['global']['mean']:.0f})."
-            )
+            accumulator.add(expense)
+            continue
 
-        # 4. Análisis de fecha/horario (si está disponible)
-        if transaction_date:
-            date_analysis = _analyze_date_pattern(transaction_date, history, stats)
-            if date_analysis["is_unusual"]:
-                suspicion_score += date_analysis["score"]
-                reasons.append(date_analysis["reason"])
-
-        # 5. Análisis de frecuencia de comercio
-        if vendor_key and vendor_key in stats["vendor_frequency"]:
-            freq_stats = stats["vendor_frequency"][vendor_key]
-            days_since_last = _days_since_last_transaction(transaction_date, freq_stats["last_date"])
-            if days_since_last > 0 and days_since_last > freq_stats["avg_interval"] * 3:
-                suspicion_score += 0.15
-                reasons.append(
-                    f"Transacción después de {days_since_last} días, cuando el intervalo promedio es de {freq_stats['avg_interval']:.0f} días."
-                )
+        before = (bool(expense.is_suspicious), expense.suspicion_score)
+        stats = accumulator.stats_for(_expense_to_transaction(expense))
+        rescore_expense_with_stats(expense, stats, sensitivity_config, keep_existing_reason=True, pending_explanations=pending)
+        accumulator.add(expense)
+        rescored += 1
+        after = (bool(expense.is_suspicious), expense.suspicion_score)
+        if before != after:
+            changes.append({
+                "id": expense.id,
+                "was_suspicious": before[0],
+                "is_suspicious": after[0],
+                "previous_score": before[1],
+                "suspicion_score": after[1],
+            })
+
+    explain_pending(pending)
+    db.commit()
+    print(
+        f"[SuspiciousDetector] Re-score incremental: {rescored} transacciones re-evaluadas "
+        f"(comercios={sorted(vendor_keys)}, categorías={sorted(categories)}, desde={since_date}), "
+        f"{len(changes)} cambios"
+    )
+    for change in changes:
+        print(
+            f"[SuspiciousDetector]   #{change['id']}: sospechosa {change['was_suspicious']} -> {change['is_suspicious']}, "
+            f"score {change['previous_score']} -> {change['suspicion_score']}"
+        )
+    return changes
 
-        # 6. Análisis de categoría de comercio atípica
-        if merchant_category and vendor_key:
-            vendor_categories = stats["vendor_categories"].get(vendor_key, set())
-            if merchant_category not in vendor_categories and len(vendor_categories) > 0:
-                suspicion_score += 0.1
-                reasons.append(
-                    f"Comercio con categoría '{merchant_category}' diferente a sus categorías históricas."
-                )
 
-        # Aplicar umbral de sensibilidad
-        transaction["suspicion_score"] = min(1.0, suspicion_score)
-        if suspicion_score >= sensitivity_config["threshold"]:
-            transaction["is_suspicious"] = True
-            
-            # Generar explicación mejorada con IA si hay razones
-            if reasons:
-                historical_context = {
-                    "avg_amount": global_stats.get("mean", 0),
-                    "total_transactions": global_stats.get("count", 0),
-                }
-                try:
-                    transaction["suspicious_reason"] = openai_service.generate_suspicious_explanation(
-                        transaction, reasons, historical_context
-                    )
-                except:
-                    # Fallback a explicación simple si falla IA
-                    transaction["suspicious_reason"] = " | ".join(reasons)
+def replay_history(history: List, sensitivity: str = DEFAULT_SENSITIVITY) -> Dict:
+    """Repite el reproceso cronológico sobre un historial en memoria, sin escribir en la base ni llamar a la IA.
+
+    Pensado para el snapshot Parquet de `parquet_export.load_history`: cada transacción se
+    compara sólo con las anteriores, como en `reprocess_job.run_job`, y `changed` cuenta las
+    marcas que difieren de las guardadas en el snapshot.
+    """
+    sensitivity_config = get_sensitivity_config(sensitivity)
+    accumulator = HistoryAccumulator()
+    flagged: List[Dict] = []
+    changed = 0
+    for expense in sorted(history, key=lambda expense: (expense.date or "", expense.id)):
+        transaction = _expense_to_transaction(expense)
+        suspicion_score, reasons = 0.0, []
+        stats = accumulator.stats_for(transaction)
+        if stats["global"]["count"] >= 3:
+            suspicion_score, reasons = score_features(compute_features(transaction, stats), sensitivity_config)
+        is_suspicious = suspicion_score >= sensitivity_config["threshold"]
+        if is_suspicious:
+            flagged.append({
+                "id": expense.id,
+                "date": expense.date,
+                "vendor": expense.merchant_normalized or expense.vendor,
+                "amount": transaction["amount"],
+                "suspicion_score": round(float(suspicion_score), 4),
+                "reasons": reasons,
+            })
+        if is_suspicious != bool(expense.is_suspicious):
+            changed += 1
+        accumulator.add(expense)
+
+    print(f"[SuspiciousDetector] Replay '{sensitivity}': {len(flagged)} sospechosas, {changed} cambios sobre {len(history)} transacciones")
+    return {
+        "sensitivity": sensitivity,
+        "total": len(history),
+        "suspicious_count": len(flagged),
+        "changed": changed,
+        "flagged": flagged,
+    }
+
+
+def _expense_to_transaction(expense: models.Expense) -> Dict:
+    return {
+        "date": expense.date,
+        "amount": float(expense.amount or 0),
+        "vendor": expense.vendor,
+        "merchant_normalized": expense.merchant_normalized,
+        "merchant_category": expense.merchant_category,
+        "category": expense.category,
+        "transaction_type": expense.transaction_type or "cargo",
+        "charge_archetype": expense.charge_archetype,
+    }
+
+
+def rescore_from_features(db, sensitivity: str = DEFAULT_SENSITIVITY, account_id: str = models.DEFAULT_ACCOUNT_ID) -> Dict[str, int]:
+    """Re-aplica el umbral de sensibilidad usando las métricas persistidas, sin reconstruir historial.
+
+    Las transacciones que pasan a ser sospechosas reciben la explicación basada en reglas;
+    las que ya estaban marcadas conservan su explicación original.
+    """
+    sensitivity_config = get_sensitivity_config(sensitivity)
+    expenses = (
+        db.query(models.Expense)
+        .filter(models.Expense.account_id == account_id, models.Expense.detector_features.isnot(None))
+        .all()
+    )
+
+    # Filas escritas antes de la migración 0005 pueden tener JSON 'null'
+    expenses = [expense for expense in expenses if expense.detector_features is not None]
+
+    flagged = 0
+    changed = 0
+    for expense in expenses:
+        suspicion_score, reasons = score_features(expense.detector_features, sensitivity_config)
+        is_suspicious = suspicion_score >= sensitivity_config["threshold"]
+
+        if is_suspicious != bool(expense.is_suspicious):
+            changed += 1
+            if is_suspicious:
+                expense.suspicious_reason = (
+                    " | ".join(reasons) if reasons else "Movimiento marcado como sospechoso por el sistema."
+                )
             else:
-                transaction["suspicious_reason"] = "Movimiento marcado como sospechoso por el sistema."
+                expense.suspicious_reason = None
+        expense.is_suspicious = is_suspicious
+        expense.suspicion_score = float(suspicion_score) if suspicion_score > 0 else None
+        if is_suspicious:
+            flagged += 1
+
+    db.commit()
+    print(f"[SuspiciousDetector] Re-umbral '{sensitivity}': {flagged} sospechosas, {changed} cambios sobre {len(expenses)} transacciones")
+    return {"total": len(expenses), "suspicious_count": flagged, "changed": changed}
+
+
+def preview_sensitivity_levels(db, account_id: str = models.DEFAULT_ACCOUNT_ID) -> Dict:
+    """Cuenta cuántas transacciones quedarían marcadas con cada nivel de sensibilidad."""
+    all_features = [
+        features for (features,) in db.query(models.Expense.detector_features)
+        .filter(models.Expense.account_id == account_id)
+    ]
+    # JSON 'null' (filas anteriores a la migración 0005) cuenta como sin métricas
+    rows = [(features,) for features in all_features if features is not None]
+    without_features = len(all_features) - len(rows)
+
+    levels = {}
+    for level, config in SENSITIVITY_LEVELS.items():
+        levels[level] = sum(
+            1 for (features,) in rows
+            if score_features(features, config)[0] >= config["threshold"]
+        )
 
-    return transactions
+    return {
+        "levels": levels,
+        "total_with_features": len(rows),
+        "without_features": without_features,
+    }
+
+
+class HistoryAccumulator:
+    """Estadísticas del historial que crecen de a una transacción.
+
+    Evita reconstruir `_build_stats` sobre todo el prefijo en cada paso del reproceso
+    cronológico: `add` busca la posición de cada monto en O(log n) pero la inserción en la
+    lista ordenada es O(n) (un `memmove`, barato frente a reordenar el prefijo), y
+    `stats_for` sólo calcula las métricas del comercio y la categoría consultados.
+    """
+
+    def __init__(self):
+        self.global_amounts: List[float] = []
+        self.global_sum = 0.0
+        self.global_m2 = 0.0
+        self.category_amounts: Dict[str, List[float]] = defaultdict(list)
+        self.vendor_amounts: Dict[str, List[float]] = defaultdict(list)
+        self.vendor_types: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.vendor_categories: Dict[str, set] = defaultdict(set)
+        self.vendor_dates: Dict[str, Dict] = {}
+        self.weekday_counts: Dict[int, int] = defaultdict(int)
+
+    @property
+    def count(self) -> int:
+        return len(self.global_amounts)
+
+    def add(self, expense) -> None:
+        try:
+            amount = float(expense.amount or 0)
+        except (TypeError, ValueError):
+            return
+
+        # Media y varianza con el algoritmo de Welford
+        previous_mean = self.global_sum / self.count if self.count else 0.0
+        insort(self.global_amounts, amount)
+        self.global_sum += amount
+        self.global_m2 += (amount - previous_mean) * (amount - self.global_sum / self.count)
+
+        parsed_date = None
+        if expense.date:
+            try:
+                parsed_date = datetime.strptime(expense.date, "%Y-%m-%d")
+                self.weekday_counts[parsed_date.weekday()] += 1
+            except:
+                pass
+        if expense.category:
+            insort(self.category_amounts[expense.category], amount)
+
+        vendor_key = _normalize_vendor(expense.merchant_normalized or expense.vendor)
+        if not vendor_key:
+            return
+        insort(self.vendor_amounts[vendor_key], amount)
+        self.vendor_types[vendor_key][expense.transaction_type or "cargo"] += 1
+        if expense.merchant_category:
+            self.vendor_categories[vendor_key].add(expense.merchant_category)
+        if expense.date:
+            # La suma de intervalos entre fechas consecutivas es (última - primera),
+            # así que basta guardar los extremos para obtener el intervalo promedio.
+            dates = self.vendor_dates.setdefault(
+                vendor_key, {"last_date": None, "first": None, "last": None, "parsed": 0}
+            )
+            if dates["last_date"] is None or expense.date > dates["last_date"]:
+                dates["last_date"] = expense.date
+            if parsed_date is not None:
+                dates["parsed"] += 1
+                if dates["first"] is None or parsed_date < dates["first"]:
+                    dates["first"] = parsed_date
+                if dates["last"] is None or parsed_date > dates["last"]:
+                    dates["last"] = parsed_date
+
+    def stats_for(self, transaction: Dict) -> Dict:
+        """Estadísticas con la forma de `_build_stats`, limitadas al comercio y categoría de la transacción."""
+        vendor_key = _normalize_vendor(
+            transaction.get("merchant_normalized") or transaction.get("vendor")
+        )
+        category = transaction.get("category")
+
+        stats: Dict = {
+            "global": self._global_metrics(),
+            "categories": {},
+            "vendors": {},
+            "vendor_categories": {},
+            "vendor_frequency": {},
+            "weekday_counts": self.weekday_counts,
+        }
+        if category in self.category_amounts:
+            stats["categories"][category] = _metrics_sorted(self.category_amounts[category])
+        if vendor_key and vendor_key in self.vendor_amounts:
+            stats["vendors"][vendor_key] = {
+                **_metrics_sorted(self.vendor_amounts[vendor_key]),
+                "types": dict(self.vendor_types[vendor_key]),
+            }
+            if vendor_key in self.vendor_categories:
+                stats["vendor_categories"][vendor_key] = self.vendor_categories[vendor_key]
+            if vendor_key in self.vendor_dates:
+                dates = self.vendor_dates[vendor_key]
+                avg_interval = 0
+                if dates["parsed"] > 1:
+                    avg_interval = (dates["last"] - dates["first"]).days / (dates["parsed"] - 1)
+                stats["vendor_frequency"][vendor_key] = {
+                    "last_date": dates["last_date"],
+                    "avg_interval": avg_interval,
+                }
+        return stats
+
+    def _global_metrics(self) -> Dict[str, float]:
+        count = self.count
+        if not count:
+            return _metrics([])
+        return {
+            "count": count,
+            "mean": self.global_sum / count,
+            "std": (self.global_m2 / count) ** 0.5 if count > 1 else 0.0,
+            "median": _percentile(self.global_amounts, 0.5),
+            "p90": _percentile(self.global_amounts, 0.9),
+            "p95": _percentile(self.global_amounts, 0.95),
+        }
 
 
 def _build_stats(expenses: List[models.Expense]) -> Dict:
@@ -197,6 +699,7 @@ def _build_stats(expenses: List[models.Expense]) -> Dict:
     )
     vendor_categories: Dict[str, set] = defaultdict(set)
     vendor_frequency: Dict[str, Dict] = defaultdict(lambda: {"dates": [], "last_date": None})
+    weekday_counts: Dict[int, int] = defaultdict(int)
 
     for expense in expenses:
         try:
@@ -205,6 +708,11 @@ def _build_stats(expenses: List[models.Expense]) -> Dict:
             continue
 
         global_amounts.append(amount)
+        if expense.date:
+            try:
+                weekday_counts[datetime.strptime(expense.date, "%Y-%m-%d").weekday()] += 1
+            except:
+                pass
         if expense.category:
             category_amounts[expense.category].append(amount)
 
@@ -254,14 +762,18 @@ def _build_stats(expenses: List[models.Expense]) -> Dict:
         },
         "vendor_categories": dict(vendor_categories),
         "vendor_frequency": dict(vendor_frequency),
+        "weekday_counts": dict(weekday_counts),
     }
 
 
 def _metrics(values: List[float]) -> Dict[str, float]:
-    if not values:
+    return _metrics_sorted(sorted(values))
+
+
+def _metrics_sorted(sorted_vals: List[float]) -> Dict[str, float]:
+    if not sorted_vals:
         return {"count": 0, "mean": 0.0, "std": 0.0, "median": 0.0, "p90": 0.0, "p95": 0.0}
 
-    sorted_vals = sorted(values)
     count = len(sorted_vals)
     avg = mean(sorted_vals)
     std = _std(sorted_vals, avg)
@@ -305,39 +817,18 @@ def _normalize_vendor(name: Optional[str]) -> Optional[str]:
     return name.strip().lower()
 
 
-def _analyze_date_pattern(transaction_date: str, history: List[models.Expense], stats: Dict) -> Dict:
-    """Analiza si la fecha/horario de la transacción es inusual."""
+def _weekday_frequency(transaction_date: str, stats: Dict) -> Tuple[Optional[int], Optional[float], int]:
+    """Retorna (día de la semana, frecuencia histórica de ese día, total de fechas en el historial)."""
     try:
-        tx_datetime = datetime.strptime(transaction_date, "%Y-%m-%d")
-        tx_weekday = tx_datetime.weekday()  # 0 = lunes, 6 = domingo
-        
-        # Obtener días de la semana más comunes en el historial
-        weekday_counts = defaultdict(int)
-        for expense in history:
-            if expense.date:
-                try:
-                    exp_date = datetime.strptime(expense.date, "%Y-%m-%d")
-                    weekday_counts[exp_date.weekday()] += 1
-                except:
-                    pass
-        
-        if weekday_counts:
-            most_common_weekday = max(weekday_counts.items(), key=lambda x: x[1])[0]
-            total_transactions = sum(weekday_counts.values())
-            weekday_frequency = weekday_counts[tx_weekday] / total_transactions if total_transactions > 0 else 0
-            
-            # Si el día de la semana es muy poco frecuente (< 5% de las transacciones)
-            if weekday_frequency < 0.05 and total_transactions > 20:
-                return {
-                    "is_unusual": True,
-                    "score": 0.1,
-                    "reason": f"Transacción en {_weekday_name(tx_weekday)}, día poco frecuente en tu historial."
-                }
-    
+        tx_weekday = datetime.strptime(transaction_date, "%Y-%m-%d").weekday()  # 0 = lunes, 6 = domingo
     except:
-        pass
-    
-    return {"is_unusual": False, "score": 0.0, "reason": ""}
+        return None, None, 0
+
+    weekday_counts = stats.get("weekday_counts", {})
+    total_transactions = sum(weekday_counts.values())
+    if not total_transactions:
+        return tx_weekday, None, 0
+    return tx_weekday, weekday_counts.get(tx_weekday, 0) / total_transactions, total_transactions
 
 
 def _weekday_name(weekday: int) -> str:
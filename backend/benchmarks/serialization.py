@@ -0,0 +1,128 @@
+"""Microbenchmark de serialización de `/expenses/` y `/expenses/stats`.
+
+Uso:
+    python -m benchmarks.serialization --sizes 100 1000 10000
+    python -m benchmarks.serialization --sizes 10000 --output benchmarks/results/serialization.json
+
+Compara, sobre un historial sintético en SQLite:
+- `pydantic`: entidades ORM -> `List[schemas.Expense]` (from_attributes) -> `json.dumps`,
+  igual que `response_model` + `JSONResponse`.
+- `fast`: tuplas de `fast_json.EXPENSE_COLUMNS` -> `fast_json.expense_rows` -> `fast_json.dumps`
+  (orjson si está instalado), el camino de `FAST_JSON_RESPONSES=1`.
+Verifica que ambos produzcan el mismo JSON e informa tamaños con gzip y brotli.
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+DEFAULT_SIZES = [100, 1_000, 10_000]
+REPEAT = 5
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="Repeticiones por medición (se toma la mejor)")
+    parser.add_argument("--output", default=None, help="Ruta del reporte JSON")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    # app.database lee DATABASE_URL al importarse
+    os.environ["DATABASE_URL"] = f"sqlite:///{Path(tempfile.mkdtemp()) / 'serialization.db'}"
+    report = run(args.sizes, args.repeat, args.seed)
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(json.dumps(report, indent=2, ensure_ascii=False))
+        print(f"[Benchmark] Reporte escrito en {args.output}")
+    return 0
+
+
+def run(sizes: List[int], repeat: int, seed: int) -> Dict:
+    from pydantic import TypeAdapter
+
+    from app import models, schemas
+    from app.database import Base, SessionLocal, engine
+    from app.services import fast_json
+    from benchmarks.synthetic import generate_history
+
+    Base.metadata.create_all(bind=engine)
+    adapter = TypeAdapter(List[schemas.Expense])
+
+    def pydantic_path(db) -> bytes:
+        expenses = db.query(models.Expense).order_by(models.Expense.id).all()
+        content = adapter.dump_python(adapter.validate_python(expenses, from_attributes=True), mode="json")
+        db.expunge_all()
+        # Mismos parámetros que `JSONResponse.render`
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+    def fast_path(db) -> bytes:
+        rows = db.query(*fast_json.EXPENSE_COLUMNS).order_by(models.Expense.id)
+        return fast_json.dumps(fast_json.expense_rows(rows))
+
+    results = []
+    for size in sizes:
+        db = SessionLocal()
+        try:
+            db.query(models.Expense).delete()
+            db.bulk_insert_mappings(models.Expense, [
+                {**{k: v for k, v in tx.items() if k != "injected_anomaly"}, "is_suspicious": False,
+                 "detector_features": {"vendor_count": 3, "vendor_ratio": 1.25}}
+                for tx in generate_history(size, seed=seed)
+            ])
+            db.commit()
+
+            baseline = pydantic_path(db)
+            candidate = fast_path(db)
+            if json.loads(baseline) != json.loads(candidate):
+                print(f"[Benchmark] {size:>7} filas: la salida rápida difiere de la de Pydantic")
+                return {"benchmark": "serialization", "error": f"salida distinta con {size} filas"}
+
+            entry = {
+                "size": size,
+                "pydantic_seconds": _best_of(repeat, lambda: pydantic_path(db)),
+                "fast_seconds": _best_of(repeat, lambda: fast_path(db)),
+                "bytes": len(candidate),
+                "gzip_bytes": len(gzip.compress(candidate, compresslevel=fast_json.GZIP_LEVEL)),
+                "brotli_bytes": (
+                    len(fast_json.brotli.compress(candidate, quality=fast_json.BROTLI_QUALITY))
+                    if fast_json.brotli is not None else None
+                ),
+            }
+            entry["speedup"] = round(entry["pydantic_seconds"] / entry["fast_seconds"], 2) if entry["fast_seconds"] else None
+            results.append(entry)
+            print(
+                f"[Benchmark] {size:>7} filas | pydantic {entry['pydantic_seconds']:8.4f}s | "
+                f"rápido {entry['fast_seconds']:8.4f}s | x{entry['speedup']} | "
+                f"{entry['bytes'] / 1024:.0f} KB (gzip {entry['gzip_bytes'] / 1024:.0f} KB"
+                + (f", br {entry['brotli_bytes'] / 1024:.0f} KB)" if entry["brotli_bytes"] else ")")
+            )
+        finally:
+            db.close()
+
+    return {
+        "benchmark": "serialization",
+        "orjson": fast_json.orjson is not None,
+        "brotli": fast_json.brotli is not None,
+        "results": results,
+    }
+
+
+def _best_of(repeat: int, fn: Callable[[], bytes]) -> float:
+    best = float("inf")
+    for _ in range(max(1, repeat)):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return round(best, 5)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
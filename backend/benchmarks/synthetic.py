@@ -0,0 +1,154 @@
+"""Generador de historiales de gastos sintéticos para benchmarks del detector.
+
+Produce filas con la forma de `models.Expense`: comercios con distribución de
+potencia (pocos comercios concentran la mayoría de las compras), suscripciones
+mensuales de monto fijo, sueldo mensual, estacionalidad (diciembre y fines de
+semana) y anomalías inyectadas marcadas con `injected_anomaly=True`.
+"""
+from __future__ import annotations
+
+import random
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+VENDOR_PROFILES = [
+    # (categoría, categoría de comercio, arquetipo, monto típico CLP)
+    ("Comida", "Supermercado", "Compra en supermercado", 35000),
+    ("Comida", "Restaurante", "Consumo en restaurante", 18000),
+    ("Comida", "Comida rápida", "Compra de comida rápida", 7500),
+    ("Comida", "Cafetería", "Compra en cafetería", 3500),
+    ("Transporte", "Transporte app", "Viaje en aplicación de transporte", 6000),
+    ("Transporte", "Gasolinera", "Carga de combustible", 40000),
+    ("Salud", "Farmacia", "Compra en farmacia", 12000),
+    ("Vestimenta", "Ropa/Calzado", "Compra de ropa", 30000),
+    ("Entretenimiento", "Entretenimiento", "Gasto en entretenimiento", 15000),
+    ("Personal", "Tienda retail", "Compra en tienda retail", 20000),
+]
+
+SUBSCRIPTIONS = [
+    ("Netflix", "Entretenimiento", "Suscripción streaming", 9490),
+    ("Spotify", "Entretenimiento", "Suscripción streaming", 5990),
+    ("Gimnasio Pacific", "Salud", "Gimnasio", 29990),
+    ("Enel", "Servicios", "Servicios públicos", 42000),
+    ("Movistar", "Servicios", "Suscripción servicio", 24990),
+]
+
+SALARY_AMOUNT = 1_800_000
+
+
+def generate_history(
+    rows: int,
+    seed: int = 42,
+    vendors: Optional[int] = None,
+    anomaly_rate: float = 0.005,
+    start: date = date(2019, 1, 1),
+) -> List[Dict]:
+    """Genera `rows` transacciones ordenadas por fecha.
+
+    La cantidad de comercios crece con el tamaño (≈ raíz cuadrada de las filas) y sus
+    pesos siguen una ley de potencia (Zipf, s≈1.1). Los movimientos recurrentes
+    (suscripciones y sueldo) se distribuyen mes a mes hasta completar el período.
+    """
+    rng = random.Random(seed)
+    vendor_count = vendors or max(20, int(rows ** 0.5))
+    vendor_pool = _build_vendor_pool(rng, vendor_count)
+    weights = [1 / (rank ** 1.1) for rank in range(1, vendor_count + 1)]
+
+    # Aproximadamente 3 transacciones diarias; el período se ajusta al tamaño pedido
+    days = max(60, rows // 3)
+    months = days // 30 + 1
+    recurring_per_month = len(SUBSCRIPTIONS) + 1
+    recurring_rows = min(rows // 4, months * recurring_per_month)
+    regular_rows = rows - recurring_rows
+
+    transactions: List[Dict] = []
+
+    # Movimientos recurrentes: suscripciones de monto fijo y sueldo
+    for month_index in range(months):
+        if len(transactions) >= recurring_rows:
+            break
+        month_start = _add_months(start, month_index)
+        for vendor, category, merchant_category, amount in SUBSCRIPTIONS:
+            transactions.append(_row(
+                month_start + timedelta(days=4), amount, vendor, category, merchant_category,
+                f"Suscripción mensual a {vendor}", "cargo", is_fixed="fixed",
+            ))
+        transactions.append(_row(
+            month_start + timedelta(days=27), SALARY_AMOUNT, "Empleador SpA", "Otros",
+            "Banco/Financiera", "Salario o ingreso fijo", "abono", is_fixed="fixed",
+        ))
+    transactions = transactions[:recurring_rows]
+
+    # Compras regulares con estacionalidad
+    for _ in range(regular_rows):
+        vendor = rng.choices(vendor_pool, weights=weights, k=1)[0]
+        day = start + timedelta(days=rng.randrange(days))
+        seasonal = 1.0
+        if day.month == 12:
+            seasonal *= 1.6
+        if day.weekday() >= 5:
+            seasonal *= 1.2
+        amount = max(500, round(rng.lognormvariate(0, 0.35) * vendor["base_amount"] * seasonal))
+        transactions.append(_row(
+            day, amount, vendor["name"], vendor["category"], vendor["merchant_category"],
+            vendor["archetype"], "cargo",
+        ))
+
+    # Anomalías inyectadas: montos desproporcionados, comercios nuevos y abonos atípicos
+    anomalies = int(len(transactions) * anomaly_rate)
+    for index in rng.sample(range(len(transactions)), anomalies):
+        tx = transactions[index]
+        kind = rng.random()
+        if kind < 0.6:
+            tx["amount"] = round(tx["amount"] * rng.uniform(5, 20))
+        elif kind < 0.85:
+            tx["vendor"] = tx["merchant_normalized"] = f"Comercio Desconocido {rng.randrange(10**6)}"
+            tx["amount"] = round(tx["amount"] * rng.uniform(8, 30))
+        else:
+            tx["transaction_type"] = "abono"
+            tx["amount"] = round(tx["amount"] * rng.uniform(3, 10))
+        tx["injected_anomaly"] = True
+
+    transactions.sort(key=lambda tx: tx["date"])
+    return transactions
+
+
+def _build_vendor_pool(rng: random.Random, count: int) -> List[Dict]:
+    pool = []
+    for index in range(count):
+        category, merchant_category, archetype, base_amount = rng.choice(VENDOR_PROFILES)
+        pool.append({
+            "name": f"{merchant_category} {index:05d}",
+            "category": category,
+            "merchant_category": merchant_category,
+            "archetype": archetype,
+            "base_amount": base_amount * rng.uniform(0.6, 1.6),
+        })
+    return pool
+
+
+def _row(day: date, amount: float, vendor: str, category: str, merchant_category: str,
+         archetype: str, transaction_type: str, is_fixed: str = "variable") -> Dict:
+    return {
+        "category": category,
+        "amount": float(amount),
+        "date": day.isoformat(),
+        "vendor": vendor,
+        "description": vendor.upper(),
+        "is_fixed": is_fixed,
+        "channel": "pos",
+        "merchant_normalized": vendor,
+        "merchant_category": merchant_category,
+        "transaction_type": transaction_type,
+        "charge_archetype": archetype,
+        "charge_origin": archetype,
+        "pdf_filename": "synthetic.pdf",
+        "pdf_path": "/dev/null",
+        "analysis_method": "synthetic",
+        "injected_anomaly": False,
+    }
+
+
+def _add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
@@ -0,0 +1,11 @@
+#!/bin/bash
+set -e
+
+# Usuario de replicación para la réplica de docker-compose.replica.yml
+psql -v ON_ERROR_STOP=1 --username "$POSTGRES_USER" --dbname postgres <<-EOSQL
+    CREATE ROLE ${REPLICATION_USER} WITH REPLICATION LOGIN PASSWORD '${REPLICATION_PASSWORD}';
+EOSQL
+
+echo "host replication ${REPLICATION_USER} all scram-sha-256" >> "$PGDATA/pg_hba.conf"
+
+echo "Replication user ${REPLICATION_USER} is ready!"
@@ -0,0 +1,273 @@
+"""Servidor HTTP compatible con la API de chat de OpenAI para pruebas de carga.
+
+Responde con JSON de extracción de cartolas, con JSON de enriquecimiento indexado para
+las filas que ya leyó el parser de tablas (`openai_service._request_enrichment`) o con
+explicaciones de transacciones sospechosas, sin consumir cuota real. La latencia y la tasa de errores son
+configurables para simular un proveedor lento o inestable.
+
+Uso:
+    python -m loadtest.fake_openai --port 8100 --latency-ms 800 --jitter-ms 300 --error-rate 0.02
+    OPENAI_BASE_URL=http://localhost:8100/v1 uvicorn app.main:app
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import Counter
+from typing import Dict, List, Optional
+
+VENDORS = [
+    ("JUMBO LAS CONDES", "Jumbo", "Comida", "Supermercado", "Compra en supermercado", "variable"),
+    ("UBER TRIP", "Uber", "Transporte", "Transporte app", "Viaje en aplicación de transporte", "variable"),
+    ("NETFLIX.COM", "Netflix", "Entretenimiento", "Suscripción streaming", "Suscripción mensual de streaming", "fixed"),
+    ("MCDONALDS PROVIDENCIA", "McDonald's", "Comida", "Comida rápida", "Compra de comida rápida", "variable"),
+    ("FARMACIAS AHUMADA", "Farmacias Ahumada", "Salud", "Farmacia", "Compra en farmacia", "variable"),
+    ("COPEC", "Copec", "Transporte", "Gasolinera", "Carga de combustible", "variable"),
+    ("ENEL DISTRIBUCION", "Enel", "Servicios", "Servicios públicos", "Pago de servicios básicos", "fixed"),
+]
+
+# Líneas "índice;fecha;tipo;monto;descripción" del prompt de enriquecimiento
+ENRICHMENT_LINE = re.compile(r"^(\d+);[^;]*;[^;]*;[^;]*;(.*)$", re.MULTILINE)
+
+
+class FakeOpenAIConfig:
+    def __init__(self, latency_ms: float, jitter_ms: float, error_rate: float,
+                 rate_limit_share: float, transactions: int, seed: int, stream_chunk_delay_ms: float = 5):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_share = rate_limit_share
+        self.transactions = transactions
+        self.stream_chunk_delay_ms = stream_chunk_delay_ms
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.by_kind: Counter = Counter()
+
+    def random(self) -> float:
+        with self.lock:
+            return self.rng.random()
+
+
+def build_extraction_payload(config: FakeOpenAIConfig) -> Dict:
+    start = date.today().replace(day=1) - timedelta(days=30)
+    transactions: List[Dict] = []
+    for index in range(config.transactions):
+        raw, normalized, category, merchant_category, archetype, is_fixed = VENDORS[index % len(VENDORS)]
+        transactions.append({
+            "category": category,
+            "amount": int(2000 + config.random() * 60000),
+            "date": (start + timedelta(days=index % 28)).isoformat(),
+            "vendor": raw,
+            "description": f"COMPRA {raw}",
+            "is_fixed": is_fixed,
+            "channel": "pos",
+            "merchant_normalized": normalized,
+            "merchant_category": merchant_category,
+            "transaction_type": "cargo",
+            "charge_archetype": archetype,
+            "charge_origin": f"{archetype} en {normalized}",
+        })
+    transactions.append({
+        "category": "Otros",
+        "amount": 1500000,
+        "date": (start + timedelta(days=27)).isoformat(),
+        "vendor": "TRANSFERENCIA DE EMPLEADOR SPA",
+        "description": "ABONO REMUNERACIONES",
+        "is_fixed": "fixed",
+        "channel": None,
+        "merchant_normalized": "Empleador SpA",
+        "merchant_category": "Banco/Financiera",
+        "transaction_type": "abono",
+        "charge_archetype": "Salario o ingreso fijo",
+        "charge_origin": "Abono mensual de remuneraciones",
+    })
+    return {"transactions": transactions}
+
+
+def build_enrichment_payload(prompt: str) -> Optional[Dict]:
+    """Clasificación por índice, como la pide `_request_enrichment`; None si no es ese prompt."""
+    lines = ENRICHMENT_LINE.findall(prompt)
+    if not lines:
+        return None
+    transactions = []
+    for index, description in lines:
+        vendor = next(
+            (entry for entry in VENDORS if entry[0] in description.upper()),
+            VENDORS[int(index) % len(VENDORS)],
+        )
+        _, normalized, category, merchant_category, archetype, is_fixed = vendor
+        transactions.append({
+            "index": int(index),
+            "category": category,
+            "merchant_normalized": normalized,
+            "merchant_category": merchant_category,
+            "charge_archetype": archetype,
+            "charge_origin": f"{archetype} en {normalized}",
+            "is_fixed": is_fixed,
+            "channel": "pos",
+        })
+    return {"transactions": transactions}
+
+
+def build_completion(model: str, content: str, prompt_chars: int) -> Dict:
+    prompt_tokens = max(1, prompt_chars // 4)
+    completion_tokens = max(1, len(content) // 4)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def make_handler(config: FakeOpenAIConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):  # noqa: A002 - firma de BaseHTTPRequestHandler
+            pass
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._send_json(200, {"object": "list", "data": [{"id": "gpt-5.1", "object": "model"}]})
+            else:
+                self._send_json(404, {"error": {"message": "Not found"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            with config.lock:
+                config.requests += 1
+
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "Not found"}})
+                return
+
+            delay = max(0.0, config.latency_ms + (config.random() * 2 - 1) * config.jitter_ms) / 1000
+            time.sleep(delay)
+
+            if config.random() < config.error_rate:
+                with config.lock:
+                    config.errors += 1
+                if config.random() < config.rate_limit_share:
+                    self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}})
+                else:
+                    self._send_json(500, {"error": {"message": "Internal server error", "type": "server_error"}})
+                return
+
+            messages = body.get("messages") or []
+            prompt = "\n".join(str(message.get("content", "")) for message in messages)
+            model = body.get("model", "gpt-5.1")
+            if body.get("response_format", {}).get("type") == "json_object":
+                payload = build_enrichment_payload(prompt)
+                kind = "enrichment" if payload is not None else "extraction"
+                content = json.dumps(payload or build_extraction_payload(config), ensure_ascii=False)
+            else:
+                kind = "explanation"
+                content = (
+                    "El monto de esta transacción es considerablemente mayor a tu gasto habitual "
+                    "en este comercio, por lo que conviene revisarla."
+                )
+            with config.lock:
+                config.by_kind[kind] += 1
+            if body.get("stream"):
+                self._send_stream(model, content)
+            else:
+                self._send_json(200, build_completion(model, content, len(prompt)))
+
+        def _send_stream(self, model: str, content: str, chunk_chars: int = 40):
+            completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            for start in range(0, len(content), chunk_chars):
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "delta": {"content": content[start:start + chunk_chars]},
+                        "finish_reason": None,
+                    }],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                time.sleep(config.stream_chunk_delay_ms / 1000)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+        def _send_json(self, status: int, payload: Dict):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def serve(host: str, port: int, config: FakeOpenAIConfig) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Servidor falso compatible con OpenAI")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-ms", type=float, default=500)
+    parser.add_argument("--jitter-ms", type=float, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de respuestas con error (0-1)")
+    parser.add_argument("--rate-limit-share", type=float, default=0.5,
+                        help="Fracción de los errores que se responden como 429 (el resto como 500)")
+    parser.add_argument("--transactions", type=int, default=25, help="Transacciones por extracción")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--stream-chunk-delay-ms", type=float, default=5,
+                        help="Pausa entre fragmentos cuando se pide stream=true")
+    args = parser.parse_args()
+
+    config = FakeOpenAIConfig(
+        args.latency_ms, args.jitter_ms, args.error_rate, args.rate_limit_share, args.transactions, args.seed,
+        args.stream_chunk_delay_ms,
+    )
+    server = serve(args.host, args.port, config)
+    print(f"[FakeOpenAI] Escuchando en http://{args.host}:{args.port}/v1 "
+          f"(latencia {args.latency_ms}±{args.jitter_ms} ms, errores {args.error_rate:.0%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        kinds = ", ".join(f"{kind} {count}" for kind, count in sorted(config.by_kind.items())) or "ninguna respondida"
+        print(f"[FakeOpenAI] {config.requests} solicitudes ({kinds}), {config.errors} errores simulados")
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
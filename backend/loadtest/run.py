@@ -0,0 +1,168 @@
+"""Prueba de carga end-to-end: subidas concurrentes de PDFs y consultas del dashboard.
+
+Uso (con la API apuntando al servidor falso de OpenAI):
+    python -m loadtest.fake_openai --port 8100 &
+    OPENAI_BASE_URL=http://localhost:8100/v1 uvicorn app.main:app --port 8000 &
+    python -m loadtest.run --api http://localhost:8000 --pdf cartola.pdf --uploads 20 --upload-concurrency 4
+
+Reporta latencia p50/p95/p99, errores y throughput por endpoint, y cuántas subidas
+terminaron por cada ruta de extracción (`llm` o `table_parser`, que además pasa por el
+enriquecimiento con LLM de los comercios desconocidos).
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+POLL_ENDPOINTS = [
+    ("GET /expenses/stats", "/expenses/stats"),
+    ("GET /expenses/", "/expenses/?limit=100"),
+    ("GET /expenses/categories/list", "/expenses/categories/list"),
+]
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.extraction_paths: Dict[str, int] = defaultdict(int)
+
+    def record(self, endpoint: str, seconds: float, ok: bool) -> None:
+        with self.lock:
+            self.samples[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def record_extraction_path(self, path: str) -> None:
+        with self.lock:
+            self.extraction_paths[path] += 1
+
+    def summary(self, elapsed: float) -> Dict[str, Dict]:
+        report = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            report[endpoint] = {
+                "requests": len(ordered),
+                "errors": self.errors.get(endpoint, 0),
+                "p50_ms": round(_percentile(ordered, 0.50) * 1000, 1),
+                "p95_ms": round(_percentile(ordered, 0.95) * 1000, 1),
+                "p99_ms": round(_percentile(ordered, 0.99) * 1000, 1),
+                "max_ms": round(ordered[-1] * 1000, 1),
+                "throughput_rps": round(len(ordered) / elapsed, 2) if elapsed > 0 else None,
+            }
+        return report
+
+
+def _percentile(ordered: List[float], percentile: float) -> float:
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(percentile * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def upload_worker(client: httpx.Client, pdf: bytes, filename: str, recorder: LatencyRecorder) -> None:
+    started = time.perf_counter()
+    ok = False
+    try:
+        response = client.post("/expenses/upload", files={"file": (filename, pdf, "application/pdf")})
+        ok = response.status_code == 200
+        if ok:
+            recorder.record_extraction_path(response.json().get("extraction_path") or "unknown")
+    except httpx.HTTPError:
+        pass
+    recorder.record("POST /expenses/upload", time.perf_counter() - started, ok)
+
+
+def poll_worker(client: httpx.Client, stop: threading.Event, interval: float, recorder: LatencyRecorder) -> None:
+    while not stop.is_set():
+        for name, path in POLL_ENDPOINTS:
+            started = time.perf_counter()
+            ok = False
+            try:
+                ok = client.get(path).status_code == 200
+            except httpx.HTTPError:
+                pass
+            recorder.record(name, time.perf_counter() - started, ok)
+        stop.wait(interval)
+
+
+def run(api: str, pdf_path: Path, uploads: int, upload_concurrency: int, pollers: int,
+        poll_interval: float, timeout: float) -> Dict:
+    pdf = pdf_path.read_bytes()
+    recorder = LatencyRecorder()
+    stop = threading.Event()
+    limits = httpx.Limits(max_connections=upload_concurrency + pollers + 4)
+
+    with httpx.Client(base_url=api, timeout=timeout, limits=limits) as client:
+        poll_threads = [
+            threading.Thread(target=poll_worker, args=(client, stop, poll_interval, recorder), daemon=True)
+            for _ in range(pollers)
+        ]
+        started = time.perf_counter()
+        for thread in poll_threads:
+            thread.start()
+
+        with ThreadPoolExecutor(max_workers=upload_concurrency) as executor:
+            for index in range(uploads):
+                executor.submit(upload_worker, client, pdf, f"loadtest-{index}-{pdf_path.name}", recorder)
+
+        stop.set()
+        for thread in poll_threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+    return {
+        "api": api,
+        "pdf": str(pdf_path),
+        "uploads": uploads,
+        "upload_concurrency": upload_concurrency,
+        "pollers": pollers,
+        "elapsed_seconds": round(elapsed, 2),
+        "endpoints": recorder.summary(elapsed),
+        "extraction_paths": dict(recorder.extraction_paths),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Prueba de carga de subida de cartolas y dashboard")
+    parser.add_argument("--api", default="http://localhost:8000")
+    parser.add_argument("--pdf", required=True, type=Path, help="Cartola PDF a subir en cada request")
+    parser.add_argument("--uploads", type=int, default=20)
+    parser.add_argument("--upload-concurrency", type=int, default=4)
+    parser.add_argument("--pollers", type=int, default=4, help="Clientes simulando el polling del dashboard")
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--output", type=Path, default=None, help="Guardar el reporte en JSON")
+    args = parser.parse_args(argv)
+
+    report = run(args.api, args.pdf, args.uploads, args.upload_concurrency, args.pollers,
+                 args.poll_interval, args.timeout)
+
+    print(f"{'endpoint':<32} {'reqs':>6} {'err':>5} {'p50':>9} {'p95':>9} {'p99':>9} {'req/s':>7}")
+    for endpoint, stats in report["endpoints"].items():
+        print(
+            f"{endpoint:<32} {stats['requests']:>6} {stats['errors']:>5} "
+            f"{stats['p50_ms']:>7.0f}ms {stats['p95_ms']:>7.0f}ms {stats['p99_ms']:>7.0f}ms "
+            f"{stats['throughput_rps']:>7.2f}"
+        )
+    paths = ", ".join(f"{path} {count}" for path, count in sorted(report["extraction_paths"].items()))
+    print(f"Rutas de extracción: {paths or 'ninguna'}")
+    print(f"Duración total: {report['elapsed_seconds']}s")
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
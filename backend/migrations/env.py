@@ -0,0 +1,36 @@
+from alembic import context
+from sqlalchemy import text
+
+from app import models  # noqa: F401  registra las tablas en Base.metadata
+from app.database import Base, engine
+
+config = context.config
+target_metadata = Base.metadata
+
+# Serializa migraciones lanzadas a la vez por varios workers o réplicas de la API
+MIGRATION_LOCK_ID = 4_310_001
+
+
+def run_migrations_offline() -> None:
+    context.configure(
+        url=engine.url.render_as_string(hide_password=False),
+        target_metadata=target_metadata,
+        literal_binds=True,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    with engine.connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata)
+        with context.begin_transaction():
+            if connection.dialect.name == "postgresql":
+                connection.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": MIGRATION_LOCK_ID})
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
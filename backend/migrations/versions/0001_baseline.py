@@ -0,0 +1,149 @@
+"""Esquema base: tablas existentes y columnas que antes agregaba ensure_schema_updates
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19
+
+Las bases creadas antes de las migraciones ya tienen parte de estas tablas (vía
+`create_all` y los `ALTER TABLE` del arranque), así que esta revisión crea sólo lo que
+falta y deja la base lista para que Alembic registre la versión.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# Columnas agregadas a `expenses` después de su creación original
+LEGACY_EXPENSE_COLUMNS = (
+    ("charge_archetype", sa.String(255)),
+    ("charge_origin", sa.Text()),
+    ("is_suspicious", sa.Boolean()),
+    ("suspicious_reason", sa.Text()),
+    ("merchant_category", sa.String(255)),
+    ("suspicion_score", sa.Float()),
+    ("detector_features", sa.JSON()),
+    ("fingerprint", sa.String(64)),
+)
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+
+    if "items" not in tables:
+        op.create_table(
+            "items",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("name", sa.String(), nullable=False),
+            sa.Column("description", sa.String(), nullable=True),
+            sa.Column("price", sa.Float(), nullable=False),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True),
+        )
+        op.create_index("ix_items_id", "items", ["id"])
+        op.create_index("ix_items_name", "items", ["name"])
+
+    if "expenses" not in tables:
+        op.create_table(
+            "expenses",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("category", sa.String(), nullable=False),
+            sa.Column("amount", sa.Float(), nullable=False),
+            sa.Column("date", sa.String(), nullable=True),
+            sa.Column("vendor", sa.String(), nullable=True),
+            sa.Column("description", sa.Text(), nullable=True),
+            sa.Column("pdf_filename", sa.String(), nullable=False),
+            sa.Column("pdf_path", sa.String(), nullable=False),
+            sa.Column("analysis_method", sa.String(), nullable=True),
+            sa.Column("is_fixed", sa.String(), nullable=True),
+            sa.Column("channel", sa.String(), nullable=True),
+            sa.Column("merchant_normalized", sa.String(), nullable=True),
+            sa.Column("merchant_category", sa.String(), nullable=True),
+            sa.Column("transaction_type", sa.String(), nullable=True),
+            sa.Column("charge_archetype", sa.String(), nullable=True),
+            sa.Column("charge_origin", sa.Text(), nullable=True),
+            sa.Column("is_suspicious", sa.Boolean(), nullable=True),
+            sa.Column("suspicious_reason", sa.Text(), nullable=True),
+            sa.Column("suspicion_score", sa.Float(), nullable=True),
+            sa.Column("detector_features", sa.JSON(), nullable=True),
+            sa.Column("fingerprint", sa.String(64), nullable=True),
+            sa.Column("created_at", sa.String(), nullable=True),
+            sa.Column("updated_at", sa.String(), nullable=True),
+        )
+        op.create_index("ix_expenses_id", "expenses", ["id"])
+        op.create_index("ix_expenses_category", "expenses", ["category"])
+    else:
+        existing = {column["name"] for column in inspector.get_columns("expenses")}
+        for name, column_type in LEGACY_EXPENSE_COLUMNS:
+            if name not in existing:
+                op.add_column("expenses", sa.Column(name, column_type, nullable=True))
+
+    expense_indexes = {index["name"] for index in inspector.get_indexes("expenses")} if "expenses" in tables else set()
+    if "ix_expenses_fingerprint" not in expense_indexes:
+        op.create_index("ix_expenses_fingerprint", "expenses", ["fingerprint"], unique=True)
+
+    if "reprocess_jobs" not in tables:
+        op.create_table(
+            "reprocess_jobs",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("status", sa.String(), nullable=False),
+            sa.Column("sensitivity", sa.String(), nullable=False),
+            sa.Column("total", sa.Integer(), nullable=True),
+            sa.Column("processed", sa.Integer(), nullable=True),
+            sa.Column("suspicious_count", sa.Integer(), nullable=True),
+            sa.Column("last_date", sa.String(), nullable=True),
+            sa.Column("last_id", sa.Integer(), nullable=True),
+            sa.Column("state", sa.JSON(), nullable=True),
+            sa.Column("cancel_requested", sa.Boolean(), nullable=True),
+            sa.Column("error", sa.Text(), nullable=True),
+            sa.Column("started_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+        )
+        op.create_index("ix_reprocess_jobs_id", "reprocess_jobs", ["id"])
+
+    if "merchant_knowledge" not in tables:
+        op.create_table(
+            "merchant_knowledge",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("vendor_key", sa.String(), nullable=False),
+            sa.Column("merchant_normalized", sa.String(), nullable=True),
+            sa.Column("merchant_category", sa.String(), nullable=True),
+            sa.Column("category", sa.String(), nullable=True),
+            sa.Column("charge_archetype", sa.String(), nullable=True),
+            sa.Column("charge_origin", sa.Text(), nullable=True),
+            sa.Column("is_fixed", sa.String(), nullable=True),
+            sa.Column("channel", sa.String(), nullable=True),
+            sa.Column("occurrences", sa.Integer(), nullable=True),
+            sa.Column("source", sa.String(), nullable=True),
+            sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index("ix_merchant_knowledge_id", "merchant_knowledge", ["id"])
+        op.create_index("ix_merchant_knowledge_vendor_key", "merchant_knowledge", ["vendor_key"], unique=True)
+
+    if "ingested_files" not in tables:
+        op.create_table(
+            "ingested_files",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("content_hash", sa.String(64), nullable=False),
+            sa.Column("filename", sa.String(), nullable=False),
+            sa.Column("path", sa.String(), nullable=False),
+            sa.Column("transactions", sa.Integer(), nullable=True),
+            sa.Column("pages", sa.Integer(), nullable=True),
+            sa.Column("seconds", sa.Float(), nullable=True),
+            sa.Column("ingested_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index("ix_ingested_files_id", "ingested_files", ["id"])
+        op.create_index("ix_ingested_files_content_hash", "ingested_files", ["content_hash"], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_table("ingested_files")
+    op.drop_table("merchant_knowledge")
+    op.drop_table("reprocess_jobs")
+    op.drop_table("expenses")
+    op.drop_table("items")
@@ -0,0 +1,51 @@
+"""Índices para los filtros y la búsqueda de /expenses/
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+# Debe coincidir con `expense_filters.search_document()` para que el planner use el índice
+SEARCH_DOCUMENT = (
+    "coalesce(vendor, '') || ' ' || coalesce(description, '') || ' ' || coalesce(charge_origin, '')"
+)
+
+
+def upgrade() -> None:
+    op.create_index("ix_expenses_date", "expenses", ["date"])
+    op.create_index("ix_expenses_amount", "expenses", ["amount"])
+    op.create_index("ix_expenses_merchant_normalized", "expenses", ["merchant_normalized"])
+    op.create_index("ix_expenses_vendor", "expenses", ["vendor"])
+    op.create_index("ix_expenses_created_at", "expenses", ["created_at"])
+    op.create_index(
+        "ix_expenses_suspicious_date",
+        "expenses",
+        ["date"],
+        postgresql_where=sa.text("is_suspicious = true"),
+        sqlite_where=sa.text("is_suspicious = 1"),
+    )
+
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute(
+            f"CREATE INDEX ix_expenses_search_trgm ON expenses USING gin (({SEARCH_DOCUMENT}) gin_trgm_ops)"
+        )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("DROP INDEX IF EXISTS ix_expenses_search_trgm")
+    op.drop_index("ix_expenses_suspicious_date", table_name="expenses")
+    op.drop_index("ix_expenses_created_at", table_name="expenses")
+    op.drop_index("ix_expenses_vendor", table_name="expenses")
+    op.drop_index("ix_expenses_merchant_normalized", table_name="expenses")
+    op.drop_index("ix_expenses_amount", table_name="expenses")
+    op.drop_index("ix_expenses_date", table_name="expenses")
@@ -0,0 +1,26 @@
+"""Columna charge_class precalculada para el resumen de tipos de cargo
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19
+
+Las filas existentes se clasifican al arrancar la API (`charge_classifier.start_rebuild`).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("expenses", sa.Column("charge_class", sa.String(32), nullable=True))
+    op.create_index("ix_expenses_charge_class", "expenses", ["charge_class"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_expenses_charge_class", table_name="expenses")
+    op.drop_column("expenses", "charge_class")
@@ -0,0 +1,126 @@
+"""Cuentas: account_id en expenses (particionada por hash en PostgreSQL) y ajustes por cuenta
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19
+
+Las filas existentes quedan en la cuenta `default`. En PostgreSQL `expenses` se
+reconstruye como tabla particionada por `HASH (account_id)` con `EXPENSE_PARTITIONS`
+particiones (8 por defecto): se copia la tabla completa, así que en bases grandes
+conviene correrla en una ventana de mantención. La clave primaria pasa a ser
+`(account_id, id)` y el fingerprint es único por cuenta, porque los índices únicos de una
+tabla particionada deben incluir la clave de partición. En otros motores sólo se agrega
+la columna y se ajustan los índices.
+"""
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+PARTITIONS = int(os.getenv("EXPENSE_PARTITIONS", "8"))
+DEFAULT_ACCOUNT_ID = "default"
+
+# Debe coincidir con `expense_filters.search_document()` (ver migración 0002)
+SEARCH_DOCUMENT = (
+    "coalesce(vendor, '') || ' ' || coalesce(description, '') || ' ' || coalesce(charge_origin, '')"
+)
+EXPENSE_COLUMN_INDEXES = ("id", "category", "amount", "date", "vendor", "merchant_normalized", "created_at", "charge_class")
+
+
+def _account_column() -> sa.Column:
+    return sa.Column("account_id", sa.String(64), nullable=False, server_default=DEFAULT_ACCOUNT_ID)
+
+
+def upgrade() -> None:
+    op.add_column("expenses", _account_column())
+    if op.get_bind().dialect.name == "postgresql":
+        _rebuild_expenses(PARTITIONS)
+    else:
+        op.drop_index("ix_expenses_fingerprint", table_name="expenses")
+        op.create_index("ix_expenses_account_fingerprint", "expenses", ["account_id", "fingerprint"], unique=True)
+        op.create_index("ix_expenses_account_date", "expenses", ["account_id", "date"])
+
+    op.add_column("reprocess_jobs", _account_column())
+    op.create_index("ix_reprocess_jobs_account_id", "reprocess_jobs", ["account_id"])
+
+    op.add_column("ingested_files", _account_column())
+    op.drop_index("ix_ingested_files_content_hash", table_name="ingested_files")
+    op.create_index("ix_ingested_files_account_hash", "ingested_files", ["account_id", "content_hash"], unique=True)
+
+    op.create_table(
+        "account_settings",
+        sa.Column("account_id", sa.String(64), primary_key=True),
+        sa.Column("sensitivity", sa.String(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+
+
+def downgrade() -> None:
+    # Sólo funciona si los fingerprints no se repiten entre cuentas
+    op.drop_table("account_settings")
+
+    op.drop_index("ix_ingested_files_account_hash", table_name="ingested_files")
+    op.create_index("ix_ingested_files_content_hash", "ingested_files", ["content_hash"], unique=True)
+    with op.batch_alter_table("ingested_files") as batch:
+        batch.drop_column("account_id")
+
+    op.drop_index("ix_reprocess_jobs_account_id", table_name="reprocess_jobs")
+    with op.batch_alter_table("reprocess_jobs") as batch:
+        batch.drop_column("account_id")
+
+    if op.get_bind().dialect.name == "postgresql":
+        _rebuild_expenses(0)
+    else:
+        op.drop_index("ix_expenses_account_date", table_name="expenses")
+        op.drop_index("ix_expenses_account_fingerprint", table_name="expenses")
+        op.create_index("ix_expenses_fingerprint", "expenses", ["fingerprint"], unique=True)
+    with op.batch_alter_table("expenses") as batch:
+        batch.drop_column("account_id")
+
+
+def _rebuild_expenses(partitions: int) -> None:
+    """Copia `expenses` a una tabla nueva (particionada si `partitions` > 0) y la reemplaza.
+
+    La secuencia de `id` se desliga de la tabla antigua antes de borrarla para que la
+    nueva, que la usa como default, la conserve.
+    """
+    bind = op.get_bind()
+    if partitions:
+        op.execute("CREATE TABLE expenses_new (LIKE expenses INCLUDING DEFAULTS) PARTITION BY HASH (account_id)")
+        op.execute("ALTER TABLE expenses_new ADD CONSTRAINT expenses_new_pkey PRIMARY KEY (account_id, id)")
+        for remainder in range(partitions):
+            op.execute(
+                f"CREATE TABLE expenses_p{remainder} PARTITION OF expenses_new "
+                f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+            )
+    else:
+        op.execute("CREATE TABLE expenses_new (LIKE expenses INCLUDING DEFAULTS)")
+        op.execute("ALTER TABLE expenses_new ADD CONSTRAINT expenses_new_pkey PRIMARY KEY (id)")
+    op.execute("INSERT INTO expenses_new SELECT * FROM expenses")
+
+    sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence('expenses', 'id')")).scalar()
+    if sequence:
+        op.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+    op.execute("DROP TABLE expenses")
+    op.execute("ALTER TABLE expenses_new RENAME TO expenses")
+    op.execute("ALTER TABLE expenses RENAME CONSTRAINT expenses_new_pkey TO expenses_pkey")
+    if sequence:
+        op.execute(f"ALTER SEQUENCE {sequence} OWNED BY expenses.id")
+
+    for column in EXPENSE_COLUMN_INDEXES:
+        op.create_index(f"ix_expenses_{column}", "expenses", [column])
+    if partitions:
+        op.create_index("ix_expenses_account_fingerprint", "expenses", ["account_id", "fingerprint"], unique=True)
+        op.create_index("ix_expenses_account_date", "expenses", ["account_id", "date"])
+    else:
+        op.create_index("ix_expenses_fingerprint", "expenses", ["fingerprint"], unique=True)
+    op.create_index(
+        "ix_expenses_suspicious_date", "expenses", ["date"], postgresql_where=sa.text("is_suspicious = true")
+    )
+    op.execute(f"CREATE INDEX ix_expenses_search_trgm ON expenses USING gin (({SEARCH_DOCUMENT}) gin_trgm_ops)")
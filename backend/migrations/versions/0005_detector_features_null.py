@@ -0,0 +1,27 @@
+"""detector_features sin métricas como NULL de SQL en vez de JSON 'null'
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19
+
+Hasta ahora `Column(JSON)` guardaba `None` como el literal JSON `null`, que no cumple
+`IS NULL`, y `rescore_from_features` / `preview_sensitivity_levels` intentaban puntuar
+esas filas. El modelo usa ahora `JSON(none_as_null=True)`; esta migración normaliza las
+filas existentes.
+"""
+from alembic import op
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("UPDATE expenses SET detector_features = NULL WHERE CAST(detector_features AS TEXT) = 'null'")
+
+
+def downgrade() -> None:
+    # NULL y JSON 'null' significan lo mismo para el código anterior
+    pass
@@ -0,0 +1,23 @@
+"""run_id en reprocess_jobs para que un trabajo tenga un solo runner
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("reprocess_jobs", sa.Column("run_id", sa.String(32), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("reprocess_jobs") as batch:
+        batch.drop_column("run_id")
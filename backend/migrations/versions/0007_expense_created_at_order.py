@@ -0,0 +1,33 @@
+"""created_at poblado e índice (account_id, created_at, id) para el listado paginado
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19
+"""
+from datetime import datetime, timezone
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Ningún insert fijaba created_at: las filas existentes quedan con la hora de la
+    # migración (el desempate por id conserva su orden) para que no se mezclen NULLs, que
+    # PostgreSQL ordena primero en DESC, con las filas nuevas
+    op.get_bind().execute(
+        sa.text("UPDATE expenses SET created_at = :now WHERE created_at IS NULL"),
+        {"now": datetime.now(timezone.utc).isoformat()},
+    )
+    op.drop_index("ix_expenses_created_at", table_name="expenses")
+    op.create_index("ix_expenses_account_created", "expenses", ["account_id", "created_at", "id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_expenses_account_created", table_name="expenses")
+    op.create_index("ix_expenses_created_at", "expenses", ["created_at"])
@@ -0,0 +1,39 @@
+"""account_id en merchant_knowledge: diccionario de comercios por cuenta
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+DEFAULT_ACCOUNT_ID = "default"
+
+
+def upgrade() -> None:
+    # Las entradas de historial mezclaban los comercios de todas las cuentas; se borran y
+    # `merchant_dictionary` las reconstruye por cuenta en la primera consulta. Las
+    # correcciones del usuario quedan en la cuenta por defecto, como las filas de 0004.
+    op.execute("DELETE FROM merchant_knowledge WHERE source IS NULL OR source <> 'user'")
+    op.add_column(
+        "merchant_knowledge",
+        sa.Column("account_id", sa.String(64), nullable=False, server_default=DEFAULT_ACCOUNT_ID),
+    )
+    op.drop_index("ix_merchant_knowledge_vendor_key", table_name="merchant_knowledge")
+    op.create_index(
+        "ix_merchant_knowledge_account_vendor", "merchant_knowledge", ["account_id", "vendor_key"], unique=True
+    )
+
+
+def downgrade() -> None:
+    # Sólo funciona si ningún comercio quedó en más de una cuenta
+    op.drop_index("ix_merchant_knowledge_account_vendor", table_name="merchant_knowledge")
+    op.create_index("ix_merchant_knowledge_vendor_key", "merchant_knowledge", ["vendor_key"], unique=True)
+    with op.batch_alter_table("merchant_knowledge") as batch:
+        batch.drop_column("account_id")
@@ -0,0 +1,29 @@
+"""fingerprint de las filas anteriores a la deduplicación, una sola vez
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-19
+
+Antes se calculaba en cada arranque (`startup_event`), y como las filas sin clave posible
+(sin fecha o con extracción fallida) nunca lo reciben, cada worker volvía a recorrer la
+tabla al iniciar. Las filas nuevas ya llegan con fingerprint desde `expense_store`.
+"""
+from alembic import op
+from sqlalchemy.orm import Session
+
+from app.services import expense_store
+
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    expense_store.backfill_fingerprints(Session(bind=op.get_bind()))
+
+
+def downgrade() -> None:
+    # Los fingerprints calculados son válidos también para el código anterior
+    pass
@@ -0,0 +1,24 @@
+"""merchants_built_at en account_settings: diccionario de comercios ya reconstruido
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Sin marca, cada cuenta reconstruye su diccionario una vez en la primera consulta
+    op.add_column("account_settings", sa.Column("merchants_built_at", sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("account_settings") as batch:
+        batch.drop_column("merchants_built_at")
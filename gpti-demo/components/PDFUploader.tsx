@@ -1,7 +1,14 @@
 "use client";
 
 import { useState, useCallback } from "react";
-import { uploadPDF } from "@/lib/api";
+import { uploadPDFStream } from "@/lib/api";
+
+const STAGE_LABELS: Record<string, string> = {
+  docling: "Leyendo PDF",
+  llm: "Extrayendo transacciones",
+  detection: "Detectando movimientos sospechosos",
+  persistence: "Guardando",
+};
 
 interface PDFUploaderProps {
   onUploadSuccess: () => void;
@@ -12,6 +19,7 @@ export default function PDFUploader({ onUploadSuccess }: PDFUploaderProps) {
   const [isUploading, setIsUploading] = useState(false);
   const [error, setError] = useState<string | null>(null);
   const [successMessage, setSuccessMessage] = useState<string | null>(null);
+  const [progress, setProgress] = useState<{ stage: string; received: number }>({ stage: "", received: 0 });
 
   const handleDragOver = useCallback((e: React.DragEvent) => {
     e.preventDefault();
@@ -65,8 +73,22 @@ export default function PDFUploader({ onUploadSuccess }: PDFUploaderProps) {
     setSuccessMessage(null);
 
     try {
-      const result = await uploadPDF(file);
-      setSuccessMessage(`${result.count} transacciones procesadas correctamente`);
+      setProgress({ stage: "Subiendo archivo", received: 0 });
+      const result = await uploadPDFStream(file, ({ event, data }) => {
+        if (event === "stage" && data.status === "started") {
+          const label = STAGE_LABELS[data.stage] || data.stage;
+          const pages = data.pages && data.total_pages
+            ? ` (páginas ${data.pages[0]}–${data.pages[1]} de ${data.total_pages})`
+            : "";
+          setProgress((current) => ({ ...current, stage: `${label}${pages}` }));
+        } else if (event === "transaction") {
+          setProgress((current) => ({ ...current, received: current.received + 1 }));
+        }
+      });
+      const duplicates = result.duplicates_skipped
+        ? ` (${result.duplicates_skipped} ya registradas se omitieron)`
+        : "";
+      setSuccessMessage(`${result.count} transacciones procesadas correctamente${duplicates}`);
       setTimeout(() => {
         onUploadSuccess();
         setSuccessMessage(null);
@@ -118,7 +140,10 @@ export default function PDFUploader({ onUploadSuccess }: PDFUploaderProps) {
             {isUploading ? (
               <div className="flex items-center justify-center gap-2">
                 <div className="w-5 h-5 border-2 border-blue-500 border-t-transparent rounded-full animate-spin"></div>
-                <span>Analizando PDF...</span>
+                <span>
+                  {progress.stage || "Analizando PDF"}...
+                  {progress.received > 0 && ` ${progress.received} transacciones recibidas`}
+                </span>
               </div>
             ) : (
               <>
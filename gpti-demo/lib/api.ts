@@ -34,11 +34,101 @@ export async function uploadPDF(file: File): Promise<{
   }
 }
 
-export async function getExpenses(category?: string): Promise<Expense[]> {
+export interface UploadStreamEvent {
+  event: "stage" | "transaction" | "detection" | "done" | "error";
+  data: any;
+}
+
+export async function uploadPDFStream(
+  file: File,
+  onEvent: (event: UploadStreamEvent) => void
+): Promise<{ success: boolean; message: string; count: number; duplicates_skipped?: number; pdf_filename: string }> {
+  const formData = new FormData();
+  formData.append("file", file);
+
+  let response: Response;
+  try {
+    response = await fetch(`${API_BASE_URL}/expenses/upload/stream`, {
+      method: "POST",
+      body: formData,
+    });
+  } catch (error) {
+    if (error instanceof TypeError && error.message === "Failed to fetch") {
+      throw new Error(
+        `No se puede conectar al backend en ${API_BASE_URL}. Asegúrate de que el backend esté corriendo.`
+      );
+    }
+    throw error;
+  }
+
+  if (!response.ok || !response.body) {
+    const error = await response.json().catch(() => ({}));
+    throw new Error(error.detail || "Failed to upload PDF");
+  }
+
+  // Parsear server-sent events a medida que llegan
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let result: any = null;
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let separator = buffer.indexOf("\n\n");
+    while (separator !== -1) {
+      const raw = buffer.slice(0, separator);
+      buffer = buffer.slice(separator + 2);
+      separator = buffer.indexOf("\n\n");
+
+      let eventName = "message";
+      let data = "";
+      for (const line of raw.split("\n")) {
+        if (line.startsWith("event: ")) eventName = line.slice(7);
+        else if (line.startsWith("data: ")) data += line.slice(6);
+      }
+      const event = { event: eventName, data: data ? JSON.parse(data) : null } as UploadStreamEvent;
+      if (event.event === "error") {
+        throw new Error(event.data?.detail || "Failed to upload PDF");
+      }
+      if (event.event === "done") {
+        result = event.data;
+      }
+      onEvent(event);
+    }
+  }
+
+  if (!result) {
+    throw new Error("La conexión se cerró antes de terminar el análisis");
+  }
+  return result;
+}
+
+export interface ExpenseFilters {
+  vendor?: string;
+  date_from?: string;
+  date_to?: string;
+  min_amount?: number;
+  max_amount?: number;
+  transaction_type?: "cargo" | "abono";
+  is_suspicious?: boolean;
+  q?: string;
+  skip?: number;
+  limit?: number;
+}
+
+export async function getExpenses(category?: string, filters: ExpenseFilters = {}): Promise<Expense[]> {
   const url = new URL(`${API_BASE_URL}/expenses/`);
   if (category) {
     url.searchParams.append("category", category);
   }
+  Object.entries(filters).forEach(([key, value]) => {
+    if (value !== undefined && value !== null && value !== "") {
+      url.searchParams.append(key, String(value));
+    }
+  });
 
   try {
     const response = await fetch(url.toString());
@@ -141,7 +231,7 @@ export async function getSensitivity(): Promise<{ sensitivity: string }> {
   return response.json();
 }
 
-export async function setSensitivity(sensitivity: "conservative" | "standard" | "strict"): Promise<{ sensitivity: string; message: string }> {
+export async function setSensitivity(sensitivity: "conservative" | "standard" | "strict"): Promise<{ sensitivity: string; message: string; suspicious_count: number; changed: number }> {
   const response = await fetch(`${API_BASE_URL}/settings/sensitivity`, {
     method: "POST",
     headers: {
@@ -156,6 +246,19 @@ export async function setSensitivity(sensitivity: "conservative" | "standard" |
   return response.json();
 }
 
+export async function getSensitivityPreview(): Promise<{
+  levels: { conservative: number; standard: number; strict: number };
+  total_with_features: number;
+  without_features: number;
+  current: string;
+}> {
+  const response = await fetch(`${API_BASE_URL}/expenses/suspicious/preview`);
+  if (!response.ok) {
+    throw new Error("Failed to fetch sensitivity preview");
+  }
+  return response.json();
+}
+
 export async function deleteAllExpenses(): Promise<{ message: string; transactions_deleted: number; files_deleted: number }> {
   const response = await fetch(`${API_BASE_URL}/expenses/clear/all`, {
     method: "DELETE",
@@ -167,7 +270,39 @@ export async function deleteAllExpenses(): Promise<{ message: string; transactio
   return response.json();
 }
 
-export async function reprocessSuspiciousFlags(): Promise<{ message: string; total: number; suspicious_count: number }> {
+export interface ReprocessJobProgress {
+  job_id: number;
+  status: "pending" | "running" | "completed" | "failed" | "cancelled";
+  total: number;
+  processed: number;
+  percent: number;
+  suspicious_count: number;
+  throughput_per_second: number | null;
+  eta_seconds: number | null;
+  error: string | null;
+}
+
+export async function getReprocessJob(jobId: number): Promise<ReprocessJobProgress> {
+  const response = await fetch(`${API_BASE_URL}/expenses/reprocess-suspicious/jobs/${jobId}`);
+  if (!response.ok) {
+    throw new Error("Failed to fetch reprocess job");
+  }
+  return response.json();
+}
+
+export async function cancelReprocessJob(jobId: number): Promise<ReprocessJobProgress> {
+  const response = await fetch(`${API_BASE_URL}/expenses/reprocess-suspicious/jobs/${jobId}/cancel`, {
+    method: "POST",
+  });
+  if (!response.ok) {
+    throw new Error("Failed to cancel reprocess job");
+  }
+  return response.json();
+}
+
+export async function reprocessSuspiciousFlags(
+  onProgress?: (progress: ReprocessJobProgress) => void
+): Promise<{ message: string; total: number; suspicious_count: number }> {
   const response = await fetch(`${API_BASE_URL}/expenses/reprocess-suspicious`, {
     method: "POST",
   });
@@ -175,5 +310,24 @@ export async function reprocessSuspiciousFlags(): Promise<{ message: string; tot
     const error = await response.json();
     throw new Error(error.detail || "Failed to reprocess suspicious flags");
   }
-  return response.json();
+  const started = await response.json();
+  if (started.job_id === undefined) {
+    return started;
+  }
+
+  // El reproceso corre en segundo plano: consultar el progreso hasta que termine
+  let progress: ReprocessJobProgress = started;
+  while (progress.status === "pending" || progress.status === "running") {
+    onProgress?.(progress);
+    await new Promise((resolve) => setTimeout(resolve, 1500));
+    progress = await getReprocessJob(progress.job_id);
+  }
+  if (progress.status === "failed") {
+    throw new Error(progress.error || "Failed to reprocess suspicious flags");
+  }
+  return {
+    message: progress.status === "cancelled" ? "Reproceso cancelado" : "Transacciones reprocesadas exitosamente",
+    total: progress.total,
+    suspicious_count: progress.suspicious_count,
+  };
 }
@@ -40,6 +40,7 @@ export interface ExpenseUpdate {
   merchant_category?: string | null;
   transaction_type?: 'cargo' | 'abono';
   charge_archetype?: string | null;
+  charge_class?: "suscripciones" | "compras_diarias" | "pagos_excepcionales" | "otros" | null;
   charge_origin?: string | null;
   is_suspicious?: boolean;
   suspicious_reason?: string | null;